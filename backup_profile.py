@@ -1,6 +1,9 @@
 import os
 from pathlib import Path
 
+from compressor import CODECS
+from rules import RuleSet, escapeGlob
+
 class Profile:
     """
     ## Profile
@@ -26,12 +29,44 @@ class Profile:
             raise KeyError(f'Missing Profile Attributes: {missingAttributes}')
         # optional/generated attributes
         self.description = map.get('description')
+        self.copyWorkers = self.parseInteger(map, 'copyWorkers', 4, minimum=1)
+        self.scanWorkers = self.parseInteger(map, 'scanWorkers', 1, minimum=1)
+        self.indexFormat = self.parseChoice(map, 'indexFormat', ['text', 'binary'])
+        self.changeDetection = self.parseChoice(map, 'changeDetection', ['mtime', 'hash'])
+        self.copyBackend = self.parseChoice(map, 'copyBackend', ['kernel', 'shutil'])
+        self.deltaThreshold = self.parseSize(map, 'deltaThreshold', 0)
+        self.deltaBlockSize = self.parseSize(map, 'deltaBlockSize', 1024 * 1024, minimum=4096)
+        self.propagateDeletes = self.parseBoolean(map, 'propagateDeletes', False)
+        self.deleteDryRun = self.parseBoolean(map, 'deleteDryRun', False)
+        self.fastIncremental = self.parseBoolean(map, 'fastIncremental', False)
+        self.changeJournal = self.parseBoolean(map, 'changeJournal', False)
+        self.fullScanInterval = self.parseInteger(map, 'fullScanInterval', 24)
+        self.runReports = self.parseBoolean(map, 'runReports', True)
+        self.packThreshold = self.parseSize(map, 'packThreshold', 0)
+        self.dedup = self.parseBoolean(map, 'dedup', False)
+        self.dedupChunkSize = self.parseSize(map, 'dedupChunkSize', 1024 * 1024, minimum=4096)
+        self.dedupStore = map.get('dedupStore')
+        self.compression = self.parseChoice(map, 'compression', ['none', 'zlib', 'lzma', 'bz2', 'zstd'])
+        self.compressionLevel = self.parseInteger(map, 'compressionLevel', None)
+        self.history = self.parseChoice(map, 'history', ['none', 'increments', 'snapshots'])
+        self.historyKeep = self.parseInteger(map, 'historyKeep', 0)
+        self.historyDays = self.parseInteger(map, 'historyDays', 0)
+        self.checkpoints = self.parseBoolean(map, 'checkpoints', False)
+        self.checkpointInterval = self.parseInteger(map, 'checkpointInterval', 30, minimum=1)
+        self.maxBytesPerSecond = self.parseSize(map, 'maxBytesPerSecond', 0)
+        self.maxFilesPerSecond = self.parseInteger(map, 'maxFilesPerSecond', 0)
+        self.adaptiveThrottle = self.parseBoolean(map, 'adaptiveThrottle', False)
+        if (self.compressionLevel != None and self.compression != 'none' and self.compressionLevel not in CODECS.get(self.compression).levels):
+            levels = CODECS.get(self.compression).levels
+            raise ValueError(f"Profile attribute 'compressionLevel' must be from {levels.start} to {levels.stop - 1} for {self.compression}: {self.compressionLevel}")
         self.executable = self.isExecutable()
         try:
             if self.executable:
                 self.blacklist = self.generateBlacklist(map.get('blacklist'))
+                self.rules = self.generateRules(map)
             else:
                 self.blacklist = []
+                self.rules = None
         except FileNotFoundError:
             print(f"FileNotFoundError for profile {map}")
             raise FileNotFoundError
@@ -57,6 +92,130 @@ class Profile:
                     continue
         return blacklist
 
+    def generateRules(self, map: dict[str, str]) -> RuleSet:
+        """
+        Returns the include and exclude rules of the profile compiled into a
+        RuleSet, or None if it has none. Blacklisted directories come first,
+        as rules excluding those children of the original path, then the
+        `rules` attribute (separated by `;`), then the lines of `rulesFile`.
+
+        @type map: dict[str, str]
+        @param map: Dictionary of profile objects being parsed.
+        """
+        rules = [f"exclude /{escapeGlob(name)}/" for name in self.blacklist]
+        if (map.get('rules') != None):
+            rules.extend(rule.strip() for rule in map.get('rules').split(';') if rule.strip() != '')
+        if (map.get('rulesFile') != None):
+            with open(map.get('rulesFile'),'r') as rulesFile:
+                rules.extend(line.strip() for line in rulesFile if line.strip() != '' and not line.startswith('#'))
+        if (len(rules) == 0):
+            return None
+        try:
+            return RuleSet(rules)
+        except ValueError as error:
+            raise ValueError(f"Profile attribute 'rules' is invalid: {error}")
+
+    def parseInteger(self, map: dict[str, str], key: str, default: int, minimum: int = 0) -> int:
+        """
+        Returns the integer value of an optional profile attribute, or the
+        default if the attribute is not present.
+
+        @type map: dict[str, str]
+        @param map: Dictionary of profile objects being parsed.
+        @type key: str
+        @param key: Name of the profile attribute.
+        @type default: int
+        @param default: Value to use when the attribute is not present.
+        @type minimum: int
+        @param minimum: Smallest accepted value.
+            (default is 0)
+        """
+        value = map.get(key)
+        if (value == None or value.strip() == ''):
+            return default
+        try:
+            number = int(value.strip())
+        except ValueError:
+            raise ValueError(f"Profile attribute '{key}' must be an integer: {value}")
+        if (number < minimum):
+            raise ValueError(f"Profile attribute '{key}' must be at least {minimum}: {value}")
+        return number
+
+    def parseSize(self, map: dict[str, str], key: str, default: int, minimum: int = 0) -> int:
+        """
+        Returns the size in bytes of an optional profile attribute, or the default
+        if the attribute is not present. Sizes may end with a `K`, `M`, `G` or `T`
+        unit (powers of 1024).
+
+        @type map: dict[str, str]
+        @param map: Dictionary of profile objects being parsed.
+        @type key: str
+        @param key: Name of the profile attribute.
+        @type default: int
+        @param default: Value to use when the attribute is not present.
+        @type minimum: int
+        @param minimum: Smallest accepted value (other than 0).
+            (default is 0)
+        """
+        units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+        value = map.get(key)
+        if (value == None or value.strip() == ''):
+            return default
+        number = value.strip().upper().rstrip('B')
+        multiplier = 1
+        if (number[-1:] in units):
+            multiplier = units.get(number[-1])
+            number = number[:-1]
+        try:
+            size = int(float(number) * multiplier)
+        except ValueError:
+            raise ValueError(f"Profile attribute '{key}' must be a size: {value}")
+        if (size < 0 or (size != 0 and size < minimum)):
+            raise ValueError(f"Profile attribute '{key}' must be at least {minimum} bytes: {value}")
+        return size
+
+    def parseChoice(self, map: dict[str, str], key: str, choices: list[str]) -> str:
+        """
+        Returns the value of an optional profile attribute that must be one of
+        the given choices. The first choice is the default.
+
+        @type map: dict[str, str]
+        @param map: Dictionary of profile objects being parsed.
+        @type key: str
+        @param key: Name of the profile attribute.
+        @type choices: list[str]
+        @param choices: Accepted values, starting with the default.
+        """
+        value = map.get(key)
+        if (value == None or value.strip() == ''):
+            return choices[0]
+        value = value.strip().lower()
+        if (value not in choices):
+            raise ValueError(f"Profile attribute '{key}' must be one of {choices}: {value}")
+        return value
+
+    def parseBoolean(self, map: dict[str, str], key: str, default: bool) -> bool:
+        """
+        Returns the value of an optional yes/no profile attribute, or the default
+        if the attribute is not present. Accepts `true`/`false`, `yes`/`no` and `1`/`0`.
+
+        @type map: dict[str, str]
+        @param map: Dictionary of profile objects being parsed.
+        @type key: str
+        @param key: Name of the profile attribute.
+        @type default: bool
+        @param default: Value to use when the attribute is not present.
+        """
+        value = map.get(key)
+        if (value == None or value.strip() == ''):
+            return default
+        value = value.strip().lower()
+        if (value in ['true', 'yes', '1']):
+            return True
+        if (value in ['false', 'no', '0']):
+            return False
+        raise ValueError(f"Profile attribute '{key}' must be true or false: {value}")
+
     def getName(self) -> str:
         return self.name
     
@@ -71,6 +230,107 @@ class Profile:
     
     def getBlacklist(self) -> str:
         return self.blacklist
+
+    def getRules(self) -> RuleSet:
+        return self.rules
+
+    def getCopyWorkers(self) -> int:
+        return self.copyWorkers
+
+    def getScanWorkers(self) -> int:
+        return self.scanWorkers
+
+    def getIndexFormat(self) -> str:
+        return self.indexFormat
+
+    def getChangeDetection(self) -> str:
+        return self.changeDetection
+
+    def getCopyBackend(self) -> str:
+        return self.copyBackend
+
+    def getDeltaThreshold(self) -> int:
+        return self.deltaThreshold
+
+    def getDeltaBlockSize(self) -> int:
+        return self.deltaBlockSize
+
+    def getPropagateDeletes(self) -> bool:
+        return self.propagateDeletes
+
+    def getDeleteDryRun(self) -> bool:
+        return self.deleteDryRun
+
+    def getFastIncremental(self) -> bool:
+        return self.fastIncremental
+
+    def getChangeJournal(self) -> bool:
+        return self.changeJournal
+
+    def getFullScanInterval(self) -> int:
+        return self.fullScanInterval
+
+    def getRunReports(self) -> bool:
+        return self.runReports
+
+    def getPackThreshold(self) -> int:
+        return self.packThreshold
+
+    def getDedup(self) -> bool:
+        return self.dedup
+
+    def getDedupChunkSize(self) -> int:
+        return self.dedupChunkSize
+
+    def getDedupStore(self) -> str:
+        """
+        Returns the directory of the chunk store, shared by every profile that
+        uses the same one. Defaults to a directory inside the metadata directory.
+        """
+        if (self.dedupStore == None or self.dedupStore.strip() == ''):
+            return os.path.join(self.getMetadataPath(), 'store')
+        return os.path.realpath(self.dedupStore.strip())
+
+    def getCompression(self) -> str:
+        return self.compression
+
+    def getCompressionLevel(self) -> int:
+        """
+        Returns the compression level of the profile, or None for the default
+        level of the codec.
+        """
+        return self.compressionLevel
+
+    def getHistory(self) -> str:
+        return self.history
+
+    def getHistoryKeep(self) -> int:
+        return self.historyKeep
+
+    def getHistoryDays(self) -> int:
+        return self.historyDays
+
+    def getCheckpoints(self) -> bool:
+        return self.checkpoints
+
+    def getCheckpointInterval(self) -> int:
+        return self.checkpointInterval
+
+    def getMaxBytesPerSecond(self) -> int:
+        return self.maxBytesPerSecond
+
+    def getMaxFilesPerSecond(self) -> int:
+        return self.maxFilesPerSecond
+
+    def getAdaptiveThrottle(self) -> bool:
+        return self.adaptiveThrottle
+
+    def getMetadataPath(self) -> str:
+        """
+        Returns the directory inside the backup path where the program keeps its
+        own data about the backup.
+        """
+        return os.path.join(os.path.realpath(self.backupPath), '.rib')
     
     def getRequired(self) -> dict[str, str]:
         """
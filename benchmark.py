@@ -0,0 +1,490 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+from runreport import reportsPath
+
+SCENARIOS = ['full', 'nochange', 'smallchange', 'rename', 'rotate', 'delete']
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+# random data every generated file is cut from, so trees are cheap to build and reproducible
+BLOCK_SIZE = 1024 * 1024
+
+def parseSize(value: str) -> int:
+    """
+    Returns a size in bytes, which may end with a `K`, `M` or `G` unit.
+
+    @type value: str
+    @param value: Size to parse, such as `64K`.
+    """
+    number = value.strip().upper().rstrip('B')
+    multiplier = 1
+    if (number[-1:] in SIZE_UNITS):
+        multiplier = SIZE_UNITS.get(number[-1])
+        number = number[:-1]
+    return int(float(number) * multiplier)
+
+def parseSizes(value: str) -> list[tuple[int, int]]:
+    """
+    Returns the `(size, weight)` pairs of a size distribution such as
+    `4K:70,64K:25,1M:5`. A file gets one of the sizes with a chance relative
+    to its weight, and a random size between half of it and all of it.
+
+    @type value: str
+    @param value: Size distribution to parse.
+    """
+    sizes = []
+    for item in value.split(','):
+        size, _, weight = item.partition(':')
+        sizes.append((parseSize(size), int(weight) if weight != '' else 1))
+    return sizes
+
+def generateTree(root: str, files: int, depth: int, fanout: int, sizes: list[tuple[int, int]], commaRatio: float, seed: int) -> dict[str, int]:
+    """
+    Build a synthetic source tree and return its totals. The same arguments
+    always build the same tree.
+
+    The tree has `fanout` directories in every directory down to `depth`
+    levels, and the files are spread evenly over all of its directories. A
+    share of the file and directory names contains commas, which the index
+    has to escape.
+
+    @type root: str
+    @param root: Directory to build the tree in, created if missing.
+    @type files: int
+    @param files: Number of files.
+    @type depth: int
+    @param depth: Number of directory levels below the root.
+    @type fanout: int
+    @param fanout: Number of directories inside every directory above the last level.
+    @type sizes: list[tuple[int, int]]
+    @param sizes: Size distribution (see `parseSizes`).
+    @type commaRatio: float
+    @param commaRatio: Share of names with a comma, between 0 and 1.
+    @type seed: int
+    @param seed: Seed of the random generator.
+    """
+    rng = random.Random(seed)
+    block = rng.randbytes(BLOCK_SIZE)
+
+    def name(prefix: str, number: int) -> str:
+        if (rng.random() < commaRatio):
+            return f"{prefix}{number},{rng.randrange(1000)}"
+        return f"{prefix}{number}"
+
+    dirs = [root]
+    level = [root]
+    for _ in range(depth):
+        nextLevel = []
+        for parent in level:
+            for number in range(fanout):
+                nextLevel.append(os.path.join(parent, name('dir', number)))
+        dirs.extend(nextLevel)
+        level = nextLevel
+    for directory in dirs:
+        os.makedirs(directory, exist_ok=True)
+
+    totalSize = 0
+    choices = [size for size, weight in sizes]
+    weights = [weight for size, weight in sizes]
+    for number in range(files):
+        limit = rng.choices(choices, weights)[0]
+        size = rng.randint(max(limit // 2, 1), limit)
+        path = os.path.join(dirs[number % len(dirs)], name('file', number) + '.dat')
+        offset = rng.randrange(BLOCK_SIZE)
+        # a unique header keeps files with the same size apart for hashing
+        header = f"{number}\n".encode()
+        with open(path,'wb') as file:
+            file.write(header[:size])
+            written = min(len(header), size)
+            while (written < size):
+                chunk = block[offset:offset + size - written]
+                file.write(chunk)
+                written += len(chunk)
+                offset = 0
+        totalSize += size
+    return {'files': files, 'directories': len(dirs), 'bytes': totalSize}
+
+def listFiles(root: str) -> list[str]:
+    """
+    Returns the paths of every file in a tree, sorted.
+
+    @type root: str
+    @param root: Top of the tree.
+    """
+    paths = []
+    for dirPath, dirNames, fileNames in os.walk(root):
+        dirNames.sort()
+        for fileName in sorted(fileNames):
+            paths.append(os.path.join(dirPath, fileName))
+    return paths
+
+def mutateTree(scenario: str, root: str, ratio: float, seed: int) -> int:
+    """
+    Change the source tree for a scenario after its first backup and return
+    the number of files affected.
+
+    - `smallchange` appends to a share of the files.
+    - `rename` renames a share of the files within their directory, and one
+      directory in every level below the root.
+    - `rotate` renames files onto the names of other renamed files, in pairs:
+      every other pair swaps names, the rest is rotated like log files (the
+      second file gets a new name, and the first one takes its old name).
+    - `delete` deletes a share of the files.
+
+    @type scenario: str
+    @param scenario: Name of the scenario.
+    @type root: str
+    @param root: Top of the source tree.
+    @type ratio: float
+    @param ratio: Share of the files to change, between 0 and 1.
+    @type seed: int
+    @param seed: Seed of the random generator.
+    """
+    rng = random.Random(seed + 1)
+    paths = listFiles(root)
+    chosen = rng.sample(paths, max(1, int(len(paths) * ratio))) if len(paths) > 0 else []
+    if (scenario == 'smallchange'):
+        for path in chosen:
+            with open(path,'ab') as file:
+                file.write(b'changed\n')
+    elif (scenario == 'rename'):
+        for path in chosen:
+            os.rename(path, path + '.renamed')
+        directory = root
+        while True:
+            subdirs = sorted(entry.path for entry in os.scandir(directory) if entry.is_dir())
+            if (len(subdirs) == 0):
+                break
+            subdir = rng.choice(subdirs)
+            os.rename(subdir, subdir + '-renamed')
+            directory = subdir + '-renamed'
+    elif (scenario == 'rotate'):
+        for number in range(0, len(chosen) - 1, 2):
+            first, second = chosen[number], chosen[number + 1]
+            if (number % 4 == 0):
+                os.rename(first, first + '.swap')
+                os.rename(second, first)
+                os.rename(first + '.swap', second)
+            else:
+                os.rename(second, second + '.1')
+                os.rename(first, second)
+    elif (scenario == 'delete'):
+        for path in chosen:
+            os.remove(path)
+    return len(chosen)
+
+def runBackup(workDir: str, profileMap: dict[str, str]) -> dict[str, any]:
+    """
+    Back up a profile in a separate process and return its run report. A
+    process of its own keeps the peak memory of every run apart.
+
+    @type workDir: str
+    @param workDir: Directory the backup runs in, where `backup.log` is written.
+    @type profileMap: dict[str, str]
+    @param profileMap: Profile attributes.
+    """
+    reportDir = reportsPath(profileMap.get('indexPath'))
+    before = set(os.listdir(reportDir)) if os.path.isdir(reportDir) else set()
+    subprocess.run([sys.executable, os.path.abspath(__file__), 'backup', json.dumps(profileMap)], cwd=workDir, check=True, stdout=subprocess.DEVNULL)
+    added = sorted(set(os.listdir(reportDir)) - before) if os.path.isdir(reportDir) else []
+    if (len(added) == 0):
+        raise RuntimeError(f"The backup wrote no run report to {reportDir}, see {os.path.join(workDir, 'backup.log')}")
+    with open(os.path.join(reportDir, added[-1]),'r') as reportFile:
+        return json.load(reportFile)
+
+def verifyBackup(workDir: str, profileMap: dict[str, str]) -> list[str]:
+    """
+    Restore the backup of a profile in a separate process, and return the
+    relative paths of the files that differ from the source tree, or that are
+    only in one of them.
+
+    @type workDir: str
+    @param workDir: Directory the backup runs in.
+    @type profileMap: dict[str, str]
+    @param profileMap: Profile attributes.
+    """
+    restorePath = os.path.join(workDir, 'restored')
+    shutil.rmtree(restorePath, ignore_errors=True)
+    subprocess.run([sys.executable, os.path.abspath(__file__), 'restore', json.dumps(profileMap), restorePath], cwd=workDir, check=True, stdout=subprocess.DEVNULL)
+    originalPath = profileMap.get('originalPath')
+    sourceFiles = set(os.path.relpath(path, originalPath) for path in listFiles(originalPath))
+    restoredFiles = set(os.path.relpath(path, restorePath) for path in listFiles(restorePath))
+    differences = sorted(sourceFiles ^ restoredFiles)
+    for path in sorted(sourceFiles & restoredFiles):
+        with open(os.path.join(originalPath, path),'rb') as sourceFile, open(os.path.join(restorePath, path),'rb') as restoredFile:
+            if (sourceFile.read() != restoredFile.read()):
+                differences.append(path)
+    shutil.rmtree(restorePath, ignore_errors=True)
+    return differences
+
+def backupChild(profileJson: str) -> None:
+    """
+    Back up a single profile, called in the process started by `runBackup`.
+
+    @type profileJson: str
+    @param profileJson: Profile attributes as JSON.
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import driver
+    from backup_profile import Profile
+    open('backup.log','w').close()
+    driver.backup(Profile(json.loads(profileJson)))
+    driver.closeLogger()
+
+def restoreChild(profileJson: str, destination: str) -> None:
+    """
+    Restore a single profile, called in the process started by `verifyBackup`.
+
+    @type profileJson: str
+    @param profileJson: Profile attributes as JSON.
+    @type destination: str
+    @param destination: Directory to restore to.
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import driver
+    from backup_profile import Profile
+    driver.restore(Profile(json.loads(profileJson)), destination)
+    driver.closeLogger()
+
+def runScenario(scenario: str, args: argparse.Namespace, repeat: int) -> dict[str, any]:
+    """
+    Run a scenario in a fresh copy of the synthetic tree and return the run report
+    of its measured backup.
+
+    @type scenario: str
+    @param scenario: Name of the scenario.
+    @type args: argparse.Namespace
+    @param args: Command line arguments.
+    @type repeat: int
+    @param repeat: Number of the repetition, starting at 0.
+    """
+    workDir = os.path.join(os.path.abspath(args.workdir), f"{scenario}-{repeat}")
+    shutil.rmtree(workDir, ignore_errors=True)
+    os.makedirs(os.path.join(workDir, 'dst'))
+    generateTree(os.path.join(workDir, 'src'), args.files, args.depth, args.fanout, parseSizes(args.sizes), args.comma_ratio, args.seed)
+    profileMap = {
+        'name': scenario,
+        'originalPath': os.path.join(workDir, 'src'),
+        'backupPath': os.path.join(workDir, 'dst'),
+        'indexPath': os.path.join(workDir, 'index', 'index.txt')
+    }
+    for option in args.option:
+        key, _, value = option.partition('=')
+        profileMap.update({key:value})
+    # the results are read from the run report
+    profileMap.update({'runReports':'true'})
+    if (scenario == 'delete'):
+        profileMap.update({'propagateDeletes':'true'})
+    if (scenario != 'full'):
+        runBackup(workDir, profileMap)
+        mutateTree(scenario, profileMap.get('originalPath'), args.change_ratio, args.seed)
+    report = runBackup(workDir, profileMap)
+    if (args.verify):
+        differences = verifyBackup(workDir, profileMap)
+        if (len(differences) > 0):
+            raise RuntimeError(f"Restored backup of scenario {scenario} differs from the source in {len(differences)} files, such as {differences[0]}")
+    if (not args.keep):
+        shutil.rmtree(workDir, ignore_errors=True)
+    return report
+
+def summarize(reports: list[dict[str, any]]) -> dict[str, any]:
+    """
+    Returns the median times and the largest peak memory of the repeated runs of a scenario.
+
+    @type reports: list[dict[str, any]]
+    @param reports: Run reports of the scenario.
+    """
+    phases = {}
+    for report in reports:
+        for name, phase in report.get('phases').items():
+            phases.setdefault(name, []).append(phase)
+    peaks = [report.get('peakRss') for report in reports if report.get('peakRss') != None]
+    return {
+        'files': reports[0].get('files'),
+        'bytes': reports[0].get('bytes'),
+        'wallTime': statistics.median(report.get('wallTime') for report in reports),
+        'peakRss': max(peaks) if len(peaks) > 0 else None,
+        'phases': {
+            name: {
+                'wallTime': statistics.median(phase.get('wallTime') for phase in runs),
+                'peakRss': max((phase.get('peakRss') or 0) for phase in runs),
+                'syscalls': runs[-1].get('syscalls')
+            } for name, runs in phases.items()
+        },
+        'runs': [report.get('wallTime') for report in reports]
+    }
+
+def compareResults(baseline: dict[str, any], results: dict[str, any], tolerance: float, minimumTime: float) -> list[str]:
+    """
+    Returns a line for every time or memory use of the results that is worse
+    than the baseline by more than the tolerance. Times shorter than
+    `minimumTime` in both are left out, they are mostly noise.
+
+    @type baseline: dict[str, any]
+    @param baseline: Earlier results.
+    @type results: dict[str, any]
+    @param results: New results.
+    @type tolerance: float
+    @param tolerance: Allowed slowdown in percent.
+    @type minimumTime: float
+    @param minimumTime: Seconds below which times are not compared.
+    """
+    regressions = []
+
+    def check(label: str, old: float, new: float, isTime: bool) -> None:
+        if (old == None or new == None or old <= 0):
+            return
+        if (isTime and max(old, new) < minimumTime):
+            return
+        change = (new - old) / old * 100
+        if (change > tolerance):
+            regressions.append(f"{label}: {round(old, 4)} -> {round(new, 4)} (+{round(change, 1)}%)")
+
+    for scenario, summary in results.get('scenarios').items():
+        old = baseline.get('scenarios', {}).get(scenario)
+        if (old == None):
+            continue
+        check(f"{scenario} wallTime", old.get('wallTime'), summary.get('wallTime'), True)
+        check(f"{scenario} peakRss", old.get('peakRss'), summary.get('peakRss'), False)
+        for name, phase in summary.get('phases').items():
+            oldPhase = old.get('phases', {}).get(name)
+            if (oldPhase != None):
+                check(f"{scenario} {name} wallTime", oldPhase.get('wallTime'), phase.get('wallTime'), True)
+    return regressions
+
+def printResults(results: dict[str, any]) -> None:
+    """
+    Print a table of the scenario and phase times.
+
+    @type results: dict[str, any]
+    @param results: Benchmark results.
+    """
+    for scenario, summary in results.get('scenarios').items():
+        peak = summary.get('peakRss')
+        peakText = f"{round(peak / 1000000, 1)} MB" if peak != None else 'n/a'
+        print(f"{scenario}: {round(summary.get('wallTime'), 3)} s, peak memory {peakText}")
+        for name, phase in summary.get('phases').items():
+            print(f"    {name:<12} {round(phase.get('wallTime'), 4)} s")
+
+def main() -> None:
+    """
+    Benchmark `driver.backup` against synthetic source trees.
+
+    ```
+    python benchmark.py run [--files N] [--scenarios full,nochange,...] [--output results.json] [--baseline baseline.json]
+    python benchmark.py compare <baseline.json> <results.json>
+    python benchmark.py generate <directory> [--files N] ...
+    ```
+
+    `run` builds a tree for every scenario, backs it up and records the run
+    report of the measured backup. Only the last backup of a scenario is
+    measured, the backups that set it up are not. With `--verify`, every
+    measured backup is restored and compared with its source tree. With `--baseline`, the
+    results are compared to earlier results and the exit status is 1 if a
+    time or memory use got worse than `--tolerance` percent.
+    """
+    if (len(sys.argv) == 3 and sys.argv[1] == 'backup'):
+        backupChild(sys.argv[2])
+        return
+    if (len(sys.argv) == 4 and sys.argv[1] == 'restore'):
+        restoreChild(sys.argv[2], sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(description='Benchmark backups against synthetic source trees.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    treeArguments = argparse.ArgumentParser(add_help=False)
+    treeArguments.add_argument('--files', type=int, default=10000, help='number of files (default 10000)')
+    treeArguments.add_argument('--depth', type=int, default=3, help='directory levels (default 3)')
+    treeArguments.add_argument('--fanout', type=int, default=4, help='directories per directory (default 4)')
+    treeArguments.add_argument('--sizes', default='4K:70,64K:25,1M:5', help='size distribution as size:weight pairs (default 4K:70,64K:25,1M:5)')
+    treeArguments.add_argument('--comma-ratio', type=float, default=0.1, help='share of names with a comma (default 0.1)')
+    treeArguments.add_argument('--seed', type=int, default=1, help='random seed (default 1)')
+
+    runParser = commands.add_parser('run', parents=[treeArguments], help='run benchmark scenarios')
+    runParser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"scenarios to run (default {','.join(SCENARIOS)})")
+    runParser.add_argument('--change-ratio', type=float, default=0.1, help='share of files changed, renamed or deleted (default 0.1)')
+    runParser.add_argument('--repeat', type=int, default=3, help='runs per scenario, the median is kept (default 3)')
+    runParser.add_argument('--option', action='append', default=[], help='profile attribute as key=value, may be repeated')
+    runParser.add_argument('--workdir', default='benchmark-work', help='directory for the trees (default benchmark-work)')
+    runParser.add_argument('--keep', action='store_true', help='keep the trees afterwards')
+    runParser.add_argument('--verify', action='store_true', help='restore every measured backup and compare it with the source tree')
+    runParser.add_argument('--output', help='file to write the results to')
+    runParser.add_argument('--baseline', help='results to compare with')
+    runParser.add_argument('--tolerance', type=float, default=10.0, help='allowed slowdown in percent (default 10)')
+    runParser.add_argument('--min-time', type=float, default=0.05, help='seconds below which times are not compared (default 0.05)')
+
+    compareParser = commands.add_parser('compare', help='compare two result files')
+    compareParser.add_argument('baseline')
+    compareParser.add_argument('results')
+    compareParser.add_argument('--tolerance', type=float, default=10.0, help='allowed slowdown in percent (default 10)')
+    compareParser.add_argument('--min-time', type=float, default=0.05, help='seconds below which times are not compared (default 0.05)')
+
+    generateParser = commands.add_parser('generate', parents=[treeArguments], help='only build a synthetic tree')
+    generateParser.add_argument('directory')
+
+    args = parser.parse_args()
+    if (args.command == 'generate'):
+        totals = generateTree(args.directory, args.files, args.depth, args.fanout, parseSizes(args.sizes), args.comma_ratio, args.seed)
+        print(f"Generated {totals.get('files')} files in {totals.get('directories')} directories ({totals.get('bytes')} bytes)")
+        return
+
+    if (args.command == 'compare'):
+        with open(args.baseline,'r') as baselineFile:
+            baseline = json.load(baselineFile)
+        with open(args.results,'r') as resultsFile:
+            results = json.load(resultsFile)
+        regressions = compareResults(baseline, results, args.tolerance, args.min_time)
+    else:
+        scenarios = [scenario.strip() for scenario in args.scenarios.split(',') if scenario.strip() != '']
+        for scenario in scenarios:
+            if (scenario not in SCENARIOS):
+                parser.error(f"unknown scenario: {scenario}")
+        results = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'config': {
+                'files': args.files,
+                'depth': args.depth,
+                'fanout': args.fanout,
+                'sizes': args.sizes,
+                'commaRatio': args.comma_ratio,
+                'seed': args.seed,
+                'changeRatio': args.change_ratio,
+                'repeat': args.repeat,
+                'options': args.option
+            },
+            'scenarios': {}
+        }
+        for scenario in scenarios:
+            print(f"Running scenario {scenario}...")
+            reports = [runScenario(scenario, args, repeat) for repeat in range(args.repeat)]
+            results.get('scenarios').update({scenario:summarize(reports)})
+        printResults(results)
+        if (args.output != None):
+            with open(args.output,'w') as outputFile:
+                json.dump(results, outputFile, indent=2)
+                outputFile.write('\n')
+        if (args.baseline == None):
+            return
+        with open(args.baseline,'r') as baselineFile:
+            baseline = json.load(baselineFile)
+        # the number of runs does not change what is measured
+        ignored = ['repeat']
+        if ({key:value for key, value in baseline.get('config', {}).items() if key not in ignored} != {key:value for key, value in results.get('config').items() if key not in ignored}):
+            print('Warning: The baseline was recorded with a different configuration.')
+        regressions = compareResults(baseline, results, args.tolerance, args.min_time)
+
+    if (len(regressions) > 0):
+        print('Regressions:')
+        for regression in regressions:
+            print(f"    {regression}")
+        exit(1)
+    print('No regressions.')
+
+if (__name__ == '__main__'):
+    main()
@@ -0,0 +1,323 @@
+import json
+import os
+import time
+from typing import Callable, Iterator
+
+from digest import formatDigest, parseDigest
+from file import formatDirLine, formatIndexLine
+from indexfile import isDirLine, parseDirLine, parseIndexEntry
+from indexwriter import removeIfExists
+
+# operation log records, one per line: the header, the index entries decided
+# before the copies (index lines as in `index.txt`), the planned copies, the
+# end of the plan and the checkpoints of completed copies
+HEADER_RECORD = 'H'
+COPY_RECORD = 'C'
+PLAN_RECORD = 'P'
+CHECKPOINT_RECORD = 'K'
+OPLOG_VERSION = 1
+
+def operationLogPath(indexPath: str) -> str:
+    """
+    Returns the path of the operation log of a profile.
+
+    @type indexPath: str
+    @param indexPath: Path to the index file of the profile.
+    """
+    return indexPath + '.oplog'
+
+class PlannedEntry:
+    """
+    ## PlannedEntry
+    The PlannedEntry class is a file whose copy was planned by an interrupted
+    run, read back from the operation log. It has the attributes of a
+    ScanEntry that the index writer uses.
+    """
+    __slots__ = ('st_ino', 'st_mtime_ns', 'real_path', 'stored_path', 'st_size')
+
+    def __init__(self, st_ino: int, st_mtime_ns: int, real_path: str, stored_path: str, st_size: int):
+        self.st_ino = st_ino
+        self.st_mtime_ns = st_mtime_ns
+        self.real_path = real_path
+        self.stored_path = stored_path
+        self.st_size = st_size
+
+class OperationLog:
+    """
+    ## OperationLog
+    The OperationLog class journals a backup so an interrupted run can be
+    resumed without scanning again. While the source directory is scanned it
+    records every index entry that does not depend on a copy. Once deletes and
+    moves are done, it records the planned copies and marks the plan complete.
+    Completed copies are then checkpointed in batches: every
+    `interval` seconds, `onCheckpoint` is called to make the copies so far
+    durable, and only then are they written to the log and synced. A copy
+    that is not in a checkpoint is done again when the run is resumed.
+    """
+    def __init__(self, path: str, header: dict[str, any], interval: float = 30.0):
+        """
+        @type path: str
+        @param path: Path of the operation log (see `operationLogPath`).
+        @type header: dict[str, any]
+        @param header: Details of the run needed to resume it, such as the history run.
+        @type interval: float
+        @param interval: Seconds between checkpoints.
+            (default is 30.0)
+        """
+        self.path = path
+        # the log is written beside the previous one, and only replaces it once
+        # its plan is complete, so a run interrupted again early can still be resumed
+        self.tempPath = path + '.tmp'
+        self.interval = interval
+        self.planned = False
+        self.pending = []
+        self.lastCheckpoint = time.monotonic()
+        self.onCheckpoint = None
+        header.update({'version':OPLOG_VERSION})
+        self.file = open(self.tempPath, 'w', buffering=1024 * 1024)
+        self.file.write(HEADER_RECORD + json.dumps(header) + '\n')
+
+    def write(self, st_ino: int, st_mtime_ns: int, real_path: str, stored_path: str, st_size: int = -1, digest: bytes = None, codec: str = None) -> None:
+        """
+        Record an index entry decided before the copies, with the fields of `IndexWriter.write`.
+        """
+        extras = {}
+        if (st_size >= 0):
+            extras.update({'size':st_size})
+        if (digest != None):
+            extras.update({'digest':formatDigest(digest)})
+        if (codec != None):
+            extras.update({'codec':codec})
+        self.file.write(formatIndexLine(st_ino, st_mtime_ns, real_path, stored_path, extras) + '\n')
+
+    def writeDir(self, st_mtime_ns: int, childCount: int, real_path: str, stored_path: str) -> None:
+        """
+        Record a directory record, with the fields of `IndexWriter.writeDir`.
+        """
+        self.file.write(formatDirLine(st_mtime_ns, childCount, real_path, stored_path) + '\n')
+
+    def plan(self, copies: list[dict[str, any]], summary: dict[str, int]) -> None:
+        """
+        Record the planned copies and mark the plan complete. Each copy is
+        numbered under `number`, for `completed()`.
+
+        @type copies: list[dict[str, any]]
+        @param copies: The copy operations of the run.
+        @type summary: dict[str, int]
+        @param summary: Totals of the scan, reported again when the run is resumed.
+        """
+        for number, copy in enumerate(copies):
+            copy.update({'number':number})
+            entry = copy.get('entry')
+            record = {
+                'paths':copy.get('paths'),
+                'size':copy.get('size'),
+                'entry':[entry.st_ino, entry.st_mtime_ns, entry.real_path, entry.stored_path, entry.st_size],
+                'digest':formatDigest(copy.get('digest')) if copy.get('digest') != None else None,
+                'computeDigest':copy.get('computeDigest')
+            }
+            for key in ['pack', 'dedup', 'sidecar', 'blockSize', 'level']:
+                if (copy.get(key) != None):
+                    record.update({key:copy.get(key)})
+            if (copy.get('compress') != None):
+                record.update({'compress':copy.get('compress').name})
+            self.file.write(COPY_RECORD + json.dumps(record) + '\n')
+        self.file.write(PLAN_RECORD + json.dumps(summary) + '\n')
+        self.sync()
+        os.replace(self.tempPath, self.path)
+        self.planned = True
+        self.lastCheckpoint = time.monotonic()
+
+    def completed(self, copy: dict[str, any], digest: bytes) -> None:
+        """
+        Note a completed copy, to be written with the next checkpoint.
+
+        @type copy: dict[str, any]
+        @param copy: The copy operation, numbered by `plan()`.
+        @type digest: bytes
+        @param digest: Content digest of the copied file, or None.
+        """
+        record = {'number':copy.get('number')}
+        if (digest != None):
+            record.update({'digest':formatDigest(digest)})
+        for key in ['locator', 'codec']:
+            if (copy.get(key) != None):
+                record.update({key:copy.get(key)})
+        self.pending.append(record)
+        if (time.monotonic() - self.lastCheckpoint >= self.interval):
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        """
+        Make the completed copies durable with `onCheckpoint`, then write them
+        to the log and sync it.
+        """
+        self.lastCheckpoint = time.monotonic()
+        if (len(self.pending) == 0):
+            return
+        if (self.onCheckpoint != None):
+            self.onCheckpoint()
+        for record in self.pending:
+            self.file.write(CHECKPOINT_RECORD + json.dumps(record) + '\n')
+        self.pending = []
+        self.sync()
+
+    def sync(self) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        """
+        Checkpoint the completed copies and close the log, leaving it in place
+        for the run to be resumed.
+        """
+        if (self.file.closed):
+            return
+        if (self.planned):
+            self.checkpoint()
+        self.file.close()
+        if (not self.planned):
+            removeIfExists(self.tempPath)
+
+    def remove(self) -> None:
+        """
+        Close and remove the log once the index of the run has been committed.
+        """
+        if (not self.file.closed):
+            self.file.close()
+        removeIfExists(self.tempPath)
+        removeIfExists(self.path)
+
+class JournaledIndexWriter:
+    """
+    ## JournaledIndexWriter
+    The JournaledIndexWriter class passes entries on to the writer of the new
+    index, and records those written before the copies are planned in the
+    operation log. Entries of copies are recorded by their checkpoints instead.
+    """
+    def __init__(self, writer: any, oplog: OperationLog):
+        """
+        @type writer: IndexWriter | BinaryIndexWriter
+        @param writer: Writer of the new index.
+        @type oplog: OperationLog
+        @param oplog: Operation log of the run.
+        """
+        self.writer = writer
+        self.oplog = oplog
+
+    def write(self, st_ino: int, st_mtime_ns: int, real_path: str, stored_path: str, st_size: int = -1, digest: bytes = None, codec: str = None) -> None:
+        self.writer.write(st_ino, st_mtime_ns, real_path, stored_path, st_size, digest, codec)
+        if (not self.oplog.planned):
+            self.oplog.write(st_ino, st_mtime_ns, real_path, stored_path, st_size, digest, codec)
+
+    def writeEntry(self, entry: any, digest: bytes = None, codec: str = None) -> None:
+        self.write(entry.st_ino, entry.st_mtime_ns, entry.real_path, entry.stored_path, entry.st_size, digest, codec)
+
+    def writeDir(self, st_mtime_ns: int, childCount: int, real_path: str, stored_path: str) -> None:
+        self.writer.writeDir(st_mtime_ns, childCount, real_path, stored_path)
+        if (not self.oplog.planned):
+            self.oplog.writeDir(st_mtime_ns, childCount, real_path, stored_path)
+
+    def commit(self) -> None:
+        self.writer.commit()
+
+    def abort(self) -> None:
+        self.writer.abort()
+
+class ResumedRun:
+    """
+    ## ResumedRun
+    The ResumedRun class holds an interrupted run read back from its
+    operation log (see `readOperationLog`).
+    """
+    def __init__(self):
+        self.header = {}
+        self.summary = {}
+        # index lines decided before the copies
+        self.lines = []
+        # planned copy records, and the checkpoints of those completed, by number
+        self.copies = []
+        self.completed = {}
+
+    def replay(self, indexWriter: any) -> None:
+        """
+        Write the index entries decided before the copies to a new index.
+
+        @type indexWriter: IndexWriter | BinaryIndexWriter
+        @param indexWriter: Writer of the new index.
+        """
+        for line in self.lines:
+            if (isDirLine(line)):
+                indexWriter.writeDir(*parseDirLine(line))
+                continue
+            st_ino, st_mtime_ns, real_path, stored_path, extras = parseIndexEntry(line)
+            digest = parseDigest(extras.get('digest')) if 'digest' in extras else None
+            indexWriter.write(st_ino, st_mtime_ns, real_path, stored_path, int(extras.get('size', -1)), digest, extras.get('codec'))
+
+    def copyOperations(self, getCodec: Callable[[str], any]) -> list[dict[str, any]]:
+        """
+        Returns the planned copies that were not checkpointed, as copy
+        operations for `copyFiles`, numbered as they were planned.
+
+        @type getCodec: Callable[[str], Codec]
+        @param getCodec: Returns a codec by name (see `compressor.getCodec`).
+        """
+        operations = []
+        for number, record in enumerate(self.copies):
+            if (number in self.completed):
+                continue
+            copy = dict(record)
+            copy.update({
+                'number':number,
+                'entry':PlannedEntry(*record.get('entry')),
+                'digest':parseDigest(record.get('digest')) if record.get('digest') != None else None
+            })
+            if (record.get('compress') != None):
+                copy.update({'compress':getCodec(record.get('compress'))})
+            operations.append(copy)
+        return operations
+
+    def completedCopies(self) -> Iterator[tuple[PlannedEntry, str, bytes, str]]:
+        """
+        Yields the entry, locator, digest and codec of every copy that was
+        checkpointed. The locator is None for a file stored at its own path.
+        """
+        for number, record in sorted(self.completed.items()):
+            digest = record.get('digest', self.copies[number].get('digest'))
+            yield (PlannedEntry(*self.copies[number].get('entry')), record.get('locator'), parseDigest(digest) if digest != None else None, record.get('codec'))
+
+def readOperationLog(path: str) -> ResumedRun:
+    """
+    Returns the interrupted run recorded in an operation log, or None if
+    there is no log or the run cannot be resumed from it, because it was
+    interrupted before its plan was complete.
+
+    @type path: str
+    @param path: Path of the operation log.
+    """
+    run = ResumedRun()
+    planned = False
+    try:
+        with open(path,'r') as logFile:
+            for line in logFile:
+                # a line cut short by the interruption ends the log
+                if (not line.endswith('\n')):
+                    break
+                kind = line[0]
+                if (kind == HEADER_RECORD):
+                    run.header = json.loads(line[1:])
+                elif (kind == COPY_RECORD):
+                    run.copies.append(json.loads(line[1:]))
+                elif (kind == PLAN_RECORD):
+                    run.summary = json.loads(line[1:])
+                    planned = True
+                elif (kind == CHECKPOINT_RECORD):
+                    record = json.loads(line[1:])
+                    run.completed.update({record.get('number'):record})
+                else:
+                    run.lines.append(line)
+    except (FileNotFoundError):
+        return None
+    if (not planned or run.header.get('version') != OPLOG_VERSION):
+        return None
+    return run
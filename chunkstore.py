@@ -0,0 +1,209 @@
+import hashlib
+import os
+import struct
+import threading
+
+from digest import newHasher
+
+CHUNK_PREFIX = 'cas:'
+# chunks and recipes are addressed by a BLAKE2b digest of this size, long
+# enough that two different contents never share an address
+ADDRESS_SIZE = 32
+# recipe: a header, then the address and length of every chunk of the file
+RECIPE_MAGIC = b'RIBRCPE1'
+RECIPE_HEADER = struct.Struct('<8sQI') # magic, file size, chunk count
+RECIPE_CHUNK = struct.Struct(f"<{ADDRESS_SIZE}sI") # chunk address, chunk length
+
+def chunkAddress(data: bytes) -> bytes:
+    """
+    Returns the address of a chunk or recipe in the chunk store.
+
+    @type data: bytes
+    @param data: Content of the chunk or recipe.
+    """
+    return hashlib.blake2b(data, digest_size=ADDRESS_SIZE).digest()
+
+def isChunkLocator(storedPath: str) -> bool:
+    """
+    Returns true if a stored path read from the index points into the chunk
+    store instead of at a file in the backup.
+
+    @type storedPath: str
+    @param storedPath: Stored path of an index entry.
+    """
+    return storedPath.startswith(CHUNK_PREFIX)
+
+def formatChunkLocator(recipe: bytes) -> str:
+    """
+    Returns the stored path recorded in the index for a file in the chunk store.
+
+    @type recipe: bytes
+    @param recipe: Address of the recipe of the file.
+    """
+    return CHUNK_PREFIX + recipe.hex()
+
+def parseChunkLocator(locator: str) -> bytes:
+    """
+    Returns the address of the recipe of a file from its stored path.
+
+    @type locator: str
+    @param locator: Stored path of the file (see `formatChunkLocator`).
+    """
+    return bytes.fromhex(locator[len(CHUNK_PREFIX):])
+
+class ChunkStore:
+    """
+    ## ChunkStore
+    The ChunkStore class stores files by content. A file is cut into chunks of
+    `chunkSize` bytes, and every chunk is written once under its address, no
+    matter how many files (or profiles sharing the store) contain it. The list
+    of chunks of a file, its recipe, is stored the same way, so identical files
+    share their recipe too. The index records the address of the recipe (see
+    `formatChunkLocator`) in place of a stored path.
+
+    Chunks and recipes live under `chunks/` and `recipes/` of the store
+    directory, spread over 256 subdirectories by their first byte. They are
+    written to a temporary file, synced and renamed into place, so a chunk that
+    exists is always complete. It is safe to call `store()` from the copy
+    workers, and from several profiles sharing the store.
+    """
+    def __init__(self, path: str, chunkSize: int):
+        """
+        @type path: str
+        @param path: Directory of the chunk store.
+        @type chunkSize: int
+        @param chunkSize: Size files are cut into.
+        """
+        self.path = path
+        self.chunkSize = chunkSize
+        self.lock = threading.Lock()
+        # addresses known to be in the store, so they are not looked up again
+        self.known = set()
+        # addresses being written by a worker, to the event set once it is done
+        self.writing = {}
+        # bytes of the files stored, and bytes written to the store for them
+        self.size = 0
+        self.written = 0
+
+    def objectPath(self, kind: str, address: bytes) -> str:
+        """
+        Returns the path of a chunk or recipe.
+
+        @type kind: str
+        @param kind: `'chunks'` or `'recipes'`.
+        @type address: bytes
+        @param address: Address of the chunk or recipe.
+        """
+        hexAddress = address.hex()
+        return os.path.join(self.path, kind, hexAddress[:2], hexAddress)
+
+    def put(self, kind: str, data: bytes) -> tuple[bytes, int]:
+        """
+        Store a chunk or recipe unless the store already holds it. Returns its
+        address and the number of bytes written.
+
+        @type kind: str
+        @param kind: `'chunks'` or `'recipes'`.
+        @type data: bytes
+        @param data: Content of the chunk or recipe.
+        """
+        address = chunkAddress(data)
+        key = (kind, address)
+        while True:
+            with self.lock:
+                if (key in self.known):
+                    return (address, 0)
+                # another worker is writing the same content, it is waited for
+                writing = self.writing.get(key)
+                if (writing == None):
+                    self.writing.update({key:threading.Event()})
+                    break
+            writing.wait()
+        path = self.objectPath(kind, address)
+        written = 0
+        try:
+            if (not os.path.exists(path)):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tempPath = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+                with open(tempPath,'wb') as objectFile:
+                    objectFile.write(data)
+                    objectFile.flush()
+                    os.fsync(objectFile.fileno())
+                os.replace(tempPath, path)
+                written = len(data)
+            with self.lock:
+                self.known.add(key)
+        finally:
+            with self.lock:
+                self.writing.pop(key).set()
+        return (address, written)
+
+    def store(self, source: str, computeDigest: bool = False) -> tuple[str, bytes, int]:
+        """
+        Store a file. Returns the stored path of the file, its content digest
+        if asked for, and the number of bytes written to the store.
+
+        @type source: str
+        @param source: Path of the original file.
+        @type computeDigest: bool
+        @param computeDigest: Whether to return the content digest.
+            (default is False)
+        """
+        hasher = newHasher() if computeDigest else None
+        chunks = []
+        size = 0
+        written = 0
+        with open(source,'rb') as sourceFile:
+            while True:
+                chunk = sourceFile.read(self.chunkSize)
+                if (not chunk):
+                    break
+                if (hasher != None):
+                    hasher.update(chunk)
+                address, chunkWritten = self.put('chunks', chunk)
+                chunks.append(RECIPE_CHUNK.pack(address, len(chunk)))
+                size += len(chunk)
+                written += chunkWritten
+        recipe = RECIPE_HEADER.pack(RECIPE_MAGIC, size, len(chunks)) + b''.join(chunks)
+        address, recipeWritten = self.put('recipes', recipe)
+        written += recipeWritten
+        with self.lock:
+            self.size += size
+            self.written += written
+        return (formatChunkLocator(address), hasher.digest() if hasher != None else None, written)
+
+    def readRecipe(self, locator: str) -> list[tuple[bytes, int]]:
+        """
+        Returns the address and length of every chunk of a stored file.
+
+        @type locator: str
+        @param locator: Stored path of the file.
+        """
+        with open(self.objectPath('recipes', parseChunkLocator(locator)),'rb') as recipeFile:
+            recipe = recipeFile.read()
+        magic, size, count = RECIPE_HEADER.unpack_from(recipe, 0)
+        if (magic != RECIPE_MAGIC):
+            raise ValueError(f"Not a recipe: {locator}")
+        return [RECIPE_CHUNK.unpack_from(recipe, RECIPE_HEADER.size + RECIPE_CHUNK.size * number) for number in range(count)]
+
+    def extract(self, locator: str, destination: str, st_mtime_ns: int = None) -> None:
+        """
+        Write a stored file back out to a destination path.
+
+        @type locator: str
+        @param locator: Stored path of the file.
+        @type destination: str
+        @param destination: Path to write the file to.
+        @type st_mtime_ns: int
+        @param st_mtime_ns: Modification time to give the file, from the index.
+            (default is None, left as written)
+        """
+        with open(destination,'wb') as file:
+            for address, length in self.readRecipe(locator):
+                with open(self.objectPath('chunks', address),'rb') as chunkFile:
+                    chunk = chunkFile.read()
+                if (len(chunk) != length):
+                    raise EOFError(f"Chunk {address.hex()} of {locator} is damaged")
+                file.write(chunk)
+        if (st_mtime_ns != None):
+            os.utime(destination, ns=(st_mtime_ns, st_mtime_ns))
@@ -0,0 +1,218 @@
+import bz2
+import lzma
+import os
+import shutil
+import zlib
+
+from digest import newHasher
+
+# zstd is optional, from the standard library (Python 3.14+) or the zstandard package
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BUFFER_SIZE = 1024 * 1024
+# the start of a file is compressed at the fastest level first, and the file
+# is stored as is if the sample does not shrink below this ratio
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_RATIO = 0.9
+# a file this small takes up one block on disk however well it compresses
+MIN_SIZE = 4096
+# formats that are compressed already
+COMPRESSED_EXTENSIONS = {
+    '.7z', '.aac', '.apk', '.avi', '.br', '.bz2', '.cab', '.deb', '.dmg', '.docx', '.epub', '.flac',
+    '.gif', '.gz', '.heic', '.jar', '.jpeg', '.jpg', '.lz', '.lz4', '.lzma', '.m4a', '.m4v', '.mkv',
+    '.mov', '.mp3', '.mp4', '.odp', '.ods', '.odt', '.ogg', '.opus', '.png', '.pptx', '.rar', '.rpm',
+    '.tbz2', '.tgz', '.txz', '.webm', '.webp', '.whl', '.xlsx', '.xz', '.zip', '.zst'
+}
+
+class Codec:
+    """
+    ## Codec
+    The Codec class describes a compression format files can be stored in.
+    Every codec writes the standard container of its format (gzip, xz, bzip2
+    or zstd), so stored files can also be read with the usual command line
+    tools. The number of a codec is what the binary index records for a file,
+    it must never change.
+    """
+    def __init__(self, name: str, number: int, defaultLevel: int, levels: range, compressor: callable, decompressor: callable):
+        """
+        @type name: str
+        @param name: Name of the codec, as used by the `compression` profile attribute and the index.
+        @type number: int
+        @param number: Number of the codec in the binary index.
+        @type defaultLevel: int
+        @param defaultLevel: Level used when the profile does not set one.
+        @type levels: range
+        @param levels: Accepted levels.
+        @type compressor: callable
+        @param compressor: Returns a new compression object for a level.
+        @type decompressor: callable
+        @param decompressor: Returns a new decompression object.
+        """
+        self.name = name
+        self.number = number
+        self.defaultLevel = defaultLevel
+        self.levels = levels
+        self.compressor = compressor
+        self.decompressor = decompressor
+
+def newZstdCompressor(level: int) -> any:
+    if (zstd != None):
+        return zstd.ZstdCompressor(level=level)
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+def newZstdDecompressor() -> any:
+    if (zstd != None):
+        return zstd.ZstdDecompressor()
+    return zstandard.ZstdDecompressor().decompressobj()
+
+CODECS = {
+    'zlib': Codec('zlib', 1, 6, range(1, 10), lambda level: zlib.compressobj(level, zlib.DEFLATED, 31), lambda: zlib.decompressobj(31)),
+    'lzma': Codec('lzma', 2, 6, range(0, 10), lambda level: lzma.LZMACompressor(preset=level), lzma.LZMADecompressor),
+    'bz2': Codec('bz2', 3, 9, range(1, 10), bz2.BZ2Compressor, bz2.BZ2Decompressor),
+    'zstd': Codec('zstd', 4, 3, range(1, 23), newZstdCompressor, newZstdDecompressor)
+}
+CODEC_NAMES = {codec.number:name for name, codec in CODECS.items()}
+
+def isAvailable(name: str) -> bool:
+    """
+    Returns true if a codec can be used. zstd needs Python 3.14 or the
+    zstandard package, the others are always available.
+
+    @type name: str
+    @param name: Name of the codec.
+    """
+    if (name == 'zstd'):
+        return zstd != None or zstandard != None
+    return name in CODECS
+
+def getCodec(name: str) -> Codec:
+    """
+    Returns a codec by name, or None for `'none'` and None.
+
+    @type name: str
+    @param name: Name of the codec.
+    """
+    if (name == None or name == 'none'):
+        return None
+    if (not isAvailable(name)):
+        raise ValueError(f"Compression codec is not available: {name}")
+    return CODECS.get(name)
+
+def codecNumber(name: str) -> int:
+    """
+    Returns the number the binary index records for a codec, 0 for none.
+
+    @type name: str
+    @param name: Name of the codec, or None.
+    """
+    if (name == None):
+        return 0
+    return CODECS.get(name).number
+
+def codecName(number: int) -> str:
+    """
+    Returns the name of a codec from the number the binary index records, or
+    None for 0.
+
+    @type number: int
+    @param number: Number of the codec.
+    """
+    if (number == 0):
+        return None
+    name = CODEC_NAMES.get(number)
+    if (name == None):
+        raise ValueError(f"Unknown compression codec number: {number}")
+    return name
+
+def isCompressible(source: str, size: int) -> bool:
+    """
+    Returns true if a file is worth compressing: it is not too small, its
+    extension is not that of a compressed format, and a sample from its start
+    shrinks enough at the fastest level.
+
+    @type source: str
+    @param source: Path of the original file.
+    @type size: int
+    @param size: Size of the file in bytes.
+    """
+    if (size < MIN_SIZE):
+        return False
+    if (os.path.splitext(source)[1].lower() in COMPRESSED_EXTENSIONS):
+        return False
+    with open(source,'rb') as sourceFile:
+        sample = sourceFile.read(SAMPLE_SIZE)
+    return len(zlib.compress(sample, 1)) < len(sample) * SAMPLE_RATIO
+
+def compressFile(source: str, destination: str, codec: Codec, level: int = None, computeDigest: bool = False, throttle: any = None) -> tuple[int, bytes]:
+    """
+    Compress a file to a destination path and copy its stats like
+    `shutil.copy2`. Returns the number of bytes written, and the content
+    digest of the original file if asked for. The codecs of the standard
+    library release the GIL while they work, so files compressed on several
+    copy workers are compressed in parallel.
+
+    @type source: str
+    @param source: Path of the original file.
+    @type destination: str
+    @param destination: Path to write the compressed file to.
+    @type codec: Codec
+    @param codec: Codec to compress with.
+    @type level: int
+    @param level: Compression level.
+        (default is None, the default level of the codec)
+    @type computeDigest: bool
+    @param computeDigest: Whether to return the content digest.
+        (default is False)
+    @type throttle: Throttle
+    @param throttle: Limits the file is read within.
+        (default is None, no limits)
+    """
+    compressor = codec.compressor(codec.defaultLevel if level == None else level)
+    hasher = newHasher() if computeDigest else None
+    written = 0
+    with open(source,'rb') as sourceFile, open(destination,'wb') as destinationFile:
+        while True:
+            chunk = sourceFile.read(BUFFER_SIZE) if throttle == None else throttle.read(sourceFile, BUFFER_SIZE)
+            if (not chunk):
+                break
+            if (hasher != None):
+                hasher.update(chunk)
+            data = compressor.compress(chunk)
+            destinationFile.write(data)
+            written += len(data)
+        data = compressor.flush()
+        destinationFile.write(data)
+        written += len(data)
+    shutil.copystat(source, destination)
+    return (written, hasher.digest() if hasher != None else None)
+
+def decompressFile(source: str, destination: str, name: str) -> int:
+    """
+    Decompress a stored file to a destination path and return the number of
+    bytes written. Used by restores, stats are left to the caller.
+
+    @type source: str
+    @param source: Path of the compressed file in the backup.
+    @type destination: str
+    @param destination: Path to write the original content to.
+    @type name: str
+    @param name: Name of the codec the file was compressed with.
+    """
+    decompressor = getCodec(name).decompressor()
+    written = 0
+    with open(source,'rb') as sourceFile, open(destination,'wb') as destinationFile:
+        while True:
+            chunk = sourceFile.read(BUFFER_SIZE)
+            if (not chunk):
+                break
+            data = decompressor.decompress(chunk)
+            destinationFile.write(data)
+            written += len(data)
+    return written
@@ -0,0 +1,40 @@
+import os
+import shutil
+import sys
+
+from indexstore import convertIndex, isBinaryIndex
+
+def main() -> None:
+    """
+    Convert an `index.txt` file to the binary index format.
+
+    ```
+    python convert_index.py <index file> [<output file>]
+    ```
+
+    Without an output file, the index is converted in place and the text
+    version is kept next to it with a `.bak` extension.
+    """
+    if (len(sys.argv) not in [2, 3]):
+        print('Usage: python convert_index.py <index file> [<output file>]')
+        exit(1)
+
+    textPath = sys.argv[1]
+    if (not os.path.exists(textPath)):
+        print(f"Error: Index file not found: {textPath}")
+        exit(1)
+    if (isBinaryIndex(textPath)):
+        print(f"Index file is already binary: {textPath}")
+        exit()
+
+    if (len(sys.argv) == 3):
+        binaryPath = sys.argv[2]
+    else:
+        binaryPath = textPath
+        shutil.copy2(textPath, textPath + '.bak')
+
+    entries = convertIndex(textPath, binaryPath)
+    print(f"Converted {entries} index entries to {binaryPath}")
+
+if (__name__ == '__main__'):
+    main()
@@ -0,0 +1,167 @@
+import hashlib
+import os
+import shutil
+import struct
+
+from digest import newHasher
+
+# block hash sidecar: a header followed by one BLOCK_DIGEST_SIZE digest per block
+SIDECAR_MAGIC = b'RIBBLKS1'
+SIDECAR_HEADER = struct.Struct('<8sIQq') # magic, block size, file size, file mtime (ns)
+BLOCK_DIGEST_SIZE = 16
+
+def blockSidecarPath(metadataPath: str, backupPath: str, storedPath: str) -> str:
+    """
+    Returns the path of the block hash sidecar of a stored file. Sidecars are
+    kept under the metadata directory of the backup, mirroring the backup tree.
+
+    @type metadataPath: str
+    @param metadataPath: Metadata directory of the backup.
+    @type backupPath: str
+    @param backupPath: Resolved backup path of the profile.
+    @type storedPath: str
+    @param storedPath: Path the file is stored at in the backup.
+    """
+    return os.path.join(metadataPath, 'blocks', os.path.relpath(storedPath, backupPath) + '.blk')
+
+def blockSidecarDir(metadataPath: str, backupPath: str, storedDir: str) -> str:
+    """
+    Returns the directory holding the block hash sidecars of the files stored
+    in a backup directory.
+
+    @type metadataPath: str
+    @param metadataPath: Metadata directory of the backup.
+    @type backupPath: str
+    @param backupPath: Resolved backup path of the profile.
+    @type storedDir: str
+    @param storedDir: Directory in the backup.
+    """
+    return os.path.join(metadataPath, 'blocks', os.path.relpath(storedDir, backupPath))
+
+def blockDigest(block: bytes) -> bytes:
+    """
+    Returns the digest of a single block.
+
+    @type block: bytes
+    @param block: Content of the block.
+    """
+    return hashlib.blake2b(block, digest_size=BLOCK_DIGEST_SIZE).digest()
+
+def readSidecar(path: str, blockSize: int, stats: os.stat_result) -> list[bytes]:
+    """
+    Returns the block digests stored in a sidecar, or None if the sidecar is
+    missing or no longer matches the stored file.
+
+    @type path: str
+    @param path: Path of the sidecar.
+    @type blockSize: int
+    @param blockSize: Block size the digests must have been made with.
+    @type stats: os.stat_result
+    @param stats: Current stats of the stored file.
+    """
+    try:
+        with open(path,'rb') as sidecar:
+            data = sidecar.read()
+    except (FileNotFoundError):
+        return None
+    if (len(data) < SIDECAR_HEADER.size):
+        return None
+    magic, sidecarBlockSize, fileSize, fileMtime = SIDECAR_HEADER.unpack_from(data, 0)
+    if (magic != SIDECAR_MAGIC or sidecarBlockSize != blockSize or fileSize != stats.st_size or fileMtime != stats.st_mtime_ns):
+        return None
+    body = data[SIDECAR_HEADER.size:]
+    return [body[i:i + BLOCK_DIGEST_SIZE] for i in range(0, len(body), BLOCK_DIGEST_SIZE)]
+
+def writeSidecar(path: str, blockSize: int, stats: os.stat_result, digests: list[bytes]) -> None:
+    """
+    Write the block digests of a stored file to its sidecar.
+
+    @type path: str
+    @param path: Path of the sidecar.
+    @type blockSize: int
+    @param blockSize: Block size the digests were made with.
+    @type stats: os.stat_result
+    @param stats: Stats of the stored file after it was written.
+    @type digests: list[bytes]
+    @param digests: Digest of every block of the stored file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tempPath = path + '.tmp'
+    with open(tempPath,'wb') as sidecar:
+        sidecar.write(SIDECAR_HEADER.pack(SIDECAR_MAGIC, blockSize, stats.st_size, stats.st_mtime_ns))
+        sidecar.write(b''.join(digests))
+    os.replace(tempPath, path)
+
+def hashBlocks(path: str, blockSize: int) -> list[bytes]:
+    """
+    Returns the digest of every block of a file.
+
+    @type path: str
+    @param path: Path of the file.
+    @type blockSize: int
+    @param blockSize: Size of a block in bytes.
+    """
+    digests = []
+    with open(path,'rb') as file:
+        while True:
+            block = file.read(blockSize)
+            if (not block):
+                break
+            digests.append(blockDigest(block))
+    return digests
+
+def deltaCopy(source: str, destination: str, sidecar: str, blockSize: int, computeDigest: bool = False) -> tuple[int, bytes]:
+    """
+    Update the stored copy of a file in place, rewriting only the blocks whose
+    digest changed, and copy the file stats like `shutil.copy2`. The block
+    digests of the stored copy are read from its sidecar, or from the stored
+    copy itself if the sidecar is missing or out of date, and the sidecar is
+    rewritten afterwards.
+
+    Returns the number of bytes written, and the content digest of the file if
+    `computeDigest` is set.
+
+    @type source: str
+    @param source: Path of the original file.
+    @type destination: str
+    @param destination: Path the file is stored at in the backup.
+    @type sidecar: str
+    @param sidecar: Path of the block hash sidecar of the stored file.
+    @type blockSize: int
+    @param blockSize: Size of a block in bytes.
+    @type computeDigest: bool
+    @param computeDigest: Whether to compute the content digest of the file.
+        (default is False)
+    """
+    try:
+        stats = os.stat(destination)
+        storedDigests = readSidecar(sidecar, blockSize, stats)
+        if (storedDigests == None):
+            storedDigests = hashBlocks(destination, blockSize)
+        mode = 'r+b'
+    except (FileNotFoundError):
+        storedDigests = []
+        mode = 'wb'
+
+    hasher = newHasher() if computeDigest else None
+    digests = []
+    written = 0
+    with open(source,'rb') as sourceFile, open(destination, mode) as destinationFile:
+        while True:
+            block = sourceFile.read(blockSize)
+            if (not block):
+                break
+            if (hasher != None):
+                hasher.update(block)
+            digest = blockDigest(block)
+            blockNumber = len(digests)
+            if (blockNumber >= len(storedDigests) or storedDigests[blockNumber] != digest):
+                destinationFile.seek(blockNumber * blockSize)
+                destinationFile.write(block)
+                written += len(block)
+            digests.append(digest)
+        destinationFile.truncate(sourceFile.tell())
+    shutil.copystat(source, destination)
+    writeSidecar(sidecar, blockSize, os.stat(destination), digests)
+
+    return (written, hasher.digest() if hasher != None else None)
@@ -0,0 +1,86 @@
+import hashlib
+import shutil
+
+# xxhash is optional, it is used instead of BLAKE2 when it is installed
+try:
+    import xxhash
+    DIGEST_ALGORITHM = 'xxh3_128'
+except ImportError:
+    xxhash = None
+    DIGEST_ALGORITHM = 'blake2b'
+
+DIGEST_SIZE = 16
+CHUNK_SIZE = 1024 * 1024
+
+def newHasher() -> any:
+    """
+    Returns a new hash object for `DIGEST_ALGORITHM`.
+    """
+    if (xxhash != None):
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=DIGEST_SIZE)
+
+def fileDigest(path: str, throttle: any = None) -> bytes:
+    """
+    Returns the content digest of a file.
+
+    @type path: str
+    @param path: Path of the file to hash.
+    @type throttle: Throttle
+    @param throttle: Limits the file is read within.
+        (default is None, no limits)
+    """
+    hasher = newHasher()
+    with open(path,'rb') as file:
+        while True:
+            chunk = file.read(CHUNK_SIZE) if throttle == None else throttle.read(file, CHUNK_SIZE)
+            if (not chunk):
+                break
+            hasher.update(chunk)
+    return hasher.digest()
+
+def copyWithDigest(source: str, destination: str, throttle: any = None) -> bytes:
+    """
+    Copy a file and its stats like `shutil.copy2`, hashing the content as it
+    is copied, and return the content digest.
+
+    @type source: str
+    @param source: Path of the file to copy.
+    @type destination: str
+    @param destination: Path to copy the file to.
+    @type throttle: Throttle
+    @param throttle: Limits the file is read within.
+        (default is None, no limits)
+    """
+    hasher = newHasher()
+    with open(source,'rb') as sourceFile, open(destination,'wb') as destinationFile:
+        while True:
+            chunk = sourceFile.read(CHUNK_SIZE) if throttle == None else throttle.read(sourceFile, CHUNK_SIZE)
+            if (not chunk):
+                break
+            hasher.update(chunk)
+            destinationFile.write(chunk)
+    shutil.copystat(source, destination)
+    return hasher.digest()
+
+def formatDigest(digest: bytes) -> str:
+    """
+    Returns the string written to the index file for a content digest.
+
+    @type digest: bytes
+    @param digest: Content digest.
+    """
+    return f"{DIGEST_ALGORITHM}:{digest.hex()}"
+
+def parseDigest(digestString: str) -> bytes:
+    """
+    Returns the content digest from a string written to the index file, or None
+    if it was made with a different algorithm than `DIGEST_ALGORITHM`.
+
+    @type digestString: str
+    @param digestString: Digest string read from the index file.
+    """
+    algorithm, _, digestHex = digestString.partition(':')
+    if (algorithm != DIGEST_ALGORITHM):
+        return None
+    return bytes.fromhex(digestHex)
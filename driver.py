@@ -1,12 +1,33 @@
-from pathlib import Path
+import argparse
+import concurrent.futures
 import time
 import os
-import datetime
 import shutil
+import sys
+import threading
 import traceback
+from typing import Callable
 
-from file import File
-from indexfile import IndexFile
+from delta import blockSidecarPath, deltaCopy
+from checkpoint import JournaledIndexWriter, OperationLog, operationLogPath, readOperationLog
+from chunkstore import ChunkStore, isChunkLocator
+from compressor import compressFile, getCodec, isAvailable, isCompressible
+from digest import copyWithDigest, fileDigest
+from fastcopy import fastCopy
+from history import History, historyDir, listRuns, pruneHistory, resolveStoredPath
+from indexfile import parseIndexLine
+from indexstore import IndexStore, isBinaryIndex
+from indexwriter import openIndexWriter
+from journal import journalPosition, readChanges, saveChanges
+from moves import planMoves
+from pack import PackWriter, isPackLocator
+from restorer import RestoreEntry, isUnder, restoreFile, streamIndex
+from runlog import DEBUG, ERROR, INFO, WARNING, RunLog, parseLevel
+from rules import formatRules, readRules, saveRules
+from runreport import RunReport
+from scanner import scanChanges, scanTree
+from scheduler import scheduleProfiles
+from throttle import Throttle
 from backup_profile import Profile
 from tracker import Tracker
 
@@ -25,7 +46,7 @@ def readPreferences(path: str) -> dict[str, str]:
         for line in prefFile:
             firstChar = line[0]
             if (firstChar not in specialChars):
-                splitLine = line.split('=')
+                splitLine = line.split('=', 1)
                 preferences.update({splitLine[0]:splitLine[1].strip('\n')})
     except (FileNotFoundError):
         raise FileNotFoundError
@@ -33,31 +54,36 @@ def readPreferences(path: str) -> dict[str, str]:
     prefFile.close()
     return preferences
 
-def readProfiles(path: str) -> dict[str, list[Profile]]:
+def readProfiles(path: str, defaults: dict[str, str] = None) -> dict[str, list[Profile]]:
     """
     Read `profiles.txt` file and return a dictionary containing both a list
     of the executable profiles, and a list of all profiles. 
 
     @type path: str
     @param path: Path to the `profiles.txt` file. 
+    @type defaults: dict[str, str]
+    @param defaults: Attributes applied to every profile unless the profile sets them itself.
+        (default is None)
     """
     specialChars = ['\n', '#', '=']
     profiles = {'executable':[], 'all':[]}
-    profile = {}
+    if (defaults == None):
+        defaults = {}
+    profile = dict(defaults)
 
     try:
         profileFile = open(path,'r')
         for line in profileFile:
             firstChar = line[0]
             if (firstChar not in specialChars):
-                splitLine = line.split('=')
+                splitLine = line.split('=', 1)
                 profile.update({splitLine[0]:splitLine[1].strip('\n')})
             elif (firstChar == '='):
                 tempProfile = Profile(profile)
                 profiles.get('all').append(tempProfile)
                 if (tempProfile.executable == True):
                     profiles.get('executable').append(tempProfile)
-                profile.clear()
+                profile = dict(defaults)
         tempProfile = Profile(profile)
         profiles.get('all').append(tempProfile)
         if (tempProfile.executable == True):
@@ -70,28 +96,29 @@ def readProfiles(path: str) -> dict[str, list[Profile]]:
     profileFile.close()
     return profiles
 
-def readIndex(path: str) -> dict[str, IndexFile]:
+def readIndex(path: str) -> IndexStore:
     """
-    Read the index file, create IndexFile objects with the stored metadata,
-    and returns a dictionary.
+    Read the index file and return an IndexStore holding the stored metadata.
+    Both the text and the binary index formats are accepted.
 
     @type path: str
     @param path: Path to the `index.txt` file.
     """
-    Index = {}
+    if (isBinaryIndex(path)):
+        return IndexStore.load(path)
+
+    index = IndexStore()
 
     try:
-        indexFile = open(path,'r')
-        for line in indexFile:
-            if (line != '\n'):
-                currIndexFile = IndexFile(line)
-                Index.update({currIndexFile.st_ino:currIndexFile})
+        with open(path,'r') as indexFile:
+            for line in indexFile:
+                if (line != '\n'):
+                    index.addLine(line)
     except (FileNotFoundError):
-        return Index
-    finally:
-        indexFile.close()
+        pass
 
-    return Index
+    index.freeze()
+    return index
 
 def backup(profile: Profile) -> dict[str, int]:
     """
@@ -105,7 +132,7 @@ def backup(profile: Profile) -> dict[str, int]:
     indexPath = profile.getIndexPath()
     originalPath = profile.getOriginalPath()
     backupPath = profile.getBackupPath()
-    blacklist = profile.getBlacklist()
+    rules = profile.getRules()
 
     # used for program statistics
     numOfDirectories = 0
@@ -117,65 +144,366 @@ def backup(profile: Profile) -> dict[str, int]:
     copyOperationsSize = 0
     moveOperations = []
     moveOperationsSize = 0
-    indexWrites = []
+    fileMoves = []
 
-    index = readIndex(indexPath)
+    # measures the phases of the run, see `RunReport`
+    report = RunReport(profile.getName())
+    # with checkpoints, a run interrupted during its copies is resumed from
+    # its operation log, without loading the index or scanning again
+    oplogPath = operationLogPath(indexPath)
+    resumed = readOperationLog(oplogPath) if profile.getCheckpoints() else None
+    report.start('indexLoad')
+    if (resumed != None):
+        index = IndexStore()
+        index.freeze()
+    else:
+        index = readIndex(indexPath)
     indexCount = len(index)
+    report.stop(indexCount)
     tracker = Tracker(indexCount)
+    indexWriter = openIndexWriter(indexPath, profile.getIndexFormat())
+    hashMode = (profile.getChangeDetection() == 'hash')
+    unchangedByDigest = 0
+    deltaThreshold = profile.getDeltaThreshold()
+    deltaStats = {'size':0, 'written':0}
+    packThreshold = profile.getPackThreshold()
+    packWriter = None
+    if (packThreshold > 0):
+        packWriter = PackWriter(profile.getMetadataPath())
+    chunkStore = None
+    if (profile.getDedup()):
+        chunkStore = ChunkStore(profile.getDedupStore(), profile.getDedupChunkSize())
+    codec = None
+    if (profile.getCompression() != 'none'):
+        if (not isAvailable(profile.getCompression())):
+            logger(f"Compression codec {profile.getCompression()} is not available, using zlib instead.", WARNING)
+            codec = getCodec('zlib')
+        else:
+            codec = getCodec(profile.getCompression())
+    compressionStats = {'size':0, 'written':0}
+    # limits the reads and stats of the scan, hashing and copies
+    throttle = None
+    if (profile.getMaxBytesPerSecond() > 0 or profile.getMaxFilesPerSecond() > 0 or profile.getAdaptiveThrottle()):
+        throttle = Throttle(profile.getMaxBytesPerSecond(), profile.getMaxFilesPerSecond(), profile.getAdaptiveThrottle())
+    # one flag per index row, set once a scanned file accounts for the row
+    seenRows = bytearray(indexCount)
+    realOriginalPath = os.path.realpath(originalPath)
+    realBackupPath = os.path.realpath(backupPath)
+    history = None
+    if (profile.getHistory() != 'none'):
+        history = History(profile.getMetadataPath(), realBackupPath, profile.getHistory() == 'snapshots', resumed.header.get('historyRun') if resumed != None else None)
+        if (deltaThreshold > 0):
+            # delta copies change stored files in place, which earlier runs may still share
+            logger('Delta copies are not used while history is kept.')
+            deltaThreshold = 0
+    oplog = None
+    if (profile.getCheckpoints()):
+        oplog = OperationLog(oplogPath, {'historyRun':history.runId if history != None else None}, profile.getCheckpointInterval())
+        indexWriter = JournaledIndexWriter(indexWriter, oplog)
+
+        def syncCopies() -> None:
+            # copies must be on disk before the log says they are done
+            if (packWriter != None):
+                packWriter.commit()
+            if (hasattr(os, 'sync')):
+                os.sync()
 
-    print('Walking through files...')
-    for dirpath, dirnames, files in os.walk(originalPath):
-        if (indexCount > 0):
-            tracker.progressBar(numOfFiles)
+        oplog.onCheckpoint = syncCopies
+    fastIncremental = profile.getFastIncremental()
+    unchangedDir = None
+    unchangedDirs = 0
+    # directories are only trusted to be unchanged under the rules they were last scanned with
+    rulesChanged = formatRules(rules) != readRules(indexPath)
+    if (rulesChanged and indexCount > 0 and (fastIncremental or profile.getChangeJournal())):
+        logger('Rules changed since the last run, scanning every directory.')
+    if (fastIncremental):
+        report.start('indexLoad')
+        index.groupByDir()
+        report.stop()
+        if (not rulesChanged):
+            unchangedDir = index.unchangedDir
+    # the journal position is taken first, so changes made during the scan are read again next time
+    journalStart = None
+    changes = None
+    if (profile.getChangeJournal() and resumed == None):
+        journalStart = journalPosition(indexPath)
+        changes = readChanges(indexPath, journalStart, profile.getFullScanInterval()) if not rulesChanged else None
+        if (changes == None):
+            logger('Change journal cannot be used for this run, scanning the whole source directory.')
+
+    def scheduleCopy(entry: any, digest: bytes, indirect: bool = False) -> None:
+        nonlocal copyOperationsSize
+        copy = {
+            'paths':entry.real_path + '{copy-operation-separator}' + entry.stored_path,
+            'size':entry.st_size,
+            'entry':entry,
+            'digest':digest,
+            'computeDigest':hashMode and digest == None
+        }
+        if (indirect and entry.st_size < packThreshold):
+            copy.update({'pack':True})
+        elif (indirect and chunkStore != None):
+            copy.update({'dedup':True})
+        elif (deltaThreshold > 0 and entry.st_size >= deltaThreshold):
+            copy.update({
+                'sidecar':blockSidecarPath(profile.getMetadataPath(), realBackupPath, entry.stored_path),
+                'blockSize':profile.getDeltaBlockSize()
+            })
+        elif (codec != None):
+            copy.update({'compress':codec, 'level':profile.getCompressionLevel()})
+        copyOperations.append(copy)
+        copyOperationsSize += entry.st_size
+
+    def copyCompleted(copy: dict[str, any], digest: bytes) -> None:
+        # index entries of copied files are only written once the copy has landed
+        if (digest == None):
+            digest = copy.get('digest')
+        if (copy.get('locator') != None):
+            entry = copy.get('entry')
+            indexWriter.write(entry.st_ino, entry.st_mtime_ns, entry.real_path, copy.get('locator'), entry.st_size, digest)
         else:
-            print(f"{numOfFiles} Files Found", end='\r')
-        if (not any(path in dirpath for path in blacklist)):
-            numOfDirectories += 1
-            for file_name in files:
-                fullPath = Path(dirpath + '/' + file_name)
-                if (os.path.exists(fullPath)):
+            indexWriter.writeEntry(copy.get('entry'), digest, copy.get('codec'))
+        if (copy.get('sidecar') != None):
+            deltaStats['size'] += copy.get('size')
+            deltaStats['written'] += copy.get('written')
+        elif (copy.get('codec') != None):
+            compressionStats['size'] += copy.get('size')
+            compressionStats['written'] += copy.get('written')
+        if (oplog != None):
+            oplog.completed(copy, digest)
+
+    logProfile = getLogProfile()
+
+    def onScanError(path: str, error: OSError) -> None:
+        # may be called from a scanner worker thread
+        setLogProfile(logProfile)
+        logScanError(path, error)
+
+    def moveCompleted(move: dict[str, any]) -> None:
+        # files that also changed get their index entry from the copy
+        for fileMove in move.get('files'):
+            if (fileMove.get('unchanged')):
+                indexWriter.writeEntry(fileMove.get('entry'), fileMove.get('digest'), fileMove.get('codec'))
+
+    try:
+        if (resumed != None):
+            logger(f"Resume the interrupted run from its operation log ({len(resumed.completed)}/{len(resumed.copies)} copies were done)")
+            resumed.replay(indexWriter)
+            for entry, locator, digest, copyCodec in resumed.completedCopies():
+                indexWriter.write(entry.st_ino, entry.st_mtime_ns, entry.real_path, locator if locator != None else entry.stored_path, entry.st_size, digest, copyCodec)
+            for copy in resumed.copyOperations(getCodec):
+                copyOperations.append(copy)
+                copyOperationsSize += copy.get('size')
+            numOfFiles = resumed.summary.get('files')
+            numOfDirectories = resumed.summary.get('directories')
+            totalSize = resumed.summary.get('bytes')
+        else:
+            print('Walking through files...')
+            if (changes != None):
+                if (index.dirRows == None):
+                    report.start('indexLoad')
+                    index.groupByDir()
+                    report.stop()
+                keptDirs = [directory for dirId, directory in enumerate(index.dirs) if (len(index.rowsInDir(dirId)) > 0 or index.dirMtimes[dirId] >= 0) and changes.isUnchanged(directory)]
+                logger(f"Change journal: {len(changes.getDirs())} changed directories, {len(changes.getTrees())} changed trees")
+                scanDirs = scanChanges(originalPath, backupPath, rules, keptDirs, changes.getDirs(), changes.getTrees(), onError=onScanError, workers=profile.getScanWorkers(), throttle=throttle)
+            else:
+                scanDirs = scanTree(originalPath, backupPath, rules, onError=onScanError, workers=profile.getScanWorkers(), unchangedDir=unchangedDir, throttle=throttle)
+            # the scan goes on while its directories are compared with the index (the diff)
+            report.start('diff')
+            for scanDir in report.timeIterator('scan', scanDirs):
+                if (indexCount > 0):
+                    tracker.progressBar(numOfFiles)
+                else:
+                    print(f"{numOfFiles} Files Found", end='\r')
+                numOfDirectories += 1
+                storedDir = realBackupPath + scanDir.path[len(realOriginalPath):]
+                if (scanDir.trusted):
+                    # the directory is unchanged, its entries are carried over without a stat
+                    dirId = index.dirLookup.get(scanDir.path)
+                    for row in index.rowsInDir(dirId):
+                        numOfFiles += 1
+                        totalSize += max(index.getSize(row), 0)
+                        seenRows[row] = 1
+                        indexWriter.write(index.getInode(row), index.getMtime(row), index.getRealPath(row), index.getStoredPath(row), index.getSize(row), index.getDigest(row), index.getCodec(row))
+                    if (index.dirChildCounts[dirId] >= 0):
+                        indexWriter.writeDir(index.dirMtimes[dirId], index.dirChildCounts[dirId], scanDir.path, storedDir)
+                    unchangedDirs += 1
+                    continue
+                if (fastIncremental and scanDir.complete and scanDir.st_mtime_ns >= 0):
+                    indexWriter.writeDir(scanDir.st_mtime_ns, scanDir.childCount, scanDir.path, storedDir)
+                for currFile in scanDir.files:
                     numOfFiles += 1
-                    currFile = File(fullPath)
-                    currFile.setStoredPath(originalPath,backupPath)
                     totalSize += currFile.st_size
-                    if (len(index.keys()) != 0):
-                        indexSearchResult = index.get(currFile.st_ino,None)
-                        if (indexSearchResult != None):
-                            if (currFile.st_mtime_ns > indexSearchResult.st_mtime_ns):
-                                indexWrites.append(currFile.getIndexPrint())
-                                copyOperations.append({'paths':currFile.real_path + '{copy-operation-separator}' + currFile.stored_path,'size':currFile.st_size})
-                                copyOperationsSize += currFile.st_size
-                            elif (currFile.st_mtime_ns == indexSearchResult.st_mtime_ns):
-                                indexWrites.append(currFile.getIndexPrint())
+                    indexRow = index.findStored(currFile.st_ino, currFile.stored_path)
+                    moved = False
+                    # a packed file or a file in the chunk store has no stored file to
+                    # move, renaming it only changes its index entry
+                    indirectPath = None
+                    if (indexRow >= 0 and isStoredIndirectly(index.getStoredPath(indexRow))):
+                        indirectPath = index.getStoredPath(indexRow)
+                        if (index.getRealPath(indexRow) != currFile.real_path and (currFile.st_nlink > 1 or index.countRows(currFile.st_ino) > 1)):
+                            indexRow = -1
+                            indirectPath = None
+                    elif (indexRow >= 0 and index.getStoredPath(indexRow) != currFile.stored_path):
+                        # a hard linked file cannot be told apart from its other links, so it is copied
+                        if (currFile.st_nlink > 1 or index.countRows(currFile.st_ino) > 1):
+                            indexRow = -1
                         else:
-                            indexWrites.append(currFile.getIndexPrint())
-                            copyOperations.append({'paths':currFile.real_path + '{copy-operation-separator}' + currFile.stored_path,'size':currFile.st_size})
-                            copyOperationsSize += currFile.st_size
-                    else:
-                        indexWrites.append(currFile.getIndexPrint())
-                        copyOperations.append({'paths':currFile.real_path + '{copy-operation-separator}' + currFile.stored_path,'size':currFile.st_size})
-                        copyOperationsSize += currFile.st_size
-                else:
-                    # handle file not found error (should continue if the file does not exist)
-                    # print('FileNotFoundError:', fullPath)
-                    logger(f"backup() > FileNotFoundError: {fullPath}")
-        else:
-            del dirnames[:]
-    
-    if (indexCount > 0):
-        tracker.setComplete()
-        tracker.progressBar(numOfFiles)
-    else:
-        print(f"{numOfFiles} Files Found {' ' * 10}")
-   
+                            moved = True
+                    if (indexRow >= 0):
+                        seenRows[indexRow] = 1
+                    digest = None
+                    unchanged = False
+                    if (indexRow >= 0 and hashMode):
+                        indexDigest = index.getDigest(indexRow)
+                        indexSize = index.getSize(indexRow)
+                        if (currFile.st_mtime_ns == index.getMtime(indexRow) and (indexSize < 0 or currFile.st_size == indexSize)):
+                            digest = indexDigest
+                            unchanged = True
+                        else:
+                            # size or modification time changed, only copy if the content did
+                            try:
+                                digest = fileDigest(currFile.real_path, throttle)
+                            except OSError as error:
+                                logScanError(currFile.real_path, error)
+                                continue
+                            if (digest == indexDigest):
+                                unchanged = True
+                                unchangedByDigest += 1
+                    elif (indexRow >= 0):
+                        if (currFile.st_mtime_ns == index.getMtime(indexRow)):
+                            unchanged = True
+                        elif (currFile.st_mtime_ns < index.getMtime(indexRow)):
+                            continue
+                    if (moved):
+                        fileMoves.append({'entry':currFile, 'digest':digest, 'source':index.getStoredPath(indexRow), 'unchanged':unchanged, 'codec':index.getCodec(indexRow)})
+                        moveOperationsSize += currFile.st_size
+                    elif (unchanged and indirectPath != None):
+                        indexWriter.write(currFile.st_ino, currFile.st_mtime_ns, currFile.real_path, indirectPath, currFile.st_size, digest)
+                    elif (unchanged):
+                        indexWriter.writeEntry(currFile, digest, index.getCodec(indexRow))
+                    if (not unchanged):
+                        # files already stored as a file of their own stay that way
+                        scheduleCopy(currFile, digest, indexRow < 0 or indirectPath != None)
+            report.stop(numOfFiles, totalSize)
+            report.count('scan', numOfFiles, totalSize)
+
+            if (indexCount > 0):
+                tracker.setComplete()
+                tracker.progressBar(numOfFiles)
+            else:
+                print(f"{numOfFiles} Files Found {' ' * 10}")
+
+            if (fastIncremental or changes != None):
+                logger(f"Directories trusted to be unchanged: {unchangedDirs}/{numOfDirectories}")
+            if (profile.getPropagateDeletes()):
+                # stale copies are removed first, their paths may be reused by moves and copies
+                report.start('delete')
+                removedCount = removeDeletedFiles(index, seenRows, realBackupPath, profile.getMetadataPath(), profile.getCopyWorkers(), profile.getDeleteDryRun(), history)
+                report.stop(removedCount)
+            logger(f"Move files to correct destinations ({round(moveOperationsSize/1000000,3)} MB)")
+            report.start('move')
+            if (history != None):
+                for fileMove in fileMoves:
+                    try:
+                        history.preserve(fileMove.get('source'))
+                    except OSError as error:
+                        logger(f"History could not keep {fileMove.get('source')}: {type(error).__name__}: {error}", WARNING, operation='move', path=fileMove.get('source'))
+            moveOperations = planMoves(fileMoves, index, realBackupPath, profile.getMetadataPath())
+            moveFileStats = moveFiles(moveOperations, realBackupPath, moveCompleted, history)
+            report.stop(sum(1 for fileMove in fileMoves if fileMove.get('moved')), moveOperationsSize)
+            report.start('dirStats')
+            copyDirStats(moveFileStats)
+            report.stop(len(moveFileStats))
+            # unchanged files that could not be moved are copied again instead
+            for fileMove in fileMoves:
+                if (fileMove.get('unchanged') and not fileMove.get('moved')):
+                    scheduleCopy(fileMove.get('entry'), fileMove.get('digest'))
+        logger(f"Copy files to backup destination ({round(copyOperationsSize/1000000,3)} MB)")
+        if (hashMode):
+            logger(f"Files with a new modification time but unchanged content: {unchangedByDigest}")
+        if (oplog != None):
+            oplog.plan(copyOperations, {'files':numOfFiles, 'directories':numOfDirectories, 'bytes':totalSize})
+        report.start('copy')
+        copyStatDirs = copyFiles(copyOperations, copyOperationsSize, profile.getCopyWorkers(), copyCompleted, profile.getCopyBackend(), packWriter, chunkStore, history, throttle)
+        report.stop(len(copyOperations), copyOperationsSize)
+        report.start('dirStats')
+        copyDirStats(copyStatDirs)
+        report.stop(len(copyStatDirs))
+        if (chunkStore != None and chunkStore.size > 0):
+            logger(f"Deduplicated copies wrote {round(chunkStore.written/1000000,3)} MB of {round(chunkStore.size/1000000,3)} MB")
+        if (deltaStats.get('size') > 0):
+            logger(f"Delta copies rewrote {round(deltaStats.get('written')/1000000,3)} MB of {round(deltaStats.get('size')/1000000,3)} MB")
+        if (throttle != None):
+            logger(f"Throttle waits: {round(throttle.waited,3)} s across all workers" + (f", backed off {throttle.backoffs} times (longest pause {throttle.maxPause}x the read time)" if throttle.adaptive else ''))
+        if (compressionStats.get('size') > 0):
+            logger(f"Compressed copies wrote {round(compressionStats.get('written')/1000000,3)} MB of {round(compressionStats.get('size')/1000000,3)} MB")
+    except:
+        indexWriter.abort()
+        index.close()
+        report.close()
+        if (oplog != None):
+            oplog.close()
+        if (packWriter != None):
+            packWriter.commit()
+        raise
+
     logger('Write updates to index.')
-    writeToIndex(indexPath,indexWrites)
-    logger(f"Move files to correct destinations ({round(moveOperationsSize/1000000,3)} MB)")
-    moveFileStats = moveFiles(moveOperations)
-    copyDirStats(moveFileStats)
-    logger(f"Copy files to backup destination ({round(copyOperationsSize/1000000,3)} MB)")
-    copyStatDirs = copyFiles(copyOperations, copyOperationsSize)
-    copyDirStats(copyStatDirs)
+    report.start('indexWrite')
+    # packed files must be on disk before the index points at them
+    if (packWriter != None):
+        packWriter.commit()
+    if (oplog != None):
+        oplog.checkpoint()
+    index.close()
+    indexWriter.commit()
+    if (oplog != None):
+        oplog.remove()
+    report.stop(numOfFiles)
+    if (profile.getChangeJournal() and resumed == None):
+        saveChanges(indexPath, journalStart, changes == None)
+    if (rulesChanged and resumed == None):
+        saveRules(indexPath, rules)
+    if (history != None):
+        report.start('history')
+        linked = 0
+        try:
+            linked = history.finish(indexPath)
+            logger(f"History run {history.runId}: {history.displaced} earlier versions kept, {linked} files linked into the snapshot")
+            pruned = pruneHistory(profile.getMetadataPath(), profile.getHistoryKeep(), profile.getHistoryDays())
+            if (len(pruned) > 0):
+                logger(f"History runs removed: {', '.join(pruned)}")
+        except OSError as error:
+            logger(f"History could not be completed: {type(error).__name__}: {error}", WARNING)
+        report.stop(linked)
+
+    logger(f"Phase times: {report.formatPhases()}")
+    if (profile.getRunReports()):
+        report.setSummary(
+            files=numOfFiles,
+            directories=numOfDirectories,
+            bytes=totalSize,
+            options={
+                'copyWorkers':profile.getCopyWorkers(),
+                'scanWorkers':profile.getScanWorkers(),
+                'indexFormat':profile.getIndexFormat(),
+                'changeDetection':profile.getChangeDetection(),
+                'copyBackend':profile.getCopyBackend(),
+                'fastIncremental':fastIncremental,
+                'changeJournal':changes != None,
+                'resumed':resumed != None,
+                'maxBytesPerSecond':profile.getMaxBytesPerSecond(),
+                'maxFilesPerSecond':profile.getMaxFilesPerSecond(),
+                'adaptiveThrottle':profile.getAdaptiveThrottle(),
+                'compression':codec.name if codec != None else 'none'
+            }
+        )
+        try:
+            logger(f"Run report written to {report.write(indexPath)}")
+        except OSError as error:
+            logger(f"Run report could not be written: {type(error).__name__}: {error}", WARNING)
+    report.close()
 
     return {
         'numOfDirectories': numOfDirectories,
@@ -183,13 +511,235 @@ def backup(profile: Profile) -> dict[str, int]:
         'totalSize': totalSize
     }
 
-def restore() -> None:
+def isStoredIndirectly(storedPath: str) -> bool:
     """
-    Conduct restore procedure.
+    Returns true if a stored path read from the index points into a pack file
+    or the chunk store, rather than at a file of its own in the backup.
+
+    @type storedPath: str
+    @param storedPath: Stored path of an index entry.
     """
-    return None
+    return isPackLocator(storedPath) or isChunkLocator(storedPath)
 
-def writeToIndex(path: str, data: list[str]) -> None:
+def logScanError(path: str, error: OSError) -> None:
+    """
+    Log a file or directory that could not be read while scanning the source directory.
+
+    @type path: str
+    @param path: Path of the file or directory.
+    @type error: OSError
+    @param error: Error raised while reading the path.
+    """
+    logger(f"backup() > {type(error).__name__}: {path}", WARNING, operation='scan', path=path)
+
+def restore(profile: Profile, destination: str = None, prefix: str = None, overwrite: bool = False, runId: str = None) -> dict[str, int]:
+    """
+    Conduct restore procedure for a given profile and return a statistical
+    summary dictionary. The index is read as a stream (see `streamIndex`),
+    keeping only the entries below `prefix`. The directory structure is
+    created first, then the files are restored by a pool of workers in order
+    of their directory, and the stats of the directories are reapplied last,
+    deepest first, so restoring their files does not change them again.
+
+    @type profile: Profile
+    @param profile: Profile whose backup is restored.
+    @type destination: str
+    @param destination: Directory that takes the place of the original path.
+        (default is None, files are restored to where they were backed up from)
+    @type prefix: str
+    @param prefix: Directory or file to restore, absolute or relative to the original path.
+        (default is None, everything)
+    @type overwrite: bool
+    @param overwrite: Whether existing files are replaced.
+        (default is False, they are skipped)
+    @type runId: str
+    @param runId: Run of the history (see `History`) to restore the files as they were after.
+        (default is None, the latest backup)
+    """
+    realOriginalPath = os.path.realpath(profile.getOriginalPath())
+    realBackupPath = os.path.realpath(profile.getBackupPath())
+    targetRoot = realOriginalPath if destination == None else os.path.realpath(destination)
+    prefixPath = None
+    if (prefix != None):
+        prefixPath = os.path.normpath(os.path.join(realOriginalPath, prefix))
+        if (not isUnder(prefixPath, realOriginalPath)):
+            raise ValueError(f"Restore prefix is not inside the original path {realOriginalPath}: {prefix}")
+    # directories whose stats are reapplied, those of the restored subtree only
+    restoreRoot = targetRoot + (prefixPath or realOriginalPath)[len(realOriginalPath):]
+
+    indexPath = profile.getIndexPath()
+    laterRuns = None
+    if (runId != None):
+        runs = [run for run in listRuns(profile.getMetadataPath()) if os.path.exists(os.path.join(historyDir(profile.getMetadataPath()), run, 'index'))]
+        if (runId not in runs):
+            raise ValueError(f"No run {runId} in the history of {profile.getName()}, runs: {', '.join(runs)}")
+        indexPath = os.path.join(historyDir(profile.getMetadataPath()), runId, 'index')
+        laterRuns = listRuns(profile.getMetadataPath())
+        laterRuns = laterRuns[laterRuns.index(runId) + 1:]
+
+    report = RunReport(profile.getName())
+    report.start('indexLoad')
+    restores = []
+    restoreSize = 0
+    dirMtimes = {}
+    for entry in streamIndex(indexPath, prefixPath):
+        target = targetRoot + entry.real_path[len(realOriginalPath):]
+        if (laterRuns != None and not entry.is_dir):
+            entry.stored_path = resolveStoredPath(profile.getMetadataPath(), realBackupPath, runId, entry.stored_path, laterRuns)
+        if (entry.is_dir):
+            dirMtimes.update({target:entry.st_mtime_ns})
+        else:
+            restores.append((target, entry))
+            restoreSize += max(entry.st_size, 0)
+    report.stop(len(restores))
+    logger(f"Restore {len(restores)} files ({round(restoreSize/1000000,3)} MB) to {restoreRoot}")
+
+    report.start('mkdir')
+    restoreDirs = set(dirMtimes.keys())
+    for target, entry in restores:
+        directory = os.path.dirname(target)
+        while (directory not in restoreDirs and isUnder(directory, restoreRoot)):
+            restoreDirs.add(directory)
+            directory = os.path.dirname(directory)
+    failedDirs = set()
+    for directory in sorted(restoreDirs):
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError as error:
+            failedDirs.add(directory)
+            logger(f"restore() > {type(error).__name__}: {directory}", ERROR, operation='restore', path=directory)
+    if (len(restores) > 0 and not os.path.isdir(os.path.dirname(restoreRoot))):
+        os.makedirs(os.path.dirname(restoreRoot), exist_ok=True)
+    report.stop(len(restoreDirs))
+
+    report.start('copy')
+    # files of one directory are restored next to each other
+    restores.sort(key=lambda restore: restore[0])
+    results = restoreFiles(restores, restoreSize, profile, overwrite)
+    report.stop(results.get('restored'), results.get('size'))
+
+    report.start('dirStats')
+    for directory in sorted(restoreDirs - failedDirs, key=lambda directory: directory.count(os.sep), reverse=True):
+        storedDir = realBackupPath + directory[len(targetRoot):]
+        try:
+            if (os.path.isdir(storedDir)):
+                shutil.copystat(storedDir, directory)
+            # a directory record holds the modification time of the original itself
+            if (dirMtimes.get(directory) != None):
+                os.utime(directory, ns=(dirMtimes.get(directory), dirMtimes.get(directory)))
+        except OSError as error:
+            logger(f"restore() > {type(error).__name__}: {directory}", WARNING, operation='restore', path=directory)
+    report.stop(len(restoreDirs))
+    logger(f"Phase times: {report.formatPhases()}")
+    report.close()
+
+    return {
+        'numOfDirectories': len(restoreDirs),
+        'numOfFiles': results.get('restored'),
+        'skipped': results.get('skipped'),
+        'failed': results.get('failed'),
+        'totalSize': results.get('size')
+    }
+
+def restoreFiles(restores: list[tuple[str, RestoreEntry]], size: int, profile: Profile, overwrite: bool = False) -> dict[str, int]:
+    """
+    Restore files with a bounded pool of worker threads, like `copyFiles`.
+    Files are handed to the workers in batches of up to 64 files of one
+    directory, in the order given. Returns the number of files restored,
+    skipped and failed, and the bytes restored.
+
+    @type restores: list[tuple[str, RestoreEntry]]
+    @param restores: Destination path and index entry of every file, ordered by destination.
+    @type size: int
+    @param size: Total number of bytes to restore.
+    @type profile: Profile
+    @param profile: Profile whose backup is restored.
+    @type overwrite: bool
+    @param overwrite: Whether existing files are replaced.
+        (default is False, they are skipped)
+    """
+    metadataPath = profile.getMetadataPath()
+    chunkStore = ChunkStore(profile.getDedupStore(), profile.getDedupChunkSize())
+    backend = profile.getCopyBackend()
+    workers = profile.getCopyWorkers()
+    tracker = Tracker(size)
+    results = {'restored':0, 'skipped':0, 'failed':0, 'size':0}
+    methods = {}
+    maxPending = max(workers, 1) * 4
+    batchSize = 64
+    pending = set()
+
+    def completed(futures: set[concurrent.futures.Future]) -> None:
+        for future in futures:
+            pending.discard(future)
+            for result, method, fileSize in future.result():
+                results[result] += 1
+                if (result == 'restored'):
+                    results['size'] += fileSize
+                    methods.update({method:methods.get(method, 0) + 1})
+        tracker.progressBar(data=True)
+
+    print('Restoring files...')
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1), initializer=setLogProfile, initargs=(getLogProfile(),)) as executor:
+        batch = []
+        for target, entry in restores:
+            if (len(batch) > 0 and (len(batch) >= batchSize or os.path.dirname(batch[-1][0]) != os.path.dirname(target))):
+                pending.add(executor.submit(restoreBatch, batch, tracker, metadataPath, chunkStore, backend, overwrite))
+                batch = []
+                if (len(pending) >= maxPending):
+                    done, notDone = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    completed(done)
+            batch.append((target, entry))
+        if (len(batch) > 0):
+            pending.add(executor.submit(restoreBatch, batch, tracker, metadataPath, chunkStore, backend, overwrite))
+        done, notDone = concurrent.futures.wait(pending)
+        completed(done)
+
+    tracker.setComplete()
+    tracker.progressBar(data=True)
+    logger(f"Restore Operations Completed: {results.get('restored')}/{len(restores)} ({results.get('skipped')} skipped, {results.get('failed')} failed)")
+    if (len(methods) > 0):
+        logger(f"Restore methods used: {', '.join(f'{method} ({count})' for method, count in sorted(methods.items()))}")
+    return results
+
+def restoreBatch(restores: list[tuple[str, RestoreEntry]], tracker: Tracker, metadataPath: str, chunkStore: ChunkStore, backend: str = 'shutil', overwrite: bool = False) -> list[tuple[str, str, int]]:
+    """
+    Restore a batch of files with `restoreFile` and return the result of each:
+    `'restored'`, `'skipped'` or `'failed'`, the method used and the size of
+    the file. Called from the `restoreFiles` worker threads.
+
+    @type restores: list[tuple[str, RestoreEntry]]
+    @param restores: Destination path and index entry of each file.
+    @type tracker: Tracker
+    @param tracker: Tracker shared by all workers of the restore.
+    @type metadataPath: str
+    @param metadataPath: Metadata directory of the backup, holding the pack files.
+    @type chunkStore: ChunkStore
+    @param chunkStore: Chunk store of the profile.
+    @type backend: str
+    @param backend: How stored files are copied, `'kernel'` (see `fastCopy`) or `'shutil'`.
+        (default is `'shutil'`)
+    @type overwrite: bool
+    @param overwrite: Whether existing files are replaced.
+        (default is False, they are skipped)
+    """
+    results = []
+    for target, entry in restores:
+        fileSize = max(entry.st_size, 0)
+        if (not overwrite and os.path.lexists(target)):
+            results.append(('skipped', None, fileSize))
+            tracker.addCurrent(fileSize)
+            continue
+        try:
+            method = restoreFile(entry, target, metadataPath, chunkStore, backend)
+            results.append(('restored', method, fileSize))
+        except (OSError, EOFError, ValueError) as error:
+            logger(f"restore() > {type(error).__name__}: {entry.stored_path} {target}", ERROR, operation='restore', path=target)
+            results.append(('failed', None, fileSize))
+        tracker.addCurrent(fileSize)
+    return results
+
+def writeToIndex(path: str, data: list[str], indexFormat: str = 'text') -> None:
     """
     Write to `index.txt` with the new IndexFile data. 
 
@@ -197,119 +747,487 @@ def writeToIndex(path: str, data: list[str]) -> None:
     @param path: Path to the `index.txt` file. 
     @type data: list[str]
     @param data: List of strings to write to the `index.txt` file. 
+    @type indexFormat: str
+    @param indexFormat: Format of the index file, `'text'` or `'binary'`.
+        (default is `'text'`)
 
     *Note: If the index file does not exist, it will be generated at the provided path.*
     """
-    file = open(path,'w')
-
+    indexWriter = openIndexWriter(path, indexFormat)
     for line in data:
-        file.write(line + '\n')
-    
-    file.close()
+        indexWriter.write(*parseIndexLine(line))
+    indexWriter.commit()
 
-def moveFiles(operations: list[str]) -> dict[str, str]:
+def moveFiles(operations: list[dict[str, any]], backupPath: str = None, onComplete: Callable[[dict[str, any]], None] = None, history: History = None) -> dict[str, str]:
     """
-    Given a list of operations `["/old/stored/path,/new/stored/path",..]`, try to move
-    the files from the old location to the new location (to match source structure).
+    Given a list of move operations (see `moves.planMoves`), move the stored files and
+    directories from the old location to the new location (to match source structure),
+    along with their block hash sidecars, in the order given. A file is never
+    moved onto the old path of a file that has not been moved away. Every moved file is marked `moved`, and
+    directories left empty by the moves are removed.
+
+    @type operations: list[dict[str, any]]
+    @param operations: List of dictionaries describing move operations.
+    @type backupPath: str
+    @param backupPath: Resolved backup path of the profile, empty directories are removed up to it.
+        (default is None, empty directories are kept)
+    @type onComplete: Callable[[dict[str, any]], None]
+    @param onComplete: Called with every operation that was completed.
+        (default is None)
+    @type history: History
+    @param history: History of the run, a stored file a move replaces is moved into its increment.
+        (default is None, replaced files are overwritten)
 
-    @type operations: list[str]
-    @param operations: List of strings describing move operations. 
-    
     *Note: On Windows, some metadata will not be retained.
     See [here](https://docs.python.org/3/library/shutil.html) for more information.*
     """
     moveStatsDirs = {}
     operationsNum = len(operations)
     operationsCompleted = 0
+    oldDirs = set()
 
+    # one file of every cycle of moves is moved out of the way first, with its sidecar
     for move in operations:
-        operationList = move.split('{move-op}')
-        oldStoredLoc = operationList[0]
-        newStoredLoc = operationList[1]
-        oldStoredLocHead = os.path.split(oldStoredLoc)[0]
+        if (move.get('viaTemp')):
+            tempPath = move.get('source') + '.rib-move'
+            try:
+                os.rename(move.get('source'), tempPath)
+                move.update({'source':tempPath})
+            except OSError as error:
+                logger(f"moveFiles() > {type(error).__name__}: {move.get('source')}", ERROR, operation='move', path=move.get('source'))
+                continue
+            oldSidecar, newSidecar = move.get('sidecars')
+            if (os.path.lexists(oldSidecar)):
+                moveSidecar(oldSidecar, oldSidecar + '.rib-move')
+                move.update({'sidecars':(oldSidecar + '.rib-move', newSidecar)})
+
+    # files not moved yet, which must not be overwritten if a move before them failed
+    pending = set(move.get('source') for move in operations if not move.get('directory'))
+    queue = list(operations)
+    for move in queue:
+        oldStoredLoc = move.get('source')
+        newStoredLoc = move.get('destination')
         newStoredLocHead = os.path.split(newStoredLoc)[0]
         try:
             os.makedirs(newStoredLocHead,exist_ok=True)
-            if (moveStatsDirs.get(oldStoredLoc,None) == None):
-                moveStatsDirs.update({oldStoredLocHead:newStoredLocHead})
         except:
-            logger(f"moveFiles() > Error creating directories | move: {move}")
+            logger(f"moveFiles() > Error creating directories | move: {oldStoredLoc} {newStoredLoc}", ERROR, operation='move', path=newStoredLocHead)
             traceback.print_exc()
         try:
-            shutil.move(oldStoredLoc,newStoredLoc)
+            if (move.get('directory')):
+                # the directory may have been created by an earlier move, then
+                # its files are moved one by one instead
+                if (os.path.lexists(newStoredLoc)):
+                    operationsNum += len(move.get('fallback')) - 1
+                    queue.extend(move.get('fallback'))
+                    continue
+                os.rename(oldStoredLoc,newStoredLoc)
+                moveStatsDirs.update({move.get('statSource'):newStoredLoc})
+            else:
+                if (newStoredLoc in pending):
+                    logger(f"moveFiles() > Destination not moved away yet: {newStoredLoc}", ERROR, operation='move', path=newStoredLoc)
+                    continue
+                if (history != None and os.path.isfile(newStoredLoc)):
+                    history.displace(newStoredLoc)
+                shutil.move(oldStoredLoc,newStoredLoc)
+                pending.discard(oldStoredLoc)
+                moveStatsDirs.update({move.get('statSource'):newStoredLocHead})
             operationsCompleted += 1
         except (FileNotFoundError):
-            logger(f"moveFiles() > FileNotFoundError: {newStoredLoc}")
+            logger(f"moveFiles() > FileNotFoundError: {newStoredLoc}", ERROR, operation='move', path=newStoredLoc)
             continue
         except (PermissionError):
-            logger(f"moveFiles() > PermissionError: {newStoredLoc}")
+            logger(f"moveFiles() > PermissionError: {newStoredLoc}", ERROR, operation='move', path=newStoredLoc)
             continue
-    
+        except (OSError) as error:
+            logger(f"moveFiles() > {type(error).__name__}: {newStoredLoc}", ERROR, operation='move', path=newStoredLoc)
+            continue
+        oldDirs.add(os.path.split(oldStoredLoc)[0])
+        moveSidecar(*move.get('sidecars'))
+        for fileMove in move.get('files'):
+            fileMove.update({'moved':True})
+        if (onComplete != None):
+            onComplete(move)
+
+    if (backupPath != None):
+        removeEmptyDirs(oldDirs, backupPath)
     logger(f"Move Operations Completed {operationsCompleted}/{operationsNum}")
     return moveStatsDirs
 
-def copyFiles(operations: list[str], size: int) -> dict[str, str]:
+def moveSidecar(oldPath: str, newPath: str) -> None:
+    """
+    Move the block hash sidecar (or directory of sidecars) of a moved file or
+    directory, if it has one.
+
+    @type oldPath: str
+    @param oldPath: Old path of the sidecar.
+    @type newPath: str
+    @param newPath: New path of the sidecar.
     """
-    Given a list of strings `["/original/path{custom-separator}/stored/path"]` and
-    the total number of bytes to copy, copy the files from source location to the
-    backup location. 
+    if (not os.path.lexists(oldPath)):
+        return
+    try:
+        os.makedirs(os.path.split(newPath)[0],exist_ok=True)
+        os.replace(oldPath,newPath)
+    except OSError as error:
+        logger(f"moveFiles() > {type(error).__name__}: {oldPath}", ERROR, operation='move', path=oldPath)
+
+def removeEmptyDirs(dirs: set[str], backupPath: str) -> None:
+    """
+    Remove the given directories of the backup if they are empty, along with
+    any parent directories left empty, stopping at the backup path.
+
+    @type dirs: set[str]
+    @param dirs: Directories in the backup.
+    @type backupPath: str
+    @param backupPath: Resolved backup path of the profile.
+    """
+    for directory in sorted(dirs, key=len, reverse=True):
+        while (directory.startswith(backupPath + os.sep)):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.split(directory)[0]
 
-    @type operations: list[str]
-    @param operations: List of strings describing copy operations.
+def copyFiles(operations: list[dict[str, any]], size: int, workers: int = 1, onComplete: Callable[[dict[str, any], bytes], None] = None, backend: str = 'shutil', packWriter: PackWriter = None, chunkStore: ChunkStore = None, history: History = None, throttle: Throttle = None) -> dict[str, str]:
+    """
+    Given a list of copy operations `[{'paths': "/original/path{custom-separator}/stored/path", 'size': 0},..]`
+    and the total number of bytes to copy, copy the files from source location to the
+    backup location using a bounded pool of worker threads.
+
+    @type operations: list[dict[str, any]]
+    @param operations: List of dictionaries describing copy operations.
     @type size: int
     @param size: Total number of operations to be completed. 
+    @type workers: int
+    @param workers: Number of files to copy at the same time.
+        (default is 1)
+    @type onComplete: Callable[[dict[str, any], bytes], None]
+    @param onComplete: Called on the calling thread with the operation and the content
+        digest (or None) of every file that was copied successfully.
+        (default is None)
+    @type backend: str
+    @param backend: How whole files are copied, `'kernel'` (see `fastCopy`) or `'shutil'`.
+        (default is `'shutil'`)
+    @type packWriter: PackWriter
+    @param packWriter: Pack files that operations marked `pack` are appended to.
+        (default is None, every file is copied whole)
+    @type chunkStore: ChunkStore
+    @param chunkStore: Chunk store that operations marked `dedup` are stored in.
+        (default is None, every file is copied whole)
+    @type history: History
+    @param history: History the stored files replaced by the copies are moved to.
+        (default is None, they are overwritten)
+    @type throttle: Throttle
+    @param throttle: Limits the files are read within.
+        (default is None, no limits)
 
     *Note: On Windows, some metadata will not be retained.
     See [here](https://docs.python.org/3/library/shutil.html) for more information.*
     """
     copyStatDirs = {}
+    createdDirs = set()
     operationsNum = len(operations)
     operationsCompleted = 0
-    currSizeComplete = 0
     tracker = Tracker(size)
+    # keep only a few operations queued per worker, so a large operation list
+    # does not turn into a large list of pending futures
+    maxPending = max(workers, 1) * 4
+    pending = {}
+    methods = {}
+    # files packed are handed to the workers in batches, a task per file would cost more than the copy
+    packBatchSize = 256
+    packBatch = []
+
+    def completed(futures: set[concurrent.futures.Future]) -> int:
+        count = 0
+        for future in futures:
+            copies = pending.pop(future)
+            for copy, (copied, digest) in zip(copies, future.result()):
+                if (copied):
+                    count += 1
+                    method = copy.get('method')
+                    methods.update({method:methods.get(method, 0) + 1})
+                    if (onComplete != None):
+                        onComplete(copy, digest)
+        tracker.progressBar(data=True)
+        return count
+
+    def submit(executor: concurrent.futures.Executor, copies: list[tuple[dict[str, any], str, str]]) -> int:
+        pending.update({executor.submit(copyBatch, copies, tracker, backend, packWriter, chunkStore, history, throttle):[copy for copy, source, destination in copies]})
+        if (len(pending) >= maxPending):
+            done, notDone = concurrent.futures.wait(list(pending.keys()), return_when=concurrent.futures.FIRST_COMPLETED)
+            return completed(done)
+        return 0
 
     print('Copying files...')
-    for copy in operations:
-        tracker.progressBar(currSizeComplete, data=True)
-        paths = copy.get('paths')
-        operationList = paths.split('{copy-operation-separator}')
-        source = operationList[0]
-        destination = operationList[1]
-        sourcePathHead = os.path.split(source)
-        destPathHead = os.path.split(destination)
-        try:
-            os.makedirs(destPathHead[0],exist_ok=True)
-            if (copyStatDirs.get(sourcePathHead[0],None) == None):
-                copyStatDirs.update({sourcePathHead[0]:destPathHead[0]})
-        except:
-            logger(f"copyFiles() > Error created directories | operationList: {operationList}")
-            traceback.print_exc()
-        try:
-            shutil.copy2(source,destination)
-            operationsCompleted += 1
-            currSizeComplete += copy.get('size')
-        except (FileNotFoundError):
-            logger(f"copyFiles() > FileNotFoundError: {source}")
-        except (PermissionError):
-            logger(f"copyFiles() > PermissionError: {source}")
-        except (shutil.SameFileError):
-            logger(f"copyFiles() > shutil.SameFileError: {source} {destination}")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1), initializer=setLogProfile, initargs=(getLogProfile(),)) as executor:
+        for copy in operations:
+            paths = copy.get('paths')
+            operationList = paths.split('{copy-operation-separator}')
+            source = operationList[0]
+            destination = operationList[1]
+            sourcePathHead = os.path.split(source)
+            destPathHead = os.path.split(destination)
+            if (copy.get('pack') and packWriter != None):
+                # packed files are not stored under their destination
+                packBatch.append((copy, source, destination))
+                if (len(packBatch) >= packBatchSize):
+                    operationsCompleted += submit(executor, packBatch)
+                    packBatch = []
+                continue
+            # files stored in the chunk store are not stored under their destination
+            if (not (copy.get('dedup') and chunkStore != None) and destPathHead[0] not in createdDirs):
+                try:
+                    os.makedirs(destPathHead[0],exist_ok=True)
+                    createdDirs.add(destPathHead[0])
+                    if (copyStatDirs.get(sourcePathHead[0],None) == None):
+                        copyStatDirs.update({sourcePathHead[0]:destPathHead[0]})
+                except:
+                    logger(f"copyFiles() > Error created directories | operationList: {operationList}", ERROR, operation='copy', path=destPathHead[0])
+                    traceback.print_exc()
+            operationsCompleted += submit(executor, [(copy, source, destination)])
+        if (len(packBatch) > 0):
+            operationsCompleted += submit(executor, packBatch)
+        done, notDone = concurrent.futures.wait(list(pending.keys()))
+        operationsCompleted += completed(done)
 
     tracker.setComplete()
-    tracker.progressBar(currSizeComplete, data=True)
+    tracker.progressBar(data=True)
     logger(f"Copy Operations Completed: {operationsCompleted}/{operationsNum}")
+    if (len(methods) > 0):
+        logger(f"Copy methods used: {', '.join(f'{method} ({count})' for method, count in sorted(methods.items()))}")
     return copyStatDirs
 
-def removeDeletedFiles(index: dict[str, IndexFile]) -> None:
+def copyBatch(copies: list[tuple[dict[str, any], str, str]], tracker: Tracker, backend: str = 'shutil', packWriter: PackWriter = None, chunkStore: ChunkStore = None, history: History = None, throttle: Throttle = None) -> list[tuple[bool, bytes]]:
+    """
+    Copy a batch of files with `copyFile` and return the result of each.
+    Called from the `copyFiles` worker threads.
+
+    @type copies: list[tuple[dict[str, any], str, str]]
+    @param copies: The copy operation, original path and stored path of each file.
+    @type tracker: Tracker
+    @param tracker: Tracker shared by all workers of the copy operation.
+    @type backend: str
+    @param backend: How whole files are copied, `'kernel'` (see `fastCopy`) or `'shutil'`.
+        (default is `'shutil'`)
+    @type packWriter: PackWriter
+    @param packWriter: Pack files that operations marked `pack` are appended to.
+        (default is None)
+    @type chunkStore: ChunkStore
+    @param chunkStore: Chunk store that operations marked `dedup` are stored in.
+        (default is None)
+    @type history: History
+    @param history: History the stored files replaced by the copies are moved to.
+        (default is None)
+    @type throttle: Throttle
+    @param throttle: Limits the files are read within.
+        (default is None)
     """
-    Remove the deleted source files from the backup location. 
+    return [copyFile(copy, source, destination, tracker, backend, packWriter, chunkStore, history, throttle) for copy, source, destination in copies]
 
-    @type index: dict[str, IndexFile]
-    @param index: Dictionary of index files that need to be removed. 
+def copyFile(copy: dict[str, any], source: str, destination: str, tracker: Tracker, backend: str = 'shutil', packWriter: PackWriter = None, chunkStore: ChunkStore = None, history: History = None, throttle: Throttle = None) -> tuple[bool, bytes]:
     """
-    files = index.values()
-    for indexFileObject in files:
-        os.remove(indexFileObject.stored_path)
+    Copy a single file to the backup location. Returns whether it was copied,
+    and its content digest if the operation asks for one. Called from the
+    `copyFiles` worker threads. The method used is recorded in the operation
+    under `method`.
+
+    Files with a block hash `sidecar` in their operation are updated in place
+    with `deltaCopy`. Operations marked `pack` are appended to a pack file, and
+    operations marked `dedup` are stored in the chunk store. Their stored path
+    is recorded under `locator`, unless a file is already stored at the
+    destination. Operations with a `compress` codec are compressed if the file
+    looks compressible (see `isCompressible`), and the codec used is recorded
+    under `codec`. Everything else is copied whole. With a history, a file
+    already stored at the destination is moved into it first, and moved back
+    if the copy fails. With a throttle,
+    whole files are copied a chunk at a time within its limits, instead of by
+    the copy backend.
+
+    @type copy: dict[str, any]
+    @param copy: The copy operation (`size`, and the optional `computeDigest`, `sidecar`, `blockSize`, `compress` and `level`).
+    @type source: str
+    @param source: Path of the original file.
+    @type destination: str
+    @param destination: Path the file is stored at in the backup.
+    @type tracker: Tracker
+    @param tracker: Tracker shared by all workers of the copy operation.
+    @type backend: str
+    @param backend: How whole files are copied, `'kernel'` (see `fastCopy`) or `'shutil'`.
+        (default is `'shutil'`)
+    @type packWriter: PackWriter
+    @param packWriter: Pack files that operations marked `pack` are appended to.
+        (default is None)
+    @type chunkStore: ChunkStore
+    @param chunkStore: Chunk store that operations marked `dedup` are stored in.
+        (default is None)
+    @type history: History
+    @param history: History the stored file replaced by the copy is moved to.
+        (default is None, it is overwritten)
+    @type throttle: Throttle
+    @param throttle: Limits the file is read within.
+        (default is None, no limits)
+    """
+    computeDigest = copy.get('computeDigest', False)
+    digest = None
+    displaced = False
+    copied = False
+    packed = copy.get('pack') and packWriter != None
+    deduplicated = copy.get('dedup') and chunkStore != None
+    try:
+        if ((packed or deduplicated) and os.path.lexists(destination)):
+            # a file stored under the same path before is overwritten instead of left behind
+            packed = False
+            deduplicated = False
+        if (history != None and not packed and not deduplicated):
+            displaced = history.displace(destination)
+        if (throttle != None):
+            throttle.file()
+            # these read the file on their own, so it is taken from the limit as a whole
+            if (packed or deduplicated or copy.get('sidecar') != None):
+                throttle.bytes(copy.get('size'))
+        if (packed):
+            locator, digest = packWriter.append(source, computeDigest)
+            copy.update({'locator':locator, 'method':'pack'})
+        elif (deduplicated):
+            locator, digest, written = chunkStore.store(source, computeDigest)
+            copy.update({'locator':locator, 'method':'dedup'})
+        elif (copy.get('sidecar') != None):
+            written, digest = deltaCopy(source, destination, copy.get('sidecar'), copy.get('blockSize'), computeDigest)
+            copy.update({'written':written, 'method':'delta'})
+        elif (copy.get('compress') != None and isCompressible(source, copy.get('size'))):
+            written, digest = compressFile(source, destination, copy.get('compress'), copy.get('level'), computeDigest, throttle)
+            copy.update({'written':written, 'codec':copy.get('compress').name, 'method':copy.get('compress').name})
+        elif (computeDigest):
+            digest = copyWithDigest(source,destination, throttle)
+            copy.update({'method':'digest'})
+        elif (throttle != None):
+            throttle.copyFile(source, destination)
+            copy.update({'method':'throttled'})
+        elif (backend == 'kernel'):
+            copy.update({'method':fastCopy(source,destination)})
+        else:
+            shutil.copy2(source,destination)
+            copy.update({'method':'shutil'})
+        copied = True
+        tracker.addCurrent(copy.get('size'))
+        return (True, digest)
+    except (FileNotFoundError):
+        logger(f"copyFiles() > FileNotFoundError: {source}", ERROR, operation='copy', path=source)
+    except (PermissionError):
+        logger(f"copyFiles() > PermissionError: {source}", ERROR, operation='copy', path=source)
+    except (shutil.SameFileError):
+        logger(f"copyFiles() > shutil.SameFileError: {source} {destination}", ERROR, operation='copy', path=source)
+    finally:
+        # the index still points at the stored version until a copy replaces it
+        if (displaced and not copied):
+            try:
+                history.restore(destination)
+            except OSError as error:
+                logger(f"History could not restore {destination}: {type(error).__name__}: {error}", ERROR, operation='copy', path=destination)
+    return (False, None)
+
+def removeDeletedFiles(index: IndexStore, seenRows: bytearray, backupPath: str, metadataPath: str, workers: int = 1, dryRun: bool = False, history: History = None) -> int:
+    """
+    Remove the deleted source files from the backup location, and return the
+    number of files removed (or that would be removed, in a dry run).
+
+    Every index entry whose row was not seen during the scan is a candidate. It
+    is only removed if nothing exists at its original path anymore, so files in
+    directories that could not be read are kept. Files are removed in batches
+    by a pool of worker threads, along with their block hash sidecars, and
+    directories left empty are removed afterwards.
+
+    @type index: IndexStore
+    @param index: The loaded index.
+    @type seenRows: bytearray
+    @param seenRows: One flag per index row, non zero if the row was seen during the scan.
+    @type backupPath: str
+    @param backupPath: Resolved backup path of the profile.
+    @type metadataPath: str
+    @param metadataPath: Metadata directory of the backup.
+    @type workers: int
+    @param workers: Number of batches removed at the same time.
+        (default is 1)
+    @type dryRun: bool
+    @param dryRun: Only log the files that would be removed.
+        (default is False)
+    @type history: History
+    @param history: History the removed files are moved to.
+        (default is None, they are deleted)
+    """
+    batchSize = 256
+    stalePaths = set()
+    row = seenRows.find(0)
+    while (row >= 0):
+        storedPath = index.getStoredPath(row)
+        if (storedPath.startswith(backupPath + os.sep) and not os.path.lexists(index.getRealPath(row))):
+            stalePaths.add(storedPath)
+        row = seenRows.find(0, row + 1)
+
+    stalePaths = sorted(stalePaths)
+    if (dryRun):
+        for storedPath in stalePaths:
+            logger(f"Would remove deleted file: {storedPath}", operation='remove', path=storedPath)
+        logger(f"Deleted files that would be removed: {len(stalePaths)}")
+        return len(stalePaths)
+
+    logger(f"Remove deleted files from the backup ({len(stalePaths)} files)")
+    removedCount = 0
+    removedDirs = set()
+    sidecarDirs = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1), initializer=setLogProfile, initargs=(getLogProfile(),)) as executor:
+        batches = [stalePaths[start:start + batchSize] for start in range(0, len(stalePaths), batchSize)]
+        for removed, errors in executor.map(removeBatch, batches, [backupPath] * len(batches), [metadataPath] * len(batches), [history] * len(batches)):
+            removedCount += len(removed)
+            for storedPath in removed:
+                removedDirs.add(os.path.split(storedPath)[0])
+                sidecarDirs.add(os.path.split(blockSidecarPath(metadataPath, backupPath, storedPath))[0])
+            for storedPath, error in errors:
+                logger(f"removeDeletedFiles() > {type(error).__name__}: {storedPath}", ERROR, operation='remove', path=storedPath)
+    removeEmptyDirs(removedDirs, backupPath)
+    removeEmptyDirs(sidecarDirs, metadataPath)
+    logger(f"Remove Operations Completed: {removedCount}/{len(stalePaths)}")
+    return removedCount
+
+def removeBatch(paths: list[str], backupPath: str, metadataPath: str, history: History = None) -> tuple[list[str], list[tuple[str, OSError]]]:
+    """
+    Remove a batch of stored files and their block hash sidecars. Returns the
+    paths that were removed (or were already gone), and the paths that could
+    not be removed along with the error. Called from the `removeDeletedFiles`
+    worker threads.
+
+    @type paths: list[str]
+    @param paths: Paths of the stored files.
+    @type backupPath: str
+    @param backupPath: Resolved backup path of the profile.
+    @type metadataPath: str
+    @param metadataPath: Metadata directory of the backup.
+    @type history: History
+    @param history: History the removed files are moved to.
+        (default is None, they are deleted)
+    """
+    removed = []
+    errors = []
+    for storedPath in paths:
+        try:
+            if (history != None):
+                history.displace(storedPath)
+            else:
+                os.remove(storedPath)
+        except (FileNotFoundError):
+            pass
+        except OSError as error:
+            errors.append((storedPath, error))
+            continue
+        removed.append(storedPath)
+        try:
+            os.remove(blockSidecarPath(metadataPath, backupPath, storedPath))
+        except OSError:
+            pass
+    return (removed, errors)
 
 def copyDirStats(dirMap: dict[str, str]) -> None:
     """
@@ -325,22 +1243,138 @@ def copyDirStats(dirMap: dict[str, str]) -> None:
         currVal = dirMap.get(key)
         shutil.copystat(key,currVal)
 
-def logger(message: str = '') -> None:
+# name of the profile a thread is working on, added to its log messages
+# while several profiles run at the same time
+logContext = threading.local()
+logLock = threading.Lock()
+runLog = None
+
+def setLogProfile(name: str) -> None:
+    """
+    Set the profile name added to log messages written by the current thread.
+
+    @type name: str
+    @param name: Name of the profile, or None to stop adding one.
+    """
+    logContext.profile = name
+
+def getLogProfile() -> str:
+    """
+    Returns the profile name added to log messages written by the current thread, or None.
     """
-    Writes a formatted log message to a specified log file. 
+    return getattr(logContext, 'profile', None)
+
+def getRunLog() -> RunLog:
+    """
+    Returns the RunLog writing `backup.log`, opening it on first use.
+    """
+    global runLog
+    with logLock:
+        if (runLog == None):
+            runLog = RunLog('backup.log')
+        return runLog
+
+def configureLogger(preferences: dict[str, str]) -> None:
+    """
+    Apply the `logLevel` and `logFormat` preferences to the log.
+
+    @type preferences: dict[str, str]
+    @param preferences: Dictionary with the preferences.
+    """
+    log = getRunLog()
+    try:
+        log.level = parseLevel(preferences.get('logLevel', 'info'))
+    except ValueError:
+        logger(f"Invalid logLevel preference: {preferences.get('logLevel')}", WARNING)
+    logFormat = preferences.get('logFormat', 'text').strip().lower()
+    if (logFormat not in ['text', 'json']):
+        logger(f"Invalid logFormat preference: {logFormat}", WARNING)
+    else:
+        log.logFormat = logFormat
+
+def closeLogger() -> None:
+    """
+    Write every buffered log message and close the log.
+    """
+    global runLog
+    with logLock:
+        if (runLog != None):
+            runLog.close()
+            runLog = None
+
+def logger(message: str = '', level: int = INFO, **fields: any) -> None:
+    """
+    Writes a formatted log message to a specified log file. Messages are
+    buffered and written by a background thread (see `RunLog`), so this is
+    cheap to call from any thread.
 
     @type message: str
     @param message: Message to be logged. 
         (Default is `''`)
+    @type level: int
+    @param level: Level of the message (`DEBUG`, `INFO`, `WARNING` or `ERROR`).
+        (Default is `INFO`)
+    @type fields: any
+    @param fields: Structured fields of the message, such as `operation` and `path`.
+        The profile of the current thread is added as `profile`.
+    """
+    profileName = getLogProfile()
+    if (profileName != None and 'profile' not in fields):
+        fields.update({'profile':profileName})
+    getRunLog().log(message, level, **fields)
+
+def restoreMain(args: list[str]) -> None:
+    """
+    Restore a profile from the command line:
+    `driver.py restore <profile> [--to DIR] [--prefix PATH] [--overwrite] [--run RUN] [--list-runs]`.
+
+    @type args: list[str]
+    @param args: Command line arguments following `restore`.
     """
-    currTime = datetime.datetime.now()
-    # timestampString = f"[{currTime.strftime("%Y-%m-%d %H:%M:%S %z")}]" # UTC offset does not display
-    timestampString = f"[{currTime.strftime('%Y-%m-%d %H:%M:%S')}]"
-    file = open('backup.log','a+')
-    file.write(f"{timestampString} {message}\n")
-    file.close()
+    parser = argparse.ArgumentParser(prog='driver.py restore', description='Restore the backup of a profile.')
+    parser.add_argument('profile', help='name of the profile to restore')
+    parser.add_argument('--to', dest='destination', default=None, help='directory to restore to in place of the original path (default is the original path)')
+    parser.add_argument('--prefix', default=None, help='directory or file to restore, absolute or relative to the original path (default is everything)')
+    parser.add_argument('--overwrite', action='store_true', help='replace files that already exist (default is to skip them)')
+    parser.add_argument('--run', dest='runId', default=None, help='run of the history to restore the files as they were after (default is the latest backup)')
+    parser.add_argument('--list-runs', action='store_true', help='list the runs of the history and exit')
+    options = parser.parse_args(args)
+
+    logger('RESTORE STARTING')
+    try:
+        prefs = readPreferences('preferences.txt')
+    except FileNotFoundError:
+        logger('Error reading preferences.txt. May be missing or is named incorrectly.', ERROR)
+        print('Error reading preferences.txt. May be missing or is named incorrectly.')
+        exit(1)
+    configureLogger(prefs)
+    profiles = [profile for profile in readProfiles(prefs.get('profiles'), prefs).get('all') if profile.getName() == options.profile]
+    if (len(profiles) == 0):
+        logger(f"No profile named {options.profile}", ERROR)
+        print(f"No profile named {options.profile}")
+        closeLogger()
+        exit(1)
+    if (options.list_runs):
+        for runId in listRuns(profiles[0].getMetadataPath()):
+            print(runId)
+        closeLogger()
+        return
+    start = time.time()
+    try:
+        results = restore(profiles[0], options.destination, options.prefix, options.overwrite, options.runId)
+        restoreStats = f"RESTORE STATS ({options.profile}):\nFiles Restored: {results.get('numOfFiles')} ({results.get('skipped')} skipped, {results.get('failed')} failed)\nDirectories: {results.get('numOfDirectories')}\nTotal Size: {round(results.get('totalSize')/1000000,3)} MB\nTotal Time: {round(time.time() - start,3)} Seconds"
+        logger(restoreStats)
+        print(restoreStats)
+    except:
+        logger('Restore failed due to an error.', ERROR)
+        logger(traceback.format_exc(), DEBUG)
+        traceback.print_exc()
+    closeLogger()
 
 def main() -> None:
+    if (len(sys.argv) > 1 and sys.argv[1] == 'restore'):
+        restoreMain(sys.argv[2:])
+        return
     open('backup.log','w').close()
 
     logger('MAIN METHOD STARTING')
@@ -352,16 +1386,26 @@ def main() -> None:
         # profiles = readProfiles('profiles.txt')
         prefs = readPreferences('preferences.txt')
     except FileNotFoundError:
-        logger('Error reading preferences.txt. May be missing or is named incorrectly.')
+        logger('Error reading preferences.txt. May be missing or is named incorrectly.', ERROR)
         print('Error reading preferences.txt. May be missing or is named incorrectly.')
         exit()
+    configureLogger(prefs)
     try:
-        profiles = readProfiles(prefs.get('profiles'))
+        profiles = readProfiles(prefs.get('profiles'), prefs)
     except FileNotFoundError:
-        logger('Error reading profiles file. May be missing or is named incorrectly.')
+        logger('Error reading profiles file. May be missing or is named incorrectly.', ERROR)
         print('Error reading profiles file. May be missing or is named incorrectly.')
-    for profile in profiles.get('executable'):
-        print(f"Executing '{profile.getName()}' ({profiles.get('executable').index(profile) + 1}/{len(profiles.get('executable'))})")
+    executable = profiles.get('executable')
+    try:
+        profileWorkers = max(int(prefs.get('profileWorkers', '1').strip()), 1)
+    except ValueError:
+        logger(f"Invalid profileWorkers preference: {prefs.get('profileWorkers')}", WARNING)
+        profileWorkers = 1
+
+    def runProfile(profile: Profile) -> None:
+        if (profileWorkers > 1):
+            setLogProfile(profile.getName())
+        print(f"Executing '{profile.getName()}' ({executable.index(profile) + 1}/{len(executable)})")
         start = time.time()
         logger(f"Begin backup process for profile {profile.getName()}")
         try:
@@ -375,14 +1419,21 @@ def main() -> None:
             totalSize = f"Total Size Of Original Files: {totalSizeBytes} bytes | {totalSizeMegaBytes} MB | {totalSizeGigaBytes} GB"
             totalTime = f"Total Profile Execution Time: {round(end - start,3)} Seconds"
             logger(f"PROFILE STATS:\n{numOfFiles}\n{numOfDirectories}\n{totalSize}\n{totalTime}")
-            print(f"PROFILE STATS:\n{numOfFiles}\n{numOfDirectories}\n{totalSize}\n{totalTime}")
+            print(f"PROFILE STATS ({profile.getName()}):\n{numOfFiles}\n{numOfDirectories}\n{totalSize}\n{totalTime}")
         except:
-            logger(f"Profile backup failed due to an error.")
+            logger(f"Profile backup failed due to an error.", ERROR)
+            logger(traceback.format_exc(), DEBUG)
             traceback.print_exc()
+        finally:
+            setLogProfile(None)
+
+    # profiles that share a disk are run one after another, see `scheduleProfiles`
+    scheduleProfiles(executable, runProfile, profileWorkers)
 
     programEnd = time.time()
     logger(f"PROGRAM RUNTIME: {round(programEnd - programStart, 3)} Seconds")
     logger('MAIN METHOD COMPLETED')
+    closeLogger()
 
 if (__name__ == '__main__'):
     main()
@@ -0,0 +1,146 @@
+import errno
+import os
+import shutil
+import sys
+import threading
+
+# fcntl is only available on Unix systems
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request to clone a whole file on btrfs and XFS (linux/fs.h)
+FICLONE = 0x40049409
+BUFFER_SIZE = 1024 * 1024
+# errors meaning a copy method does not work for a pair of files,
+# rather than that the copy itself failed
+UNSUPPORTED_ERRORS = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.ETXTBSY}
+if (hasattr(errno, 'ENOTSUP')):
+    UNSUPPORTED_ERRORS.add(errno.ENOTSUP)
+
+# (method, source device, destination device) pairs a method failed on,
+# so it is not tried again for every file of the run
+unsupported = set()
+unsupportedLock = threading.Lock()
+
+def isUnsupported(method: str, devices: tuple[int, int]) -> bool:
+    """
+    Returns true if the copy method already failed on the pair of devices this run.
+    """
+    with unsupportedLock:
+        return (method, devices) in unsupported
+
+def setUnsupported(method: str, devices: tuple[int, int]) -> None:
+    """
+    Record that the copy method is not supported on the pair of devices.
+    """
+    with unsupportedLock:
+        unsupported.add((method, devices))
+
+def copyFileRange(sourceFd: int, destinationFd: int, offset: int, size: int) -> int:
+    """
+    Copy from `offset` to `size` with `os.copy_file_range` and return the offset reached.
+    """
+    while (offset < size):
+        copied = os.copy_file_range(sourceFd, destinationFd, size - offset, offset, offset)
+        if (copied == 0):
+            break
+        offset += copied
+    return offset
+
+def reflink(sourceFd: int, destinationFd: int, offset: int, size: int) -> int:
+    """
+    Clone the whole file with the FICLONE ioctl and return the offset reached.
+    """
+    if (offset != 0):
+        raise OSError(errno.EINVAL, 'reflink only clones whole files')
+    fcntl.ioctl(destinationFd, FICLONE, sourceFd)
+    return size
+
+def sendfile(sourceFd: int, destinationFd: int, offset: int, size: int) -> int:
+    """
+    Copy from `offset` to `size` with `os.sendfile` and return the offset reached.
+    """
+    os.lseek(destinationFd, offset, os.SEEK_SET)
+    while (offset < size):
+        sent = os.sendfile(destinationFd, sourceFd, offset, min(size - offset, 1024 * 1024 * 1024))
+        if (sent == 0):
+            break
+        offset += sent
+    return offset
+
+def bufferCopy(sourceFd: int, destinationFd: int, offset: int, size: int) -> int:
+    """
+    Copy from `offset` to the end of the source through a buffer and return the offset reached.
+    """
+    os.lseek(sourceFd, offset, os.SEEK_SET)
+    os.lseek(destinationFd, offset, os.SEEK_SET)
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(sourceFd, 'rb', buffering=0, closefd=False) as sourceFile:
+        while True:
+            read = sourceFile.readinto(buffer)
+            if (not read):
+                break
+            written = 0
+            while (written < read):
+                written += os.write(destinationFd, view[written:read])
+            offset += read
+    return offset
+
+# copy methods in the order they are tried
+COPY_METHODS = []
+if (hasattr(os, 'copy_file_range')):
+    COPY_METHODS.append(('copy_file_range', copyFileRange))
+if (fcntl != None and sys.platform.startswith('linux')):
+    COPY_METHODS.append(('reflink', reflink))
+if (hasattr(os, 'sendfile') and sys.platform.startswith('linux')):
+    COPY_METHODS.append(('sendfile', sendfile))
+
+def fastCopy(source: str, destination: str) -> str:
+    """
+    Copy a file and its stats like `shutil.copy2`, using the fastest copy method
+    the kernel supports for the pair of files, and return the name of the method
+    that finished the copy.
+
+    Methods are tried in order: `copy_file_range`, a FICLONE reflink (btrfs/XFS),
+    `sendfile`, and finally a plain buffered copy. A method that fails because it
+    is not supported is skipped for the rest of the run on the same pair of devices.
+
+    @type source: str
+    @param source: Path of the file to copy.
+    @type destination: str
+    @param destination: Path to copy the file to.
+    """
+    try:
+        if (os.path.samefile(source, destination)):
+            raise shutil.SameFileError(f"{source} and {destination} are the same file")
+    except (FileNotFoundError):
+        pass
+
+    with open(source,'rb') as sourceFile, open(destination,'wb') as destinationFile:
+        sourceFd = sourceFile.fileno()
+        destinationFd = destinationFile.fileno()
+        sourceStats = os.fstat(sourceFd)
+        devices = (sourceStats.st_dev, os.fstat(destinationFd).st_dev)
+        size = sourceStats.st_size
+        offset = 0
+        method = 'buffer'
+        for name, copyMethod in COPY_METHODS:
+            if (isUnsupported(name, devices)):
+                continue
+            try:
+                offset = copyMethod(sourceFd, destinationFd, offset, size)
+                method = name
+                break
+            except OSError as error:
+                if (error.errno not in UNSUPPORTED_ERRORS):
+                    raise
+                setUnsupported(name, devices)
+        # also picks up anything appended to the source during the copy
+        offset = bufferCopy(sourceFd, destinationFd, offset, size)
+        os.ftruncate(destinationFd, offset)
+
+    shutil.copystat(source, destination)
+    return method
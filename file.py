@@ -1,5 +1,66 @@
 import os
 
+def formatIndexLine(st_ino: int, st_mtime_ns: int, real_path: str, stored_path: str, extras: dict[str, str] = None) -> str:
+    """
+    Return string containing all necessary data for writing a file to the index file.
+    Optional fields are appended as `key=value` pairs after the stored path.
+
+    ```
+    # Return String Formats:
+    f"{st_ino}[index-sep]{st_mtime_ns}[index-sep]{real_path}[index-sep]{store_path}"
+    f"{st_ino},{st_mtime_ns},{real_path},{store_path}"
+    f"{st_ino},{st_mtime_ns},{real_path},{store_path},size={st_size},digest={digest}"
+    ```
+
+    @type st_ino: int
+    @param st_ino: Inode number of the file.
+    @type st_mtime_ns: int
+    @param st_mtime_ns: Last modification time of the file in nanoseconds.
+    @type real_path: str
+    @param real_path: Path of the original file.
+    @type stored_path: str
+    @param stored_path: Path the file is stored at in the backup.
+    @type extras: dict[str, str]
+    @param extras: Optional fields to append.
+        (default is None)
+    """
+    commaCount = real_path.count(',') + stored_path.count(',')
+    if (commaCount > 0):
+        separator = '[index-sep]'
+    else:
+        separator = ','
+    fields = [str(st_ino), str(st_mtime_ns), real_path, stored_path]
+    if (extras != None):
+        fields.extend(f"{key}={value}" for key, value in extras.items())
+    return separator.join(fields)
+
+def formatDirLine(st_mtime_ns: int, childCount: int, real_path: str, stored_path: str) -> str:
+    """
+    Return string containing a directory record for the index file. Directory
+    records start with a `D` so they can be told apart from file entries.
+
+    ```
+    # Return String Formats:
+    f"D[index-sep]{st_mtime_ns}[index-sep]{childCount}[index-sep]{real_path}[index-sep]{store_path}"
+    f"D,{st_mtime_ns},{childCount},{real_path},{store_path}"
+    ```
+
+    @type st_mtime_ns: int
+    @param st_mtime_ns: Last modification time of the directory in nanoseconds.
+    @type childCount: int
+    @param childCount: Number of files and directories in the directory.
+    @type real_path: str
+    @param real_path: Path of the original directory.
+    @type stored_path: str
+    @param stored_path: Path the directory is stored at in the backup.
+    """
+    commaCount = real_path.count(',') + stored_path.count(',')
+    if (commaCount > 0):
+        separator = '[index-sep]'
+    else:
+        separator = ','
+    return separator.join(['D', str(st_mtime_ns), str(childCount), real_path, stored_path])
+
 class File:
     """
     ## File
@@ -139,13 +200,7 @@ class File:
         f"{st_ino},{st_mtime_ns},{real_path},{store_path}"
         ```
         """
-        commaCount = self.real_path.count(',') + self.stored_path.count(',')
-        if (commaCount > 0):
-            returnStr = f"{self.st_ino}[index-sep]{self.st_mtime_ns}[index-sep]{self.real_path}[index-sep]{self.stored_path}"
-        else:
-            returnStr = f"{self.st_ino},{self.st_mtime_ns},{self.real_path},{self.stored_path}"
-
-        return returnStr
+        return formatIndexLine(self.st_ino, self.st_mtime_ns, self.real_path, self.stored_path)
 
     def newStoredPath(self, originalPath: str, backupPath: str, indexPath: str) -> bool:
         """
@@ -0,0 +1,232 @@
+import datetime
+import os
+import shutil
+import threading
+
+from restorer import streamIndex
+
+def historyDir(metadataPath: str) -> str:
+    """
+    Returns the directory holding the history of a backup, one directory per run.
+
+    @type metadataPath: str
+    @param metadataPath: Metadata directory of the backup.
+    """
+    return os.path.join(metadataPath, 'history')
+
+def listRuns(metadataPath: str) -> list[str]:
+    """
+    Returns the ids of the runs in the history of a backup, oldest first.
+
+    @type metadataPath: str
+    @param metadataPath: Metadata directory of the backup.
+    """
+    try:
+        names = os.listdir(historyDir(metadataPath))
+    except (FileNotFoundError):
+        return []
+    return sorted(name for name in names if name[:8].isdigit())
+
+def runTime(runId: str) -> datetime.datetime:
+    """
+    Returns the time a run started from its id.
+
+    @type runId: str
+    @param runId: Id of the run (`YYYYMMDD-HHMMSS`, with an optional `-N` suffix).
+    """
+    return datetime.datetime.strptime(runId[:15], '%Y%m%d-%H%M%S')
+
+def pruneHistory(metadataPath: str, keep: int = 0, days: int = 0) -> list[str]:
+    """
+    Remove the oldest runs from the history and return their ids. A run is
+    removed once `keep` newer runs exist, or once it is older than `days`
+    days. Only links and the versions no other run refers to are removed, so
+    pruning never copies data.
+
+    @type metadataPath: str
+    @param metadataPath: Metadata directory of the backup.
+    @type keep: int
+    @param keep: Number of runs to keep.
+        (default is 0, no limit)
+    @type days: int
+    @param days: Age in days after which runs are removed.
+        (default is 0, no limit)
+    """
+    runs = listRuns(metadataPath)
+    pruned = []
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+    for number, runId in enumerate(runs):
+        if ((keep > 0 and len(runs) - number > keep) or (days > 0 and runTime(runId) < cutoff)):
+            shutil.rmtree(os.path.join(historyDir(metadataPath), runId))
+            pruned.append(runId)
+    return pruned
+
+class History:
+    """
+    ## History
+    The History class keeps the earlier versions of the files of a backup,
+    making the backup a reverse incremental one. The backup path stays a full
+    mirror of the latest run. Every run gets a directory in the history
+    (see `historyDir`) holding:
+
+    - `increment/` - the stored files the run replaced or removed, moved out
+      of the mirror before they are replaced, and links to the files it moved
+      to another path, at their old path in the backup.
+    - `index` - a hard link to the index the run wrote.
+    - `snapshot/` - with snapshots on, a hard link to every stored file as it
+      was after the run, so the run can be browsed as a plain directory tree.
+
+    Files are moved and linked, never copied, so keeping the history costs no
+    data written beyond the new versions themselves. Stored files are never
+    changed in place while the history is kept, since a snapshot may share them.
+    """
+    def __init__(self, metadataPath: str, backupPath: str, snapshots: bool = False, runId: str = None):
+        """
+        @type metadataPath: str
+        @param metadataPath: Metadata directory of the backup.
+        @type backupPath: str
+        @param backupPath: Resolved backup path of the profile.
+        @type snapshots: bool
+        @param snapshots: Whether to link a snapshot of every run.
+            (default is False)
+        @type runId: str
+        @param runId: Id of an interrupted run to continue.
+            (default is None, start a new run)
+        """
+        self.metadataPath = metadataPath
+        self.backupPath = backupPath
+        self.snapshots = snapshots
+        self.lock = threading.Lock()
+        self.displaced = 0
+        if (runId == None):
+            runId = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+            suffix = 1
+            while (os.path.exists(os.path.join(historyDir(metadataPath), runId))):
+                runId = datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + f"-{suffix}"
+                suffix += 1
+        self.runId = runId
+        self.runPath = os.path.join(historyDir(metadataPath), runId)
+        os.makedirs(self.runPath, exist_ok=True)
+
+    def displace(self, storedPath: str) -> bool:
+        """
+        Move a stored file that is about to be replaced or removed into the
+        increment of this run. Returns false if there is no file to move, or
+        if the path was displaced by this run before. Then the increment keeps
+        the version the earlier runs left behind, and the file is only removed,
+        since it was moved or copied there by this run and is kept elsewhere.
+        Safe to call from the copy and remove workers.
+
+        @type storedPath: str
+        @param storedPath: Path of the stored file in the backup.
+        """
+        incrementPath = self.runPath + os.sep + 'increment' + storedPath[len(self.backupPath):]
+        if (os.path.lexists(incrementPath)):
+            try:
+                os.remove(storedPath)
+            except (FileNotFoundError):
+                pass
+            return False
+        try:
+            os.rename(storedPath, incrementPath)
+        except (FileNotFoundError):
+            if (not os.path.lexists(storedPath)):
+                return False
+            os.makedirs(os.path.dirname(incrementPath), exist_ok=True)
+            os.rename(storedPath, incrementPath)
+        with self.lock:
+            self.displaced += 1
+        return True
+
+    def restore(self, storedPath: str) -> None:
+        """
+        Move a file displaced by this run back to its stored path, over
+        anything written there since, when the copy replacing it failed.
+
+        @type storedPath: str
+        @param storedPath: Path of the stored file in the backup.
+        """
+        incrementPath = self.runPath + os.sep + 'increment' + storedPath[len(self.backupPath):]
+        os.replace(incrementPath, storedPath)
+        with self.lock:
+            self.displaced -= 1
+
+    def preserve(self, storedPath: str) -> bool:
+        """
+        Link a stored file that is about to be moved to another path into the
+        increment of this run, so earlier runs still find it at its old path.
+        Returns false if there is no file to link.
+
+        @type storedPath: str
+        @param storedPath: Path of the stored file in the backup.
+        """
+        incrementPath = self.runPath + os.sep + 'increment' + storedPath[len(self.backupPath):]
+        try:
+            os.makedirs(os.path.dirname(incrementPath), exist_ok=True)
+            os.link(storedPath, incrementPath)
+        except (FileNotFoundError, FileExistsError):
+            return False
+        return True
+
+    def finish(self, indexPath: str) -> int:
+        """
+        Link the index written by this run into its history directory and,
+        with snapshots on, link every stored file into its snapshot. Called
+        once the index has been committed. Returns the number of files linked.
+
+        @type indexPath: str
+        @param indexPath: Path to the index file of the profile.
+        """
+        try:
+            os.link(indexPath, os.path.join(self.runPath, 'index'))
+        except OSError:
+            # the index may be on another file system than the backup
+            shutil.copy2(indexPath, os.path.join(self.runPath, 'index'))
+        if (not self.snapshots):
+            return 0
+        snapshotPath = os.path.join(self.runPath, 'snapshot')
+        createdDirs = set()
+        linked = 0
+        for entry in streamIndex(indexPath):
+            if (entry.is_dir or not entry.stored_path.startswith(self.backupPath + os.sep)):
+                continue
+            linkPath = snapshotPath + entry.stored_path[len(self.backupPath):]
+            linkDir = os.path.dirname(linkPath)
+            if (linkDir not in createdDirs):
+                os.makedirs(linkDir, exist_ok=True)
+                createdDirs.add(linkDir)
+            try:
+                os.link(entry.stored_path, linkPath)
+                linked += 1
+            except (FileNotFoundError, FileExistsError):
+                pass
+        return linked
+
+def resolveStoredPath(metadataPath: str, backupPath: str, runId: str, storedPath: str, laterRuns: list[str]) -> str:
+    """
+    Returns where the version of a stored file that a run left behind is kept
+    now: in the snapshot of the run if it has one, else in the increment of
+    the first later run that replaced or removed the file, else in the mirror.
+
+    @type metadataPath: str
+    @param metadataPath: Metadata directory of the backup.
+    @type backupPath: str
+    @param backupPath: Resolved backup path of the profile.
+    @type runId: str
+    @param runId: Id of the run being restored.
+    @type storedPath: str
+    @param storedPath: Path of the file in the backup, as recorded in the index of the run.
+    @type laterRuns: list[str]
+    @param laterRuns: Ids of the runs after it, oldest first.
+    """
+    if (not storedPath.startswith(backupPath + os.sep)):
+        return storedPath
+    relativePath = storedPath[len(backupPath):]
+    snapshotPath = os.path.join(historyDir(metadataPath), runId, 'snapshot') + relativePath
+    if (os.path.lexists(snapshotPath)):
+        return snapshotPath
+    for laterRun in laterRuns:
+        incrementPath = os.path.join(historyDir(metadataPath), laterRun, 'increment') + relativePath
+        if (os.path.lexists(incrementPath)):
+            return incrementPath
+    return storedPath
@@ -1,5 +1,62 @@
 from file import File
 
+def parseIndexEntry(indexString: str) -> tuple[int, int, str, str, dict[str, str]]:
+    """
+    Returns a tuple `(st_ino, st_mtime_ns, real_path, stored_path, extras)` from the
+    passed string, read from the index file. `extras` holds the optional `key=value`
+    fields that follow the stored path.
+
+    @type indexString: str
+    @param indexString: `index.txt` file string to be parsed.
+    """
+    separatorString = '[index-sep]'
+    if (separatorString in indexString):
+        splitList = indexString.rstrip('\n').split(separatorString)
+    else:
+        splitList = indexString.rstrip('\n').split(',')
+
+    extras = {}
+    for field in splitList[4:]:
+        key, _, value = field.partition('=')
+        extras.update({key:value})
+
+    return (int(splitList[0]), int(splitList[1]), splitList[2], splitList[3], extras)
+
+def isDirLine(indexString: str) -> bool:
+    """
+    Returns true if the string read from the index file is a directory record.
+
+    @type indexString: str
+    @param indexString: `index.txt` file string to check.
+    """
+    return indexString.startswith('D')
+
+def parseDirLine(indexString: str) -> tuple[int, int, str, str]:
+    """
+    Returns a tuple `(st_mtime_ns, childCount, real_path, stored_path)` from a
+    directory record read from the index file.
+
+    @type indexString: str
+    @param indexString: `index.txt` file string to be parsed.
+    """
+    separatorString = '[index-sep]'
+    if (separatorString in indexString):
+        splitList = indexString.rstrip('\n').split(separatorString)
+    else:
+        splitList = indexString.rstrip('\n').split(',')
+
+    return (int(splitList[1]), int(splitList[2]), splitList[3], splitList[4])
+
+def parseIndexLine(indexString: str) -> tuple[int, int, str, str]:
+    """
+    Returns a tuple `(st_ino, st_mtime_ns, real_path, stored_path)` from the passed
+    string, read from the index file.
+
+    @type indexString: str
+    @param indexString: `index.txt` file string to be parsed.
+    """
+    return parseIndexEntry(indexString)[:4]
+
 class IndexFile(File):
     """
     ## IndexFile (Extends File)
@@ -14,11 +71,7 @@ class IndexFile(File):
         @type indexData: str
         @param indexData: Formatted string read from the `index.txt` file.
         """
-        formattedMap = self.handleDataString(indexData)
-        self.st_ino = int(formattedMap.get('st_ino'))
-        self.real_path = formattedMap.get('real_path')
-        self.stored_path = formattedMap.get('stored_path')
-        self.st_mtime_ns = int(formattedMap.get('st_mtime_ns'))
+        self.st_ino, self.st_mtime_ns, self.real_path, self.stored_path = parseIndexLine(indexData)
 
     def handleDataString(self, indexString: str) -> dict[str, str]:
         """
@@ -27,21 +80,37 @@ class IndexFile(File):
         @type indexString: str
         @param indexString: `index.txt` file string to be parsed. 
         """
-        separatorString = '[index-sep]'
-        separatorCount = indexString.count(separatorString)
-        if (separatorCount > 0):
-            splitList = indexString.split(separatorString)
-        else:
-            splitList = indexString.split(',')
+        st_ino, st_mtime_ns, real_path, stored_path = parseIndexLine(indexString)
 
         returnMap = {}
-        returnMap.update({'st_ino':splitList[0]})
-        returnMap.update({'st_mtime_ns':splitList[1]})
-        returnMap.update({'real_path':splitList[2]})
-        returnMap.update({'stored_path':splitList[3].strip('\n')})
+        returnMap.update({'st_ino':str(st_ino)})
+        returnMap.update({'st_mtime_ns':str(st_mtime_ns)})
+        returnMap.update({'real_path':real_path})
+        returnMap.update({'stored_path':stored_path})
 
         return returnMap
 
+    @classmethod
+    def fromValues(cls, st_ino: int, st_mtime_ns: int, real_path: str, stored_path: str) -> 'IndexFile':
+        """
+        Create indexFile object from values that have already been parsed.
+
+        @type st_ino: int
+        @param st_ino: Inode number of the file.
+        @type st_mtime_ns: int
+        @param st_mtime_ns: Last modification time of the file in nanoseconds.
+        @type real_path: str
+        @param real_path: Path of the original file.
+        @type stored_path: str
+        @param stored_path: Path the file is stored at in the backup.
+        """
+        indexFile = cls.__new__(cls)
+        indexFile.st_ino = st_ino
+        indexFile.real_path = real_path
+        indexFile.stored_path = stored_path
+        indexFile.st_mtime_ns = st_mtime_ns
+        return indexFile
+
     def getAll(self) -> dict[str, str]:
         """
         Returns dictionary with all instance attributes. 
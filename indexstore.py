@@ -0,0 +1,747 @@
+from array import array
+from bisect import bisect_left, bisect_right
+import mmap
+import os
+import struct
+import sys
+from typing import Iterator
+
+from digest import DIGEST_ALGORITHM, DIGEST_SIZE, parseDigest
+from indexfile import IndexFile, isDirLine, parseDirLine, parseIndexEntry
+from chunkstore import ADDRESS_SIZE, formatChunkLocator, isChunkLocator, parseChunkLocator
+from compressor import codecName, codecNumber
+from pack import formatLocator, isPackLocator, parseLocator
+
+# binary index layout: a header, a table of sections, then the sections
+# themselves, each starting on an 8 byte boundary. All numbers are little endian.
+INDEX_MAGIC = b'RIBINDEX'
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct('<8sHHIQQ') # magic, version, flags, section count, row count, dir count
+INDEX_SECTION = struct.Struct('<4sQQ') # tag, offset, length
+
+def isBinaryIndex(path: str) -> bool:
+    """
+    Returns true if the file at the given path is a binary index file.
+
+    @type path: str
+    @param path: Path to the index file.
+    """
+    try:
+        with open(path,'rb') as indexFile:
+            return indexFile.read(len(INDEX_MAGIC)) == INDEX_MAGIC
+    except (FileNotFoundError):
+        return False
+
+def packStrings(strings: list[str]) -> tuple[array, bytes]:
+    """
+    Returns the offsets and the packed bytes of a list of strings, in the layout
+    used by the string tables of the binary index.
+
+    @type strings: list[str]
+    @param strings: Strings to pack.
+    """
+    offsets = array('Q', [0])
+    blob = bytearray()
+    for string in strings:
+        blob += string.encode('utf-8', 'surrogateescape')
+        offsets.append(len(blob))
+    return offsets, bytes(blob)
+
+def unpackStrings(offsets: memoryview, blob: memoryview) -> list[str]:
+    """
+    Returns the list of strings stored in a string table of the binary index.
+
+    @type offsets: memoryview
+    @param offsets: Offsets of the strings, one more than the number of strings.
+    @type blob: memoryview
+    @param blob: Packed bytes of the strings.
+    """
+    return [str(blob[offsets[i]:offsets[i + 1]], 'utf-8', 'surrogateescape') for i in range(len(offsets) - 1)]
+
+def joinPath(directory: str, name: str) -> str:
+    """
+    Join a directory and a file name back into a path.
+
+    @type directory: str
+    @param directory: Directory of the path.
+    @type name: str
+    @param name: Name of the file.
+    """
+    return directory + os.sep + name
+
+class IndexStore:
+    """
+    ## IndexStore
+    The IndexStore class holds every entry of the index file in compact columns
+    instead of one IndexFile object per entry. Inodes, modification times and
+    sizes live in typed arrays, directories are stored once in a shared table,
+    and file names are packed into a single byte string.
+
+    Entries are addressed by row number. Once frozen, rows are ordered by inode,
+    so `find()` is a binary search over the inode column.
+    """
+    def __init__(self):
+        # set when the store is loaded from a memory mapped binary index
+        self.mapping = None
+        self.views = []
+        self.inodes = array('Q')
+        self.mtimes = array('q')
+        self.sizes = array('q')
+        # directory id of the real path, into self.dirs
+        self.dirIds = array('I')
+        self.dirs = []
+        self.dirLookup = {}
+        # stored directory for each real directory, into self.dirs
+        self.dirStoredIds = array('I')
+        # modification time and number of children of each directory, -1 when
+        # the directory has no record
+        self.dirMtimes = array('q')
+        self.dirChildCounts = array('q')
+        # rows ordered by directory and where each directory starts, and the
+        # recorded child directories of each directory (see `groupByDir()`)
+        self.dirRows = None
+        self.dirRowStarts = None
+        self.childDirs = None
+        # file names, encoded and packed one after the other
+        self.names = bytearray()
+        self.nameStarts = array('Q')
+        self.nameLengths = array('H')
+        # stored paths that do not follow the stored directory of their real directory
+        self.storedOverrides = {}
+        # directories added by packed files only, their stored directory is not known yet
+        self.unstoredDirs = set()
+        # pack file, offset and length of packed files (pack 0 when the file is
+        # not packed), None until the first packed entry is added
+        self.packIds = None
+        self.packOffsets = None
+        self.packLengths = None
+        # recipe addresses of files in the chunk store, ADDRESS_SIZE bytes per
+        # row (all zero when the file is not in it), None until the first such entry is added
+        self.recipes = None
+        # codec numbers of compressed files, one byte per row (0 when the file
+        # is stored as is), None until the first compressed entry is added
+        self.codecs = None
+        # content digests, DIGEST_SIZE bytes per row (all zero when unknown),
+        # None until the first entry with a digest is added
+        self.digests = None
+
+    def __len__(self) -> int:
+        return len(self.inodes)
+
+    def internDir(self, directory: str, storedDirectory: str = None) -> int:
+        """
+        Returns the id of a directory in the directory table, adding it if needed.
+
+        @type directory: str
+        @param directory: Directory path.
+        @type storedDirectory: str
+        @param storedDirectory: Directory the files of `directory` are stored in.
+            (default is None, the directory itself)
+        """
+        dirId = self.dirLookup.get(directory)
+        if (dirId == None):
+            dirId = len(self.dirs)
+            self.dirs.append(directory)
+            self.dirLookup.update({directory:dirId})
+            self.dirStoredIds.append(dirId)
+            self.dirMtimes.append(-1)
+            self.dirChildCounts.append(-1)
+            if (storedDirectory != None):
+                self.dirStoredIds[dirId] = self.internDir(storedDirectory)
+        return dirId
+
+    def add(self, st_ino: int, st_mtime_ns: int, real_path: str, stored_path: str, st_size: int = -1, digest: bytes = None, codec: str = None) -> int:
+        """
+        Add an entry and return its row. `freeze()` must be called once all
+        entries have been added, before any lookups.
+
+        @type st_ino: int
+        @param st_ino: Inode number of the file.
+        @type st_mtime_ns: int
+        @param st_mtime_ns: Last modification time of the file in nanoseconds.
+        @type real_path: str
+        @param real_path: Path of the original file.
+        @type stored_path: str
+        @param stored_path: Path the file is stored at in the backup.
+        @type st_size: int
+        @param st_size: Size of the file in bytes.
+            (default is -1, unknown)
+        @type digest: bytes
+        @param digest: Content digest of the file.
+            (default is None, unknown)
+        @type codec: str
+        @param codec: Codec the stored file is compressed with (see `compressor.CODECS`).
+            (default is None, stored as is)
+        """
+        row = len(self.inodes)
+        dirId, name = self.placeEntry(row, real_path, stored_path)
+        packLocation = parseLocator(stored_path) if isPackLocator(stored_path) else None
+        recipe = parseChunkLocator(stored_path) if isChunkLocator(stored_path) else None
+        encodedName = name.encode('utf-8', 'surrogateescape')
+        self.inodes.append(st_ino)
+        self.mtimes.append(st_mtime_ns)
+        self.sizes.append(st_size)
+        self.dirIds.append(dirId)
+        self.nameStarts.append(len(self.names))
+        self.nameLengths.append(len(encodedName))
+        self.names += encodedName
+        if (packLocation != None and self.packIds == None):
+            self.packIds = array('I', [0]) * row
+            self.packOffsets = array('Q', [0]) * row
+            self.packLengths = array('Q', [0]) * row
+        if (self.packIds != None):
+            packId, packOffset, packLength = packLocation if packLocation != None else (0, 0, 0)
+            self.packIds.append(packId)
+            self.packOffsets.append(packOffset)
+            self.packLengths.append(packLength)
+        if (recipe != None and self.recipes == None):
+            self.recipes = bytearray(ADDRESS_SIZE * row)
+        if (self.recipes != None):
+            self.recipes += recipe if recipe != None else bytes(ADDRESS_SIZE)
+        if (codec != None and self.codecs == None):
+            self.codecs = bytearray(row)
+        if (self.codecs != None):
+            self.codecs.append(codecNumber(codec))
+        if (digest != None and self.digests == None):
+            self.digests = bytearray(DIGEST_SIZE * row)
+        if (self.digests != None):
+            self.digests += digest if digest != None else bytes(DIGEST_SIZE)
+        return row
+
+    def placeEntry(self, row: int, real_path: str, stored_path: str) -> tuple[int, str]:
+        """
+        Returns the directory id and file name of a new entry. Adds the
+        directory if needed, and records the stored path of the entry if it
+        does not follow its directory. Files in a pack file or in the chunk
+        store (see `pack.PackWriter` and `chunkstore.ChunkStore`) have no
+        stored directory, their location is kept in columns of its own.
+
+        @type row: int
+        @param row: Row the entry is added at.
+        @type real_path: str
+        @param real_path: Path of the original file.
+        @type stored_path: str
+        @param stored_path: Path the file is stored at in the backup, or its pack or chunk store locator.
+        """
+        realDir, _, name = real_path.rpartition(os.sep)
+        dirId = self.dirLookup.get(realDir)
+        if (isPackLocator(stored_path) or isChunkLocator(stored_path)):
+            if (dirId == None):
+                dirId = self.internDir(realDir)
+                self.unstoredDirs.add(dirId)
+            return (dirId, name)
+        storedDir, _, storedName = stored_path.rpartition(os.sep)
+        if (dirId == None):
+            dirId = self.internDir(realDir, storedDir)
+        elif (dirId in self.unstoredDirs):
+            self.unstoredDirs.discard(dirId)
+            self.dirStoredIds[dirId] = self.internDir(storedDir)
+        if (storedName != name or self.dirs[self.dirStoredIds[dirId]] != storedDir):
+            self.storedOverrides.update({row:stored_path})
+        return (dirId, name)
+
+    def addDir(self, st_mtime_ns: int, childCount: int, real_path: str, stored_path: str) -> int:
+        """
+        Add a directory record and return the id of the directory.
+
+        @type st_mtime_ns: int
+        @param st_mtime_ns: Last modification time of the directory in nanoseconds.
+        @type childCount: int
+        @param childCount: Number of files and directories in the directory.
+        @type real_path: str
+        @param real_path: Path of the original directory.
+        @type stored_path: str
+        @param stored_path: Path the directory is stored at in the backup.
+        """
+        dirId = self.internDir(real_path, stored_path)
+        self.dirMtimes[dirId] = st_mtime_ns
+        self.dirChildCounts[dirId] = childCount
+        return dirId
+
+    def addLine(self, line: str) -> int:
+        """
+        Add an entry from a line of the `index.txt` file and return its row.
+        Directory records are added with `addDir()`, and -1 is returned.
+
+        @type line: str
+        @param line: Formatted string read from the `index.txt` file.
+        """
+        if (isDirLine(line)):
+            self.addDir(*parseDirLine(line))
+            return -1
+        st_ino, st_mtime_ns, real_path, stored_path, extras = parseIndexEntry(line)
+        st_size = int(extras.get('size', -1))
+        digest = None
+        if ('digest' in extras):
+            digest = parseDigest(extras.get('digest'))
+        return self.add(st_ino, st_mtime_ns, real_path, stored_path, st_size, digest, extras.get('codec'))
+
+    def freeze(self) -> None:
+        """
+        Order the rows by inode once all entries have been added. Entries that
+        share an inode keep the order they were added in.
+        """
+        inodes = self.inodes
+        if (all(inodes[row] <= inodes[row + 1] for row in range(len(inodes) - 1))):
+            return
+        order = sorted(range(len(inodes)), key=inodes.__getitem__)
+        self.inodes = array('Q', map(inodes.__getitem__, order))
+        self.mtimes = array('q', map(self.mtimes.__getitem__, order))
+        self.sizes = array('q', map(self.sizes.__getitem__, order))
+        self.dirIds = array('I', map(self.dirIds.__getitem__, order))
+        self.nameStarts = array('Q', map(self.nameStarts.__getitem__, order))
+        self.nameLengths = array('H', map(self.nameLengths.__getitem__, order))
+        if (self.packIds != None):
+            self.packIds = array('I', map(self.packIds.__getitem__, order))
+            self.packOffsets = array('Q', map(self.packOffsets.__getitem__, order))
+            self.packLengths = array('Q', map(self.packLengths.__getitem__, order))
+        if (self.recipes != None):
+            recipes = self.recipes
+            self.recipes = bytearray(b''.join(recipes[row * ADDRESS_SIZE:(row + 1) * ADDRESS_SIZE] for row in order))
+        if (self.codecs != None):
+            self.codecs = bytearray(map(self.codecs.__getitem__, order))
+        if (self.digests != None):
+            digests = self.digests
+            self.digests = bytearray(b''.join(digests[row * DIGEST_SIZE:(row + 1) * DIGEST_SIZE] for row in order))
+        if (len(self.storedOverrides) > 0):
+            newRows = array('L', [0]) * len(order)
+            for newRow, oldRow in enumerate(order):
+                newRows[oldRow] = newRow
+            self.storedOverrides = {newRows[row]:path for row, path in self.storedOverrides.items()}
+
+    def find(self, st_ino: int) -> int:
+        """
+        Returns the row of the entry with the given inode, or -1 if the inode
+        is not in the index. If the inode appears more than once, the last
+        entry added wins.
+
+        @type st_ino: int
+        @param st_ino: Inode number to look up.
+        """
+        position = bisect_right(self.inodes, st_ino) - 1
+        if (position >= 0 and self.inodes[position] == st_ino):
+            return position
+        return -1
+
+    def findStored(self, st_ino: int, stored_path: str) -> int:
+        """
+        Returns the row of the entry with the given inode and stored path. If
+        no entry of the inode has that stored path, the row `find()` would
+        return is returned instead, and -1 if the inode is not in the index.
+        Used to tell hard links to the same inode apart.
+
+        @type st_ino: int
+        @param st_ino: Inode number to look up.
+        @type stored_path: str
+        @param stored_path: Path the file is stored at in the backup.
+        """
+        first = bisect_left(self.inodes, st_ino)
+        last = bisect_right(self.inodes, st_ino) - 1
+        if (last < first):
+            return -1
+        for row in range(first, last):
+            if (self.getStoredPath(row) == stored_path):
+                return row
+        return last
+
+    def countRows(self, st_ino: int) -> int:
+        """
+        Returns the number of entries with the given inode.
+
+        @type st_ino: int
+        @param st_ino: Inode number to look up.
+        """
+        return bisect_right(self.inodes, st_ino) - bisect_left(self.inodes, st_ino)
+
+    def storedDirCounts(self) -> dict[str, int]:
+        """
+        Returns the number of entries stored in each backup directory.
+        """
+        dirCounts = {}
+        for row, dirId in enumerate(self.dirIds):
+            # packed files and files in the chunk store are not stored in a directory
+            if ((self.packIds == None or self.packIds[row] == 0) and self.getRecipe(row) == None):
+                dirCounts.update({dirId:dirCounts.get(dirId, 0) + 1})
+        counts = {}
+        for dirId, count in dirCounts.items():
+            storedDir = self.dirs[self.dirStoredIds[dirId]]
+            counts.update({storedDir:counts.get(storedDir, 0) + count})
+        for row, path in self.storedOverrides.items():
+            storedDir = self.dirs[self.dirStoredIds[self.dirIds[row]]]
+            counts.update({storedDir:counts.get(storedDir) - 1})
+            overrideDir = path.rpartition(os.sep)[0]
+            counts.update({overrideDir:counts.get(overrideDir, 0) + 1})
+        return counts
+
+    def groupByDir(self) -> None:
+        """
+        Group the rows by directory, for `rowsInDir()` and `unchangedDir()`.
+        Called once before the lookups, which may then run on several threads.
+        """
+        dirCount = len(self.dirs)
+        starts = array('Q', [0]) * (dirCount + 1)
+        for dirId in self.dirIds:
+            starts[dirId + 1] += 1
+        for dirId in range(dirCount):
+            starts[dirId + 1] += starts[dirId]
+        positions = array('Q', starts)
+        rows = array('Q', [0]) * len(self.dirIds)
+        for row, dirId in enumerate(self.dirIds):
+            rows[positions[dirId]] = row
+            positions[dirId] += 1
+        self.dirRows = rows
+        self.dirRowStarts = starts
+        childDirs = {}
+        for dirId, directory in enumerate(self.dirs):
+            if (self.dirMtimes[dirId] >= 0):
+                parent = directory.rpartition(os.sep)[0]
+                if (parent not in childDirs):
+                    childDirs.update({parent:[]})
+                childDirs.get(parent).append(directory)
+        self.childDirs = childDirs
+
+    def rowsInDir(self, dirId: int) -> memoryview:
+        """
+        Returns the rows of the entries in a directory. `groupByDir()` must
+        have been called first.
+
+        @type dirId: int
+        @param dirId: Id of the directory.
+        """
+        return memoryview(self.dirRows)[self.dirRowStarts[dirId]:self.dirRowStarts[dirId + 1]]
+
+    def unchangedDir(self, directory: str, st_mtime_ns: int) -> list[str]:
+        """
+        Returns the recorded child directories of a directory if it can be
+        trusted to be unchanged, or None if it has to be listed again. A
+        directory is trusted when its modification time matches its record and
+        the index holds as many entries and child directories for it as it had
+        children when it was recorded. `groupByDir()` must have been called first.
+
+        @type directory: str
+        @param directory: Path of the original directory.
+        @type st_mtime_ns: int
+        @param st_mtime_ns: Current modification time of the directory in nanoseconds.
+        """
+        dirId = self.dirLookup.get(directory)
+        if (dirId == None or self.dirMtimes[dirId] != st_mtime_ns):
+            return None
+        subdirs = self.childDirs.get(directory, [])
+        if (len(self.rowsInDir(dirId)) + len(subdirs) != self.dirChildCounts[dirId]):
+            return None
+        return subdirs
+
+    def getInode(self, row: int) -> int:
+        return self.inodes[row]
+
+    def getMtime(self, row: int) -> int:
+        return self.mtimes[row]
+
+    def getSize(self, row: int) -> int:
+        return self.sizes[row]
+
+    def getDigest(self, row: int) -> bytes:
+        """
+        Returns the content digest of the entry at the given row, or None if
+        it is not known.
+
+        @type row: int
+        @param row: Row of the entry.
+        """
+        if (self.digests == None):
+            return None
+        digest = bytes(self.digests[row * DIGEST_SIZE:(row + 1) * DIGEST_SIZE])
+        if (digest == bytes(DIGEST_SIZE)):
+            return None
+        return digest
+
+    def getRecipe(self, row: int) -> bytes:
+        """
+        Returns the recipe address of the entry at the given row, or None if
+        the file is not in the chunk store.
+
+        @type row: int
+        @param row: Row of the entry.
+        """
+        if (self.recipes == None):
+            return None
+        recipe = bytes(self.recipes[row * ADDRESS_SIZE:(row + 1) * ADDRESS_SIZE])
+        if (recipe == bytes(ADDRESS_SIZE)):
+            return None
+        return recipe
+
+    def getCodec(self, row: int) -> str:
+        """
+        Returns the codec the stored file of the entry at the given row is
+        compressed with, or None if it is stored as is.
+
+        @type row: int
+        @param row: Row of the entry.
+        """
+        if (self.codecs == None):
+            return None
+        return codecName(self.codecs[row])
+
+    def getName(self, row: int) -> str:
+        """
+        Returns the file name of the entry at the given row.
+
+        @type row: int
+        @param row: Row of the entry.
+        """
+        start = self.nameStarts[row]
+        return str(self.names[start:start + self.nameLengths[row]], 'utf-8', 'surrogateescape')
+
+    def getRealPath(self, row: int) -> str:
+        """
+        Returns the original path of the entry at the given row.
+
+        @type row: int
+        @param row: Row of the entry.
+        """
+        return joinPath(self.dirs[self.dirIds[row]], self.getName(row))
+
+    def getStoredPath(self, row: int) -> str:
+        """
+        Returns the backup path of the entry at the given row.
+
+        @type row: int
+        @param row: Row of the entry.
+        """
+        if (self.packIds != None and self.packIds[row] != 0):
+            return formatLocator(self.packIds[row], self.packOffsets[row], self.packLengths[row])
+        recipe = self.getRecipe(row)
+        if (recipe != None):
+            return formatChunkLocator(recipe)
+        override = self.storedOverrides.get(row)
+        if (override != None):
+            return override
+        return joinPath(self.dirs[self.dirStoredIds[self.dirIds[row]]], self.getName(row))
+
+    def getIndexFile(self, row: int) -> IndexFile:
+        """
+        Returns an IndexFile object for the entry at the given row.
+
+        @type row: int
+        @param row: Row of the entry.
+        """
+        return IndexFile.fromValues(self.inodes[row], self.mtimes[row], self.getRealPath(row), self.getStoredPath(row))
+
+    def get(self, st_ino: int, default: IndexFile = None) -> IndexFile:
+        """
+        Returns an IndexFile object for the given inode, or the default if the
+        inode is not in the index.
+
+        @type st_ino: int
+        @param st_ino: Inode number to look up.
+        @type default: IndexFile
+        @param default: Value returned when the inode is not found.
+            (default is None)
+        """
+        row = self.find(st_ino)
+        if (row < 0):
+            return default
+        return self.getIndexFile(row)
+
+    def values(self) -> Iterator[IndexFile]:
+        """
+        Yields an IndexFile object for every entry, ordered by inode.
+        """
+        for row in range(len(self.inodes)):
+            yield self.getIndexFile(row)
+
+    def save(self, path: str) -> None:
+        """
+        Write the store to a binary index file. The file is written next to the
+        given path first and then renamed into place.
+
+        @type path: str
+        @param path: Path to the index file.
+        """
+        overrideRows = sorted(self.storedOverrides.keys())
+        dirOffsets, dirBlob = packStrings(self.dirs)
+        overrideOffsets, overrideBlob = packStrings([self.storedOverrides.get(row) for row in overrideRows])
+        sections = [
+            (b'INOD', self.inodes, 'Q'),
+            (b'MTIM', self.mtimes, 'q'),
+            (b'SIZE', self.sizes, 'q'),
+            (b'DIRI', self.dirIds, 'I'),
+            (b'NSTA', self.nameStarts, 'Q'),
+            (b'NLEN', self.nameLengths, 'H'),
+            (b'NAME', self.names, None),
+            (b'DOFF', dirOffsets, 'Q'),
+            (b'DSTR', dirBlob, None),
+            (b'DSTO', self.dirStoredIds, 'I'),
+            (b'DMTM', self.dirMtimes, 'q'),
+            (b'DCNT', self.dirChildCounts, 'q'),
+            (b'OROW', array('Q', overrideRows), 'Q'),
+            (b'OOFF', overrideOffsets, 'Q'),
+            (b'OSTR', overrideBlob, None),
+        ]
+        if (self.packIds != None):
+            sections.append((b'PKID', self.packIds, 'I'))
+            sections.append((b'PKOF', self.packOffsets, 'Q'))
+            sections.append((b'PKLN', self.packLengths, 'Q'))
+        if (self.recipes != None):
+            sections.append((b'RCPE', self.recipes, None))
+        if (self.codecs != None):
+            sections.append((b'CODC', self.codecs, None))
+        if (self.digests != None):
+            sections.append((b'DALG', DIGEST_ALGORITHM.encode('ascii'), None))
+            sections.append((b'DGST', self.digests, None))
+        payloads = [(tag, columnBytes(data, typecode)) for tag, data, typecode in sections]
+
+        offset = INDEX_HEADER.size + INDEX_SECTION.size * len(payloads)
+        table = []
+        for tag, payload in payloads:
+            offset += -offset % 8
+            table.append(INDEX_SECTION.pack(tag, offset, len(payload)))
+            offset += len(payload)
+
+        tempPath = path + '.tmp'
+        with open(tempPath,'wb') as indexFile:
+            indexFile.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0, len(payloads), len(self), len(self.dirs)))
+            indexFile.write(b''.join(table))
+            for tag, payload in payloads:
+                indexFile.write(bytes(-indexFile.tell() % 8))
+                indexFile.write(payload)
+            indexFile.flush()
+            os.fsync(indexFile.fileno())
+        os.replace(tempPath, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'IndexStore':
+        """
+        Load a binary index file. The file is memory mapped and the fixed width
+        columns are read straight from the mapping, so only the directory table
+        is decoded up front. The returned store is read only.
+
+        @type path: str
+        @param path: Path to the index file.
+        """
+        store = cls()
+        with open(path,'rb') as indexFile:
+            store.mapping = mmap.mmap(indexFile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, flags, sectionCount, rowCount, dirCount = INDEX_HEADER.unpack_from(store.mapping, 0)
+        if (magic != INDEX_MAGIC):
+            store.close()
+            raise ValueError(f"Not a binary index file: {path}")
+        if (version > INDEX_VERSION):
+            store.close()
+            raise ValueError(f"Unsupported binary index version {version}: {path}")
+
+        sections = {}
+        for number in range(sectionCount):
+            tag, offset, length = INDEX_SECTION.unpack_from(store.mapping, INDEX_HEADER.size + INDEX_SECTION.size * number)
+            sections.update({tag:(offset, length)})
+
+        store.inodes = store.column(sections, b'INOD', 'Q', rowCount, 0)
+        store.mtimes = store.column(sections, b'MTIM', 'q', rowCount, 0)
+        store.sizes = store.column(sections, b'SIZE', 'q', rowCount, -1)
+        store.dirIds = store.column(sections, b'DIRI', 'I', rowCount, 0)
+        store.nameStarts = store.column(sections, b'NSTA', 'Q', rowCount, 0)
+        store.nameLengths = store.column(sections, b'NLEN', 'H', rowCount, 0)
+        store.names = store.column(sections, b'NAME', None, 0, 0)
+        store.dirs = unpackStrings(store.column(sections, b'DOFF', 'Q', dirCount + 1, 0), store.column(sections, b'DSTR', None, 0, 0))
+        store.dirLookup = {directory:dirId for dirId, directory in enumerate(store.dirs)}
+        store.dirStoredIds = array('I', store.column(sections, b'DSTO', 'I', dirCount, 0))
+        store.dirMtimes = array('q', store.column(sections, b'DMTM', 'q', dirCount, -1))
+        store.dirChildCounts = array('q', store.column(sections, b'DCNT', 'q', dirCount, -1))
+        overrideRows = store.column(sections, b'OROW', 'Q', 0, 0)
+        overridePaths = unpackStrings(store.column(sections, b'OOFF', 'Q', len(overrideRows) + 1, 0), store.column(sections, b'OSTR', None, 0, 0))
+        store.storedOverrides = dict(zip(overrideRows, overridePaths))
+        if (b'PKID' in sections):
+            store.packIds = store.column(sections, b'PKID', 'I', rowCount, 0)
+            store.packOffsets = store.column(sections, b'PKOF', 'Q', rowCount, 0)
+            store.packLengths = store.column(sections, b'PKLN', 'Q', rowCount, 0)
+        if (b'RCPE' in sections):
+            store.recipes = store.column(sections, b'RCPE', None, 0, 0)
+        if (b'CODC' in sections):
+            store.codecs = store.column(sections, b'CODC', None, 0, 0)
+        # digests made with another algorithm cannot be compared, so they are dropped
+        if (b'DGST' in sections and bytes(store.column(sections, b'DALG', None, 0, 0)) == DIGEST_ALGORITHM.encode('ascii')):
+            store.digests = store.column(sections, b'DGST', None, 0, 0)
+        return store
+
+    def column(self, sections: dict[bytes, tuple[int, int]], tag: bytes, typecode: str, count: int, default: int) -> memoryview:
+        """
+        Returns a section of the memory mapped binary index as a sequence of
+        numbers (or bytes, if `typecode` is None).
+
+        @type sections: dict[bytes, tuple[int, int]]
+        @param sections: Offset and length of each section, by tag.
+        @type tag: bytes
+        @param tag: Tag of the section.
+        @type typecode: str
+        @param typecode: Array typecode of the numbers in the section.
+        @type count: int
+        @param count: Number of values to return if the section is missing.
+        @type default: int
+        @param default: Value to fill with if the section is missing.
+        """
+        if (tag not in sections):
+            if (typecode == None):
+                return b''
+            return array(typecode, [default]) * count
+        offset, length = sections.get(tag)
+        view = memoryview(self.mapping)[offset:offset + length]
+        self.views.append(view)
+        if (typecode == None):
+            return view
+        if (sys.byteorder != 'little'):
+            values = array(typecode)
+            values.frombytes(view)
+            values.byteswap()
+            return values
+        view = view.cast(typecode)
+        self.views.append(view)
+        return view
+
+    def close(self) -> None:
+        """
+        Release the memory mapped binary index, if the store was loaded from one.
+        The store is empty afterwards.
+        """
+        if (self.mapping == None):
+            return
+        mapping = self.mapping
+        views = self.views
+        self.__init__()
+        for view in reversed(views):
+            view.release()
+        mapping.close()
+
+def columnBytes(data: any, typecode: str) -> bytes:
+    """
+    Returns the little endian bytes of a column of the index store.
+
+    @type data: any
+    @param data: Array, memoryview or bytes holding the column.
+    @type typecode: str
+    @param typecode: Array typecode of the column, or None for raw bytes.
+    """
+    if (typecode == None):
+        return bytes(data)
+    values = array(typecode, data)
+    if (sys.byteorder != 'little'):
+        values.byteswap()
+    return values.tobytes()
+
+def convertIndex(textPath: str, binaryPath: str) -> int:
+    """
+    Convert an `index.txt` file to a binary index file and return the number
+    of entries converted.
+
+    @type textPath: str
+    @param textPath: Path to the `index.txt` file.
+    @type binaryPath: str
+    @param binaryPath: Path of the binary index file to write.
+    """
+    store = IndexStore()
+    with open(textPath,'r') as indexFile:
+        for line in indexFile:
+            if (line != '\n'):
+                store.addLine(line)
+    store.freeze()
+    store.save(binaryPath)
+    return len(store)
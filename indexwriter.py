@@ -0,0 +1,334 @@
+from array import array
+import os
+import struct
+
+from chunkstore import ADDRESS_SIZE, isChunkLocator, parseChunkLocator
+from compressor import codecNumber
+from digest import DIGEST_SIZE, formatDigest
+from file import formatDirLine, formatIndexLine
+from indexstore import IndexStore
+from pack import isPackLocator, parseLocator
+
+class IndexWriter:
+    """
+    ## IndexWriter
+    The IndexWriter class writes a new `index.txt` file one entry at a time
+    while the source directory is scanned. Entries go to a temporary file next
+    to the index, which only replaces the index once `commit()` is called, so
+    an interrupted run leaves the previous index untouched.
+    """
+    def __init__(self, path: str):
+        """
+        @type path: str
+        @param path: Path to the `index.txt` file.
+        """
+        self.path = path
+        self.tempPath = path + '.tmp'
+        self.entries = 0
+        self.file = open(self.tempPath, 'w', buffering=1024 * 1024)
+
+    def write(self, st_ino: int, st_mtime_ns: int, real_path: str, stored_path: str, st_size: int = -1, digest: bytes = None, codec: str = None) -> None:
+        """
+        Write an entry to the new index.
+
+        @type st_ino: int
+        @param st_ino: Inode number of the file.
+        @type st_mtime_ns: int
+        @param st_mtime_ns: Last modification time of the file in nanoseconds.
+        @type real_path: str
+        @param real_path: Path of the original file.
+        @type stored_path: str
+        @param stored_path: Path the file is stored at in the backup.
+        @type st_size: int
+        @param st_size: Size of the file in bytes.
+            (default is -1, unknown)
+        @type digest: bytes
+        @param digest: Content digest of the file.
+            (default is None, unknown)
+        @type codec: str
+        @param codec: Codec the stored file is compressed with (see `compressor.CODECS`).
+            (default is None, stored as is)
+        """
+        extras = {}
+        if (st_size >= 0):
+            extras.update({'size':st_size})
+        if (digest != None):
+            extras.update({'digest':formatDigest(digest)})
+        if (codec != None):
+            extras.update({'codec':codec})
+        self.file.write(formatIndexLine(st_ino, st_mtime_ns, real_path, stored_path, extras) + '\n')
+        self.entries += 1
+
+    def writeEntry(self, entry: any, digest: bytes = None, codec: str = None) -> None:
+        """
+        Write a scanned file (such as a ScanEntry) to the new index.
+
+        @type entry: any
+        @param entry: Object with `st_ino`, `st_mtime_ns`, `real_path`, `stored_path` and `st_size` attributes.
+        @type digest: bytes
+        @param digest: Content digest of the file.
+            (default is None, unknown)
+        @type codec: str
+        @param codec: Codec the stored file is compressed with.
+            (default is None, stored as is)
+        """
+        self.write(entry.st_ino, entry.st_mtime_ns, entry.real_path, entry.stored_path, entry.st_size, digest, codec)
+
+    def writeDir(self, st_mtime_ns: int, childCount: int, real_path: str, stored_path: str) -> None:
+        """
+        Write a directory record to the new index.
+
+        @type st_mtime_ns: int
+        @param st_mtime_ns: Last modification time of the directory in nanoseconds.
+        @type childCount: int
+        @param childCount: Number of files and directories in the directory.
+        @type real_path: str
+        @param real_path: Path of the original directory.
+        @type stored_path: str
+        @param stored_path: Path the directory is stored at in the backup.
+        """
+        self.file.write(formatDirLine(st_mtime_ns, childCount, real_path, stored_path) + '\n')
+
+    def commit(self) -> None:
+        """
+        Flush the new index to disk and rename it into place.
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.tempPath, self.path)
+
+    def abort(self) -> None:
+        """
+        Discard the new index, leaving the previous index in place.
+        """
+        self.file.close()
+        removeIfExists(self.tempPath)
+
+class BinaryIndexWriter:
+    """
+    ## BinaryIndexWriter
+    The BinaryIndexWriter class writes a new binary index file one entry at a
+    time while the source directory is scanned. Each column is spilled to its
+    own temporary file in small batches, so memory use does not grow with the
+    number of entries during the scan. `commit()` reads the columns back,
+    orders them by inode and writes the binary index in one pass.
+    """
+    BATCH_SIZE = 65536
+    PACK_ENTRY = struct.Struct('<IQQ') # pack file, offset and length of a packed file
+    COLUMNS = [('inodes', 'Q'), ('mtimes', 'q'), ('sizes', 'q'), ('dirIds', 'I'), ('nameStarts', 'Q'), ('nameLengths', 'H')]
+
+    def __init__(self, path: str):
+        """
+        @type path: str
+        @param path: Path to the binary index file.
+        """
+        self.path = path
+        self.entries = 0
+        # the directory table and stored path overrides are kept in memory,
+        # both grow with the number of directories rather than files
+        self.store = IndexStore()
+        self.namesLength = 0
+        self.batches = {name:array(typecode) for name, typecode in self.COLUMNS}
+        self.spillFiles = {name:open(self.spillPath(name), 'wb') for name, typecode in self.COLUMNS}
+        self.namesFile = open(self.spillPath('names'), 'wb', buffering=1024 * 1024)
+        # opened with the first digest, packed file, file in the chunk store or
+        # compressed file, earlier entries are padded with zeros
+        self.digestsFile = None
+        self.packsFile = None
+        self.recipesFile = None
+        self.codecsFile = None
+
+    def spillPath(self, name: str) -> str:
+        return f"{self.path}.tmp-{name}"
+
+    def write(self, st_ino: int, st_mtime_ns: int, real_path: str, stored_path: str, st_size: int = -1, digest: bytes = None, codec: str = None) -> None:
+        """
+        Write an entry to the new index.
+
+        @type st_ino: int
+        @param st_ino: Inode number of the file.
+        @type st_mtime_ns: int
+        @param st_mtime_ns: Last modification time of the file in nanoseconds.
+        @type real_path: str
+        @param real_path: Path of the original file.
+        @type stored_path: str
+        @param stored_path: Path the file is stored at in the backup.
+        @type st_size: int
+        @param st_size: Size of the file in bytes.
+            (default is -1, unknown)
+        @type digest: bytes
+        @param digest: Content digest of the file.
+            (default is None, unknown)
+        @type codec: str
+        @param codec: Codec the stored file is compressed with (see `compressor.CODECS`).
+            (default is None, stored as is)
+        """
+        store = self.store
+        dirId, name = store.placeEntry(self.entries, real_path, stored_path)
+        packLocation = parseLocator(stored_path) if isPackLocator(stored_path) else None
+        recipe = parseChunkLocator(stored_path) if isChunkLocator(stored_path) else None
+        encodedName = name.encode('utf-8', 'surrogateescape')
+        self.namesFile.write(encodedName)
+
+        batches = self.batches
+        batches['inodes'].append(st_ino)
+        batches['mtimes'].append(st_mtime_ns)
+        batches['sizes'].append(st_size)
+        batches['dirIds'].append(dirId)
+        batches['nameStarts'].append(self.namesLength)
+        batches['nameLengths'].append(len(encodedName))
+        self.namesLength += len(encodedName)
+        if (digest != None and self.digestsFile == None):
+            self.digestsFile = open(self.spillPath('digests'), 'wb', buffering=1024 * 1024)
+            self.digestsFile.write(bytes(DIGEST_SIZE * self.entries))
+        if (self.digestsFile != None):
+            self.digestsFile.write(digest if digest != None else bytes(DIGEST_SIZE))
+        if (packLocation != None and self.packsFile == None):
+            self.packsFile = open(self.spillPath('packs'), 'wb', buffering=1024 * 1024)
+            self.packsFile.write(bytes(self.PACK_ENTRY.size * self.entries))
+        if (self.packsFile != None):
+            self.packsFile.write(self.PACK_ENTRY.pack(*(packLocation if packLocation != None else (0, 0, 0))))
+        if (recipe != None and self.recipesFile == None):
+            self.recipesFile = open(self.spillPath('recipes'), 'wb', buffering=1024 * 1024)
+            self.recipesFile.write(bytes(ADDRESS_SIZE * self.entries))
+        if (self.recipesFile != None):
+            self.recipesFile.write(recipe if recipe != None else bytes(ADDRESS_SIZE))
+        if (codec != None and self.codecsFile == None):
+            self.codecsFile = open(self.spillPath('codecs'), 'wb', buffering=1024 * 1024)
+            self.codecsFile.write(bytes(self.entries))
+        if (self.codecsFile != None):
+            self.codecsFile.write(bytes([codecNumber(codec)]))
+        self.entries += 1
+        if (len(batches['inodes']) >= self.BATCH_SIZE):
+            self.spill()
+
+    def writeEntry(self, entry: any, digest: bytes = None, codec: str = None) -> None:
+        """
+        Write a scanned file (such as a ScanEntry) to the new index.
+
+        @type entry: any
+        @param entry: Object with `st_ino`, `st_mtime_ns`, `real_path`, `stored_path` and `st_size` attributes.
+        @type digest: bytes
+        @param digest: Content digest of the file.
+            (default is None, unknown)
+        @type codec: str
+        @param codec: Codec the stored file is compressed with.
+            (default is None, stored as is)
+        """
+        self.write(entry.st_ino, entry.st_mtime_ns, entry.real_path, entry.stored_path, entry.st_size, digest, codec)
+
+    def writeDir(self, st_mtime_ns: int, childCount: int, real_path: str, stored_path: str) -> None:
+        """
+        Write a directory record to the new index. Directory records are kept
+        with the directory table in memory.
+
+        @type st_mtime_ns: int
+        @param st_mtime_ns: Last modification time of the directory in nanoseconds.
+        @type childCount: int
+        @param childCount: Number of files and directories in the directory.
+        @type real_path: str
+        @param real_path: Path of the original directory.
+        @type stored_path: str
+        @param stored_path: Path the directory is stored at in the backup.
+        """
+        self.store.addDir(st_mtime_ns, childCount, real_path, stored_path)
+
+    def spill(self) -> None:
+        """
+        Write the batched column values to their temporary files.
+        """
+        for name, typecode in self.COLUMNS:
+            self.batches[name].tofile(self.spillFiles.get(name))
+            self.batches.update({name:array(typecode)})
+
+    def commit(self) -> None:
+        """
+        Build the binary index from the temporary files and rename it into place.
+        """
+        self.spill()
+        self.closeFiles()
+        store = self.store
+        for name, typecode in self.COLUMNS:
+            column = array(typecode)
+            with open(self.spillPath(name), 'rb') as spillFile:
+                column.fromfile(spillFile, self.entries)
+            setattr(store, name, column)
+        with open(self.spillPath('names'), 'rb') as namesFile:
+            store.names = bytearray(namesFile.read())
+        if (self.digestsFile != None):
+            with open(self.spillPath('digests'), 'rb') as digestsFile:
+                store.digests = bytearray(digestsFile.read())
+        if (self.packsFile != None):
+            store.packIds = array('I')
+            store.packOffsets = array('Q')
+            store.packLengths = array('Q')
+            with open(self.spillPath('packs'), 'rb') as packsFile:
+                for packId, packOffset, packLength in self.PACK_ENTRY.iter_unpack(packsFile.read()):
+                    store.packIds.append(packId)
+                    store.packOffsets.append(packOffset)
+                    store.packLengths.append(packLength)
+        if (self.recipesFile != None):
+            with open(self.spillPath('recipes'), 'rb') as recipesFile:
+                store.recipes = bytearray(recipesFile.read())
+        if (self.codecsFile != None):
+            with open(self.spillPath('codecs'), 'rb') as codecsFile:
+                store.codecs = bytearray(codecsFile.read())
+        self.removeSpillFiles()
+        store.freeze()
+        store.save(self.path)
+
+    def abort(self) -> None:
+        """
+        Discard the new index, leaving the previous index in place.
+        """
+        self.closeFiles()
+        self.removeSpillFiles()
+
+    def closeFiles(self) -> None:
+        for spillFile in self.spillFiles.values():
+            spillFile.close()
+        self.namesFile.close()
+        if (self.digestsFile != None):
+            self.digestsFile.close()
+        if (self.packsFile != None):
+            self.packsFile.close()
+        if (self.recipesFile != None):
+            self.recipesFile.close()
+        if (self.codecsFile != None):
+            self.codecsFile.close()
+
+    def removeSpillFiles(self) -> None:
+        for name, typecode in self.COLUMNS:
+            removeIfExists(self.spillPath(name))
+        removeIfExists(self.spillPath('names'))
+        removeIfExists(self.spillPath('digests'))
+        removeIfExists(self.spillPath('packs'))
+        removeIfExists(self.spillPath('recipes'))
+        removeIfExists(self.spillPath('codecs'))
+
+def removeIfExists(path: str) -> None:
+    """
+    Remove a file, ignoring it if it does not exist.
+
+    @type path: str
+    @param path: Path of the file to remove.
+    """
+    try:
+        os.remove(path)
+    except (FileNotFoundError):
+        pass
+
+def openIndexWriter(path: str, indexFormat: str = 'text') -> IndexWriter | BinaryIndexWriter:
+    """
+    Returns a writer for a new index file in the given format.
+
+    @type path: str
+    @param path: Path to the index file.
+    @type indexFormat: str
+    @param indexFormat: Format of the index file, `'text'` or `'binary'`.
+        (default is `'text'`)
+    """
+    if (indexFormat == 'binary'):
+        return BinaryIndexWriter(path)
+    return IndexWriter(path)
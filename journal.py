@@ -0,0 +1,232 @@
+import json
+import os
+import time
+
+# change journal records, one per line: a kind letter, a space and a path
+JOURNAL_CHANGED = 'M'   # the files of a directory changed
+JOURNAL_TREE = 'R'      # a directory tree appeared, it is scanned as a whole
+JOURNAL_REMOVED = 'X'   # a directory tree went away
+JOURNAL_OVERFLOW = 'O'  # events were lost, the next backup has to scan everything
+JOURNAL_START = 'S'     # the watcher (re)started, changes before it were not seen
+
+def journalPath(indexPath: str) -> str:
+    """
+    Returns the path of the change journal of a profile.
+
+    @type indexPath: str
+    @param indexPath: Path to the index file of the profile.
+    """
+    return indexPath + '.journal'
+
+def journalStatePath(indexPath: str) -> str:
+    """
+    Returns the path of the file recording how far the change journal of a
+    profile has been read by backups.
+
+    @type indexPath: str
+    @param indexPath: Path to the index file of the profile.
+    """
+    return indexPath + '.journal-state'
+
+def formatRecord(kind: str, path: str = '') -> bytes:
+    """
+    Returns a journal record. Backslashes and line breaks in the path are escaped.
+
+    @type kind: str
+    @param kind: Kind of the record (one of the `JOURNAL_*` letters).
+    @type path: str
+    @param path: Path the record is about.
+        (default is `''`)
+    """
+    escaped = path.replace('\\', '\\\\').replace('\n', '\\n')
+    return f"{kind} {escaped}\n".encode('utf-8', 'surrogateescape')
+
+def parseRecord(line: bytes) -> tuple[str, str]:
+    """
+    Returns the `(kind, path)` of a journal record.
+
+    @type line: bytes
+    @param line: Record read from the journal, with or without its line break.
+    """
+    text = line.rstrip(b'\n').decode('utf-8', 'surrogateescape')
+    kind, _, escaped = text.partition(' ')
+    path = []
+    position = 0
+    while (position < len(escaped)):
+        char = escaped[position]
+        if (char == '\\' and position + 1 < len(escaped)):
+            position += 1
+            char = '\n' if escaped[position] == 'n' else escaped[position]
+        path.append(char)
+        position += 1
+    return (kind, ''.join(path))
+
+class ChangeSet:
+    """
+    ## ChangeSet
+    The ChangeSet class holds the changes read from the change journal since
+    the last backup: directories whose files have to be listed again, directory
+    trees that have to be scanned as a whole, and trees that went away.
+    """
+    def __init__(self):
+        self.changedDirs = set()
+        self.changedTrees = set()
+        self.removedTrees = set()
+
+    def add(self, kind: str, path: str) -> None:
+        """
+        Add a journal record to the change set.
+
+        @type kind: str
+        @param kind: Kind of the record.
+        @type path: str
+        @param path: Path the record is about.
+        """
+        if (kind == JOURNAL_CHANGED):
+            self.changedDirs.add(path)
+        elif (kind == JOURNAL_TREE):
+            self.changedTrees.add(path)
+        elif (kind == JOURNAL_REMOVED):
+            self.removedTrees.add(path)
+
+    def isUnchanged(self, directory: str) -> bool:
+        """
+        Returns true if the entries of the directory in the index can be kept as
+        they are, meaning neither the directory nor a tree containing it changed.
+
+        @type directory: str
+        @param directory: Path of the original directory.
+        """
+        if (directory in self.changedDirs):
+            return False
+        path = directory
+        while True:
+            if (path in self.changedTrees or path in self.removedTrees):
+                return False
+            parent = os.path.dirname(path)
+            if (parent == path):
+                return True
+            path = parent
+
+    def getTrees(self) -> list[str]:
+        """
+        Returns the changed trees that are not inside another changed tree.
+        """
+        trees = []
+        for tree in sorted(self.changedTrees):
+            if (len(trees) == 0 or not (tree == trees[-1] or tree.startswith(trees[-1] + os.sep))):
+                trees.append(tree)
+        return trees
+
+    def getDirs(self) -> list[str]:
+        """
+        Returns the changed directories that are not inside a changed tree.
+        """
+        return sorted(directory for directory in self.changedDirs if not any(directory == tree or directory.startswith(tree + os.sep) for tree in self.changedTrees))
+
+def readState(statePath: str) -> dict[str, int]:
+    """
+    Returns the journal state saved by the last backup, or None if there is none.
+
+    @type statePath: str
+    @param statePath: Path of the journal state file.
+    """
+    try:
+        with open(statePath,'r') as stateFile:
+            return json.load(stateFile)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def writeState(statePath: str, state: dict[str, int]) -> None:
+    """
+    Save the journal state, replacing the previous one.
+
+    @type statePath: str
+    @param statePath: Path of the journal state file.
+    @type state: dict[str, int]
+    @param state: Journal identity (`dev`, `ino`), read `offset` and time of the last full scan (`fullScan`).
+    """
+    tempPath = statePath + '.tmp'
+    with open(tempPath,'w') as stateFile:
+        json.dump(state, stateFile)
+        stateFile.flush()
+        os.fsync(stateFile.fileno())
+    os.replace(tempPath, statePath)
+
+def journalPosition(indexPath: str) -> dict[str, int]:
+    """
+    Returns the identity and current end of the change journal of a profile, or
+    None if there is no journal. Taken before a backup scans anything, so changes
+    made during the scan are read again by the next backup.
+
+    @type indexPath: str
+    @param indexPath: Path to the index file of the profile.
+    """
+    try:
+        stats = os.stat(journalPath(indexPath))
+    except (FileNotFoundError):
+        return None
+    return {'dev':stats.st_dev, 'ino':stats.st_ino, 'offset':stats.st_size}
+
+def readChanges(indexPath: str, position: dict[str, int], fullScanInterval: int) -> ChangeSet:
+    """
+    Returns the changes journaled since the last backup, up to the given journal
+    position, or None if the backup has to scan the whole source directory. That
+    is the case when there is no journal or no state from an earlier backup, the
+    journal was replaced, the watcher restarted or lost events, or the last full
+    scan is older than `fullScanInterval` hours.
+
+    @type indexPath: str
+    @param indexPath: Path to the index file of the profile.
+    @type position: dict[str, int]
+    @param position: Journal position taken before the backup (see `journalPosition`).
+    @type fullScanInterval: int
+    @param fullScanInterval: Hours after which a full scan is done anyway, 0 for never.
+    """
+    state = readState(journalStatePath(indexPath))
+    if (position == None or state == None):
+        return None
+    if (state.get('dev') != position.get('dev') or state.get('ino') != position.get('ino')):
+        return None
+    if (fullScanInterval > 0 and time.time() - state.get('fullScan', 0) > fullScanInterval * 3600):
+        return None
+    offset = state.get('offset', 0)
+    if (offset > position.get('offset')):
+        return None
+
+    changes = ChangeSet()
+    with open(journalPath(indexPath),'rb') as journalFile:
+        journalFile.seek(offset)
+        data = journalFile.read(position.get('offset') - offset)
+    # a record still being written is read by the next backup
+    data = data[:data.rfind(b'\n') + 1]
+    position.update({'offset':offset + len(data)})
+    for line in data.splitlines():
+        kind, path = parseRecord(line)
+        if (kind in [JOURNAL_OVERFLOW, JOURNAL_START]):
+            return None
+        changes.add(kind, path)
+    return changes
+
+def saveChanges(indexPath: str, position: dict[str, int], fullScan: bool) -> None:
+    """
+    Record that a backup has read the change journal up to the given position.
+    Does nothing if there is no journal.
+
+    @type indexPath: str
+    @param indexPath: Path to the index file of the profile.
+    @type position: dict[str, int]
+    @param position: Journal position taken before the backup (see `journalPosition`).
+    @type fullScan: bool
+    @param fullScan: Whether the backup scanned the whole source directory.
+    """
+    if (position == None):
+        return
+    statePath = journalStatePath(indexPath)
+    state = dict(position)
+    if (fullScan):
+        state.update({'fullScan':time.time()})
+    else:
+        previous = readState(statePath)
+        state.update({'fullScan':previous.get('fullScan', 0) if previous != None else 0})
+    writeState(statePath, state)
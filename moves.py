@@ -0,0 +1,189 @@
+from bisect import bisect_left
+import os
+
+from delta import blockSidecarDir, blockSidecarPath
+from indexstore import IndexStore
+
+def isUnder(path: str, directory: str) -> bool:
+    """
+    Returns true if the path is the directory itself or inside of it.
+
+    @type path: str
+    @param path: Path to check.
+    @type directory: str
+    @param directory: Directory path.
+    """
+    return path == directory or path.startswith(directory + os.sep)
+
+def splitMove(oldPath: str, newPath: str) -> tuple[str, str, int]:
+    """
+    Split the old and new path of a moved file into the directories that were
+    renamed and the number of trailing path components both paths share. A file
+    renamed inside its directory shares nothing, so the returned directories are
+    the file paths themselves.
+
+    @type oldPath: str
+    @param oldPath: Path the file used to be stored at.
+    @type newPath: str
+    @param newPath: Path the file has to be stored at now.
+    """
+    oldParts = oldPath.split(os.sep)
+    newParts = newPath.split(os.sep)
+    shared = 0
+    while (shared < min(len(oldParts), len(newParts)) - 1 and oldParts[-1 - shared] == newParts[-1 - shared]):
+        shared += 1
+    return (os.sep.join(oldParts[:len(oldParts) - shared]), os.sep.join(newParts[:len(newParts) - shared]), shared)
+
+class DirCounter:
+    """
+    ## DirCounter
+    The DirCounter class answers how many index entries are stored under a
+    backup directory, including its subdirectories, using a sorted list of the
+    stored directories and a running total of their entry counts.
+    """
+    def __init__(self, index: IndexStore):
+        """
+        @type index: IndexStore
+        @param index: The loaded index.
+        """
+        self.counts = index.storedDirCounts()
+        self.dirs = sorted(self.counts.keys())
+        self.totals = [0]
+        for directory in self.dirs:
+            self.totals.append(self.totals[-1] + self.counts.get(directory))
+
+    def countUnder(self, directory: str) -> int:
+        """
+        Returns the number of entries stored in the directory or any of its subdirectories.
+
+        @type directory: str
+        @param directory: Directory in the backup.
+        """
+        # every path starting with `directory + os.sep` sorts between these two
+        first = bisect_left(self.dirs, directory + os.sep)
+        last = bisect_left(self.dirs, directory + chr(ord(os.sep) + 1))
+        return self.counts.get(directory, 0) + self.totals[last] - self.totals[first]
+
+def fileMoveOperation(fileMove: dict[str, any], backupPath: str, metadataPath: str) -> dict[str, any]:
+    """
+    Returns the move operation for a single moved file.
+
+    @type fileMove: dict[str, any]
+    @param fileMove: The moved file (`entry` and the old stored path as `source`).
+    @type backupPath: str
+    @param backupPath: Resolved backup path of the profile.
+    @type metadataPath: str
+    @param metadataPath: Metadata directory of the backup.
+    """
+    entry = fileMove.get('entry')
+    return {
+        'source':fileMove.get('source'),
+        'destination':entry.stored_path,
+        'directory':False,
+        'files':[fileMove],
+        'size':entry.st_size,
+        'statSource':os.path.dirname(entry.real_path),
+        'sidecars':(blockSidecarPath(metadataPath, backupPath, fileMove.get('source')), blockSidecarPath(metadataPath, backupPath, entry.stored_path))
+    }
+
+def planMoves(fileMoves: list[dict[str, any]], index: IndexStore, backupPath: str, metadataPath: str) -> list[dict[str, any]]:
+    """
+    Turn the files found at a new path during the scan into move operations for
+    `moveFiles`. Files that moved together with their directory are collapsed
+    into a single directory rename, as long as every index entry stored under
+    the old directory moved the same way and the new directory does not exist
+    in the backup yet. Every other file is moved on its own.
+
+    Directory operations are returned first, followed by the file operations
+    in the order they have to run in (see `orderMoves`).
+
+    @type fileMoves: list[dict[str, any]]
+    @param fileMoves: Moved files (`entry` and the old stored path as `source`).
+    @type index: IndexStore
+    @param index: The loaded index.
+    @type backupPath: str
+    @param backupPath: Resolved backup path of the profile.
+    @type metadataPath: str
+    @param metadataPath: Metadata directory of the backup.
+    """
+    groups = {}
+    for fileMove in fileMoves:
+        entry = fileMove.get('entry')
+        oldDir, newDir, shared = splitMove(fileMove.get('source'), entry.stored_path)
+        if (shared == 0):
+            continue
+        group = groups.get((oldDir, newDir))
+        if (group == None):
+            realDir = os.sep.join(entry.real_path.split(os.sep)[:-shared])
+            group = {'files':[], 'realDir':realDir}
+            groups.update({(oldDir, newDir):group})
+        group.get('files').append(fileMove)
+
+    directoryOperations = []
+    collapsed = set()
+    if (len(groups) > 0):
+        counter = DirCounter(index)
+        for (oldDir, newDir), group in sorted(groups.items()):
+            files = group.get('files')
+            if (len(files) != counter.countUnder(oldDir)):
+                continue
+            if (isUnder(newDir, oldDir) or isUnder(oldDir, newDir)):
+                continue
+            # renaming onto or out of a directory another rename touches
+            # depends on the order they run in, so only the first one is kept
+            if (any(isUnder(newDir, move.get('source')) or isUnder(oldDir, move.get('destination')) or isUnder(move.get('destination'), oldDir) for move in directoryOperations)):
+                continue
+            if (not os.path.isdir(oldDir) or os.path.lexists(newDir)):
+                continue
+            directoryOperations.append({
+                'source':oldDir,
+                'destination':newDir,
+                'directory':True,
+                'files':files,
+                'size':sum(fileMove.get('entry').st_size for fileMove in files),
+                'statSource':group.get('realDir'),
+                'sidecars':(blockSidecarDir(metadataPath, backupPath, oldDir), blockSidecarDir(metadataPath, backupPath, newDir)),
+                'fallback':[fileMoveOperation(fileMove, backupPath, metadataPath) for fileMove in files]
+            })
+            collapsed.update(id(fileMove) for fileMove in files)
+
+    fileOperations = [fileMoveOperation(fileMove, backupPath, metadataPath) for fileMove in fileMoves if id(fileMove) not in collapsed]
+    return directoryOperations + orderMoves(fileOperations)
+
+def orderMoves(operations: list[dict[str, any]]) -> list[dict[str, any]]:
+    """
+    Order file move operations so a file is only moved onto the old path of
+    another moved file once that file has been moved away, as when log files
+    are rotated (`app.log.1` to `app.log.2`, then `app.log` to `app.log.1`).
+    Where the moves form a cycle, as when two files swapped names, one move
+    of the cycle is marked `viaTemp`, so its file is moved out of the way
+    first, and ordered last.
+
+    @type operations: list[dict[str, any]]
+    @param operations: File move operations (see `fileMoveOperation`).
+    """
+    bySource = {move.get('source'):move for move in operations}
+    ordered = []
+    # 1 while the moves that have to run before a move are being ordered, 2 once it is ordered
+    states = {}
+    for first in operations:
+        if (id(first) in states):
+            continue
+        # follow the chain of moves whose old path is the new path of the previous one
+        chain = [first]
+        states.update({id(first):1})
+        while (True):
+            blocker = bySource.get(chain[-1].get('destination'))
+            if (blocker == None or states.get(id(blocker)) == 2):
+                break
+            if (states.get(id(blocker)) == 1):
+                blocker.update({'viaTemp':True})
+                break
+            chain.append(blocker)
+            states.update({id(blocker):1})
+        for move in reversed(chain):
+            states.update({id(move):2})
+            ordered.append(move)
+    for move in operations:
+        move.setdefault('viaTemp', False)
+    return ordered
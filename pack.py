@@ -0,0 +1,190 @@
+import os
+import struct
+import threading
+
+from digest import newHasher
+
+# pack records: a header, the original path of the file, then its content
+PACK_RECORD = struct.Struct('<4sIQ') # magic, path length, content length
+PACK_RECORD_MAGIC = b'RIBP'
+PACK_PREFIX = 'pack:'
+# a new pack file is started once the current one is this large
+PACK_MAX_SIZE = 1024 * 1024 * 1024
+BUFFER_SIZE = 4 * 1024 * 1024
+
+def packDir(metadataPath: str) -> str:
+    """
+    Returns the directory holding the pack files of a backup.
+
+    @type metadataPath: str
+    @param metadataPath: Metadata directory of the backup.
+    """
+    return os.path.join(metadataPath, 'packs')
+
+def packPath(metadataPath: str, packId: int) -> str:
+    """
+    Returns the path of a pack file.
+
+    @type metadataPath: str
+    @param metadataPath: Metadata directory of the backup.
+    @type packId: int
+    @param packId: Number of the pack file.
+    """
+    return os.path.join(packDir(metadataPath), f"{packId:06d}.pack")
+
+def isPackLocator(storedPath: str) -> bool:
+    """
+    Returns true if a stored path read from the index points into a pack file
+    instead of at a file in the backup.
+
+    @type storedPath: str
+    @param storedPath: Stored path of an index entry.
+    """
+    return storedPath.startswith(PACK_PREFIX)
+
+def formatLocator(packId: int, offset: int, length: int) -> str:
+    """
+    Returns the stored path recorded in the index for a packed file.
+
+    @type packId: int
+    @param packId: Number of the pack file.
+    @type offset: int
+    @param offset: Offset of the content in the pack file.
+    @type length: int
+    @param length: Length of the content.
+    """
+    return f"{PACK_PREFIX}{packId}:{offset}:{length}"
+
+def parseLocator(locator: str) -> tuple[int, int, int]:
+    """
+    Returns the `(packId, offset, length)` of a packed file from its stored path.
+
+    @type locator: str
+    @param locator: Stored path of the packed file (see `formatLocator`).
+    """
+    packId, offset, length = locator[len(PACK_PREFIX):].split(':')
+    return (int(packId), int(offset), int(length))
+
+def readPacked(metadataPath: str, locator: str) -> bytes:
+    """
+    Returns the content of a packed file.
+
+    @type metadataPath: str
+    @param metadataPath: Metadata directory of the backup.
+    @type locator: str
+    @param locator: Stored path of the packed file.
+    """
+    packId, offset, length = parseLocator(locator)
+    with open(packPath(metadataPath, packId),'rb') as packFile:
+        content = os.pread(packFile.fileno(), length, offset)
+    if (len(content) != length):
+        raise EOFError(f"Pack file {packId} ends before {locator}")
+    return content
+
+def extractPacked(metadataPath: str, locator: str, destination: str, st_mtime_ns: int = None) -> None:
+    """
+    Write a packed file back out to a destination path.
+
+    @type metadataPath: str
+    @param metadataPath: Metadata directory of the backup.
+    @type locator: str
+    @param locator: Stored path of the packed file.
+    @type destination: str
+    @param destination: Path to write the file to.
+    @type st_mtime_ns: int
+    @param st_mtime_ns: Modification time to give the file, from the index.
+        (default is None, left as written)
+    """
+    content = readPacked(metadataPath, locator)
+    with open(destination,'wb') as file:
+        file.write(content)
+    if (st_mtime_ns != None):
+        os.utime(destination, ns=(st_mtime_ns, st_mtime_ns))
+
+class PackWriter:
+    """
+    ## PackWriter
+    The PackWriter class appends small files to the pack files of a backup,
+    instead of storing each of them as a file of its own. Pack files are only
+    ever appended to, a new one is started once the last one reaches
+    `PACK_MAX_SIZE`. Each file becomes a record holding its original path and
+    its content, and its index entry records where the content starts (see
+    `formatLocator`).
+
+    Files are read on the calling thread and appended under a lock, so it is
+    safe to call `append()` from the copy workers. Appended records only
+    become part of the backup once `commit()` synced them, before the index
+    that points at them is written.
+    """
+    def __init__(self, metadataPath: str):
+        """
+        @type metadataPath: str
+        @param metadataPath: Metadata directory of the backup.
+        """
+        self.metadataPath = metadataPath
+        self.lock = threading.Lock()
+        self.packId = None
+        self.file = None
+        self.offset = 0
+        os.makedirs(packDir(metadataPath), exist_ok=True)
+        packIds = [int(name[:-len('.pack')]) for name in os.listdir(packDir(metadataPath)) if name.endswith('.pack') and name[:-len('.pack')].isdigit()]
+        self.nextId = max(packIds) + 1 if len(packIds) > 0 else 1
+        # the last pack file is continued if it has room left
+        if (len(packIds) > 0 and os.path.getsize(packPath(metadataPath, max(packIds))) < PACK_MAX_SIZE):
+            self.nextId = max(packIds)
+
+    def openPack(self) -> None:
+        """
+        Open the next pack file for appending.
+        """
+        if (self.file != None):
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+        self.packId = self.nextId
+        self.nextId += 1
+        self.file = open(packPath(self.metadataPath, self.packId), 'ab', buffering=BUFFER_SIZE)
+        self.offset = self.file.tell()
+
+    def append(self, source: str, computeDigest: bool = False) -> tuple[str, bytes]:
+        """
+        Append a file to the current pack file. Returns the stored path of the
+        packed file, and its content digest if asked for.
+
+        @type source: str
+        @param source: Path of the original file.
+        @type computeDigest: bool
+        @param computeDigest: Whether to return the content digest.
+            (default is False)
+        """
+        with open(source,'rb') as sourceFile:
+            content = sourceFile.read()
+        digest = None
+        if (computeDigest):
+            hasher = newHasher()
+            hasher.update(content)
+            digest = hasher.digest()
+        encodedPath = source.encode('utf-8', 'surrogateescape')
+        header = PACK_RECORD.pack(PACK_RECORD_MAGIC, len(encodedPath), len(content))
+        with self.lock:
+            if (self.file == None or self.offset >= PACK_MAX_SIZE):
+                self.openPack()
+            self.file.write(header)
+            self.file.write(encodedPath)
+            self.file.write(content)
+            contentOffset = self.offset + len(header) + len(encodedPath)
+            self.offset = contentOffset + len(content)
+            packId = self.packId
+        return (formatLocator(packId, contentOffset, len(content)), digest)
+
+    def commit(self) -> None:
+        """
+        Flush and sync the records appended so far, and close the pack file.
+        """
+        with self.lock:
+            if (self.file != None):
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.file = None
+                self.nextId = self.packId
@@ -0,0 +1,134 @@
+import os
+import shutil
+from typing import Iterator
+
+from chunkstore import ChunkStore, isChunkLocator
+from compressor import decompressFile
+from fastcopy import fastCopy
+from indexfile import isDirLine, parseDirLine, parseIndexEntry
+from indexstore import IndexStore, isBinaryIndex
+from pack import extractPacked, isPackLocator
+
+class RestoreEntry:
+    """
+    ## RestoreEntry
+    The RestoreEntry class is a lightweight record of a file or directory read
+    from the index for a restore.
+    """
+    __slots__ = ('real_path', 'stored_path', 'st_mtime_ns', 'st_size', 'codec', 'is_dir')
+
+    def __init__(self, real_path: str, stored_path: str, st_mtime_ns: int, st_size: int = -1, codec: str = None, is_dir: bool = False):
+        """
+        @type real_path: str
+        @param real_path: Path of the original file or directory.
+        @type stored_path: str
+        @param stored_path: Path the file is stored at in the backup, or its pack or chunk store locator.
+        @type st_mtime_ns: int
+        @param st_mtime_ns: Last modification time recorded in the index, in nanoseconds.
+        @type st_size: int
+        @param st_size: Size of the file in bytes.
+            (default is -1, unknown)
+        @type codec: str
+        @param codec: Codec the stored file is compressed with.
+            (default is None, stored as is)
+        @type is_dir: bool
+        @param is_dir: Whether the entry is a directory record.
+            (default is False)
+        """
+        self.real_path = real_path
+        self.stored_path = stored_path
+        self.st_mtime_ns = st_mtime_ns
+        self.st_size = st_size
+        self.codec = codec
+        self.is_dir = is_dir
+
+def isUnder(path: str, prefix: str) -> bool:
+    """
+    Returns true if a path is the prefix itself or lies below it.
+
+    @type path: str
+    @param path: Path to check.
+    @type prefix: str
+    @param prefix: Directory or file path, or None to accept every path.
+    """
+    return prefix == None or path == prefix or path.startswith(prefix + os.sep)
+
+def streamIndex(indexPath: str, prefix: str = None) -> Iterator[RestoreEntry]:
+    """
+    Yields the files and directory records of the index that lie below a path
+    prefix. A text index is read one line at a time. A binary index is memory
+    mapped, its directory table is matched against the prefix first and only
+    the entries of matching directories are decoded. Either way, memory use
+    follows the size of the restored subtree rather than that of the index.
+
+    @type indexPath: str
+    @param indexPath: Path to the index file.
+    @type prefix: str
+    @param prefix: Original path of the directory or file to restore.
+        (default is None, everything)
+    """
+    if (isBinaryIndex(indexPath)):
+        index = IndexStore.load(indexPath)
+        try:
+            # one flag per directory, set if the directory is below the prefix
+            # or holds a file that may be the prefix itself
+            prefixDir = os.path.dirname(prefix) if prefix != None else None
+            matching = bytearray(isUnder(directory, prefix) or directory == prefixDir for directory in index.dirs)
+            for dirId, directory in enumerate(index.dirs):
+                if (matching[dirId] and index.dirMtimes[dirId] >= 0 and isUnder(directory, prefix)):
+                    yield RestoreEntry(directory, index.dirs[index.dirStoredIds[dirId]], index.dirMtimes[dirId], is_dir=True)
+            for row, dirId in enumerate(index.dirIds):
+                if (matching[dirId]):
+                    real_path = index.getRealPath(row)
+                    if (isUnder(real_path, prefix)):
+                        yield RestoreEntry(real_path, index.getStoredPath(row), index.getMtime(row), index.getSize(row), index.getCodec(row))
+        finally:
+            index.close()
+        return
+
+    with open(indexPath,'r') as indexFile:
+        for line in indexFile:
+            if (line == '\n'):
+                continue
+            if (isDirLine(line)):
+                st_mtime_ns, childCount, real_path, stored_path = parseDirLine(line)
+                if (isUnder(real_path, prefix)):
+                    yield RestoreEntry(real_path, stored_path, st_mtime_ns, is_dir=True)
+                continue
+            st_ino, st_mtime_ns, real_path, stored_path, extras = parseIndexEntry(line)
+            if (isUnder(real_path, prefix)):
+                yield RestoreEntry(real_path, stored_path, st_mtime_ns, int(extras.get('size', -1)), extras.get('codec'))
+
+def restoreFile(entry: RestoreEntry, destination: str, metadataPath: str, chunkStore: ChunkStore, backend: str = 'shutil') -> str:
+    """
+    Write a file from the backup back out to a destination path and return
+    the method used. Packed files and files in the chunk store are extracted
+    and given their modification time from the index, compressed files are
+    decompressed, and everything else is copied with its stats.
+
+    @type entry: RestoreEntry
+    @param entry: The file to restore.
+    @type destination: str
+    @param destination: Path to restore the file to.
+    @type metadataPath: str
+    @param metadataPath: Metadata directory of the backup, holding the pack files.
+    @type chunkStore: ChunkStore
+    @param chunkStore: Chunk store of the profile.
+    @type backend: str
+    @param backend: How stored files are copied, `'kernel'` (see `fastCopy`) or `'shutil'`.
+        (default is `'shutil'`)
+    """
+    if (isPackLocator(entry.stored_path)):
+        extractPacked(metadataPath, entry.stored_path, destination, entry.st_mtime_ns)
+        return 'pack'
+    if (isChunkLocator(entry.stored_path)):
+        chunkStore.extract(entry.stored_path, destination, entry.st_mtime_ns)
+        return 'dedup'
+    if (entry.codec != None):
+        decompressFile(entry.stored_path, destination, entry.codec)
+        shutil.copystat(entry.stored_path, destination)
+        return entry.codec
+    if (backend == 'kernel'):
+        return fastCopy(entry.stored_path, destination)
+    shutil.copy2(entry.stored_path, destination)
+    return 'shutil'
@@ -0,0 +1,366 @@
+import os
+import re
+import time
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+AGE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+ACTIONS = {'include': True, '+': True, 'exclude': False, '-': False}
+# a predicate ends a rule, such as `size>10M` or `age<30d`
+PREDICATE = re.compile(r'(size|age)(<=|>=|<|>)(\d+)([A-Za-z]?)')
+# anything else starting like one is a mistyped predicate, not part of the pattern
+PREDICATE_LIKE = re.compile(r'(size|age)[<>=!]')
+GLOB_CHARS = re.compile(r'[*?\[]')
+REGEX_PREFIX = 're:'
+
+def relativePath(path: str, root: str) -> str:
+    """
+    Returns the path rules are matched against: the path relative to the
+    original path of the profile, with `/` separators and no leading `/`.
+
+    @type path: str
+    @param path: Path inside the original path.
+    @type root: str
+    @param root: Resolved original path of the profile.
+    """
+    relative = path[len(root) + 1:]
+    if (os.sep != '/'):
+        relative = relative.replace(os.sep, '/')
+    return relative
+
+def escapeGlob(name: str) -> str:
+    """
+    Returns a glob matching a name literally.
+
+    @type name: str
+    @param name: Name of a file or directory.
+    """
+    return re.sub(r'([*?\[])', r'[\1]', name)
+
+def translateGlob(pattern: str) -> str:
+    """
+    Returns a regular expression matching the same relative paths as a glob.
+    `*` and `?` do not match a `/`, `**` matches any number of directories and
+    `[...]` matches one character of a set.
+
+    @type pattern: str
+    @param pattern: Glob pattern, relative to the original path.
+    """
+    source = []
+    position = 0
+    while (position < len(pattern)):
+        char = pattern[position]
+        if (pattern.startswith('**/', position)):
+            source.append('(?:.*/)?')
+            position += 3
+            continue
+        if (pattern.startswith('**', position)):
+            source.append('.*')
+            position += 2
+            continue
+        if (char == '*'):
+            source.append('[^/]*')
+        elif (char == '?'):
+            source.append('[^/]')
+        elif (char == '[' and pattern.find(']', position + 2) > 0):
+            end = pattern.find(']', position + 2)
+            members = pattern[position + 1:end].replace('\\', '\\\\')
+            if (members.startswith('!')):
+                members = '^' + members[1:]
+            source.append('[' + members + ']')
+            position = end + 1
+            continue
+        else:
+            source.append(re.escape(char))
+        position += 1
+    return ''.join(source)
+
+class Rule:
+    """
+    ## Rule
+    The Rule class is a single include or exclude rule of a profile, written as
+    `<include|exclude> <pattern> [predicates]`:
+
+    - A pattern without a `/` matches the name of a file or directory at any
+      depth, such as `node_modules` or `*.tmp`.
+    - A pattern with a `/` is anchored to the original path, such as
+      `/build` or `src/**/generated`.
+    - A pattern ending in `/` only matches directories.
+    - A pattern starting with `re:` is a regular expression searched for in
+      the path relative to the original path.
+    - Predicates only apply to files: `size>10M`, `size<=4K`, `age>30d` or
+      `age<12h` (units `s`, `m`, `h`, `d` and `w`, age is measured from the
+      last modification).
+    """
+    __slots__ = ('number', 'text', 'include', 'dirOnly', 'isRegex', 'literal', 'name', 'source', 'regex', 'predicates')
+
+    def __init__(self, text: str, number: int):
+        """
+        @type text: str
+        @param text: The rule as written in the profile.
+        @type number: int
+        @param number: Position of the rule, the first matching rule applies.
+        """
+        self.number = number
+        self.text = text
+        action, _, rest = text.strip().partition(' ')
+        if (action not in ACTIONS):
+            raise ValueError(f"Rule must start with include or exclude: {text}")
+        self.include = ACTIONS.get(action)
+        self.predicates = []
+        pattern = rest.strip()
+        while (True):
+            head, _, last = pattern.rpartition(' ')
+            predicate = PREDICATE.fullmatch(last)
+            if (head != '' and predicate == None and PREDICATE_LIKE.match(last) != None):
+                raise ValueError(f"Rule has an invalid predicate: {text}")
+            if (head == '' or predicate == None):
+                break
+            self.predicates.append(parsePredicate(predicate, text))
+            pattern = head.strip()
+        if (pattern == ''):
+            raise ValueError(f"Rule has no pattern: {text}")
+        self.dirOnly = False
+        self.isRegex = pattern.startswith(REGEX_PREFIX)
+        self.literal = None
+        self.name = None
+        if (self.isRegex):
+            # searched for anywhere in the path, as by `re.search`
+            self.source = '.*?(?:' + pattern[len(REGEX_PREFIX):] + ').*'
+        else:
+            if (pattern.endswith('/')):
+                self.dirOnly = True
+                pattern = pattern.rstrip('/')
+            anchored = '/' in pattern
+            pattern = pattern.lstrip('/')
+            if (GLOB_CHARS.search(pattern) == None):
+                if (anchored):
+                    self.literal = pattern
+                else:
+                    self.name = pattern
+            self.source = translateGlob(pattern) if anchored else '(?:.*/)?' + translateGlob(pattern)
+        try:
+            self.regex = re.compile(self.source, re.DOTALL)
+        except re.error as error:
+            raise ValueError(f"Rule has an invalid pattern: {text}: {error}")
+
+    def matches(self, relativePath: str, stats: os.stat_result = None) -> bool:
+        """
+        Returns true if the rule matches a path, and its predicates the stats of the file.
+
+        @type relativePath: str
+        @param relativePath: Path relative to the original path (see `relativePath`).
+        @type stats: os.stat_result
+        @param stats: Stats of the file, or None for a directory.
+            (default is None)
+        """
+        if (self.regex.fullmatch(relativePath) == None):
+            return False
+        for field, compare, limit in self.predicates:
+            value = stats.st_size if field == 'size' else time.time() - stats.st_mtime
+            if (not compare(value, limit)):
+                return False
+        return True
+
+COMPARISONS = {
+    '<': lambda value, limit: value < limit,
+    '<=': lambda value, limit: value <= limit,
+    '>': lambda value, limit: value > limit,
+    '>=': lambda value, limit: value >= limit
+}
+
+def parsePredicate(predicate: re.Match, text: str) -> tuple[str, callable, int]:
+    """
+    Returns the field, comparison and limit of a parsed rule predicate.
+
+    @type predicate: re.Match
+    @param predicate: Match of `PREDICATE`.
+    @type text: str
+    @param text: The rule, for errors.
+    """
+    field, operator, amount, unit = predicate.groups()
+    units = SIZE_UNITS if field == 'size' else AGE_UNITS
+    unit = unit.upper() if field == 'size' else unit.lower()
+    if (unit not in units or (field == 'age' and unit == '')):
+        raise ValueError(f"Rule has an invalid {field} unit: {text}")
+    return (field, COMPARISONS.get(operator), int(amount) * units.get(unit))
+
+class Matcher:
+    """
+    ## Matcher
+    The Matcher class finds the first rule matching a path among rules compiled
+    for fast matching. Rules for a literal path are looked up by path, and rules
+    for a literal name by name. All other glob rules are combined into a single
+    regular expression, whose first matching alternative is the first matching
+    rule. Regular expression rules and rules with predicates are tried one at a
+    time, and only while they come before the best match found so far.
+    """
+    def __init__(self, rules: list[Rule]):
+        """
+        @type rules: list[Rule]
+        @param rules: Rules in the order they apply.
+        """
+        self.paths = {}
+        self.names = {}
+        self.single = []
+        globs = []
+        for rule in rules:
+            if (len(rule.predicates) > 0 or rule.isRegex):
+                self.single.append(rule)
+            elif (rule.literal != None):
+                self.paths.setdefault(rule.literal, rule)
+            elif (rule.name != None):
+                self.names.setdefault(rule.name, rule)
+            else:
+                globs.append(rule)
+        self.globRules = {f"r{rule.number}":rule for rule in globs}
+        self.globs = None
+        if (len(globs) > 0):
+            self.globs = re.compile('|'.join(f"(?P<r{rule.number}>{rule.source})" for rule in globs), re.DOTALL)
+
+    def __len__(self) -> int:
+        return len(self.paths) + len(self.names) + len(self.globRules) + len(self.single)
+
+    def match(self, relativePath: str, name: str, stats: os.stat_result = None) -> Rule:
+        """
+        Returns the first rule matching a path, or None.
+
+        @type relativePath: str
+        @param relativePath: Path relative to the original path (see `relativePath`).
+        @type name: str
+        @param name: Name of the file or directory.
+        @type stats: os.stat_result
+        @param stats: Stats of the file, or None for a directory.
+            (default is None)
+        """
+        best = self.paths.get(relativePath)
+        rule = self.names.get(name)
+        if (rule != None and (best == None or rule.number < best.number)):
+            best = rule
+        if (self.globs != None):
+            match = self.globs.fullmatch(relativePath)
+            if (match != None):
+                rule = self.globRules.get(match.lastgroup)
+                if (best == None or rule.number < best.number):
+                    best = rule
+        for rule in self.single:
+            if (best != None and rule.number > best.number):
+                break
+            if (rule.matches(relativePath, stats)):
+                return rule
+        return best
+
+class RuleSet:
+    """
+    ## RuleSet
+    The RuleSet class decides which files and directories of the original path
+    are backed up. Rules are compiled once per profile into one Matcher for
+    directories and one for files. The first matching rule applies, and
+    anything no rule matches is included. An excluded directory is not
+    listed, so nothing inside it is backed up, whatever later rules say.
+    """
+    def __init__(self, rules: list[str]):
+        """
+        @type rules: list[str]
+        @param rules: Rules in the order they apply (see `Rule`).
+        """
+        self.rules = [Rule(text, number) for number, text in enumerate(rules)]
+        # predicates only apply to files, a pattern ending in `/` only to directories
+        self.dirMatcher = Matcher([rule for rule in self.rules if len(rule.predicates) == 0])
+        self.fileMatcher = Matcher([rule for rule in self.rules if not rule.dirOnly])
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def includesDir(self, relativePath: str, name: str) -> bool:
+        """
+        Returns true if a directory is backed up, given that its parent is.
+
+        @type relativePath: str
+        @param relativePath: Path relative to the original path (see `relativePath`).
+        @type name: str
+        @param name: Name of the directory.
+        """
+        rule = self.dirMatcher.match(relativePath, name)
+        return rule == None or rule.include
+
+    def includesFile(self, relativePath: str, name: str, stats: os.stat_result) -> bool:
+        """
+        Returns true if a file is backed up, given that its directory is.
+
+        @type relativePath: str
+        @param relativePath: Path relative to the original path (see `relativePath`).
+        @type name: str
+        @param name: Name of the file.
+        @type stats: os.stat_result
+        @param stats: Stats of the file.
+        """
+        rule = self.fileMatcher.match(relativePath, name, stats)
+        return rule == None or rule.include
+
+    def includesPath(self, path: str, root: str) -> bool:
+        """
+        Returns true if a directory is backed up, checking every directory
+        from the original path down to it. Used for directories that are
+        reached without walking down to them, such as those of the change journal.
+
+        @type path: str
+        @param path: Path of the directory.
+        @type root: str
+        @param root: Resolved original path of the profile.
+        """
+        relative = relativePath(path, root)
+        if (relative == ''):
+            return True
+        parts = relative.split('/')
+        for depth in range(len(parts)):
+            if (not self.includesDir('/'.join(parts[:depth + 1]), parts[depth])):
+                return False
+        return True
+
+def rulesPath(indexPath: str) -> str:
+    """
+    Returns the path of the file keeping the rules of the last run of a profile.
+
+    @type indexPath: str
+    @param indexPath: Path to the index file of the profile.
+    """
+    return indexPath + '.rules'
+
+def formatRules(rules: RuleSet) -> str:
+    """
+    Returns the rules as saved by `saveRules`, an empty string for None.
+
+    @type rules: RuleSet
+    @param rules: Rules of the profile, or None.
+    """
+    if (rules == None):
+        return ''
+    return ''.join(rule.text.strip() + '\n' for rule in rules.rules)
+
+def readRules(indexPath: str) -> str:
+    """
+    Returns the rules the last run of a profile was scanned with, as saved by
+    `saveRules`, or an empty string if none were saved.
+
+    @type indexPath: str
+    @param indexPath: Path to the index file of the profile.
+    """
+    try:
+        with open(rulesPath(indexPath),'r') as rulesFile:
+            return rulesFile.read()
+    except (FileNotFoundError):
+        return ''
+
+def saveRules(indexPath: str, rules: RuleSet) -> None:
+    """
+    Save the rules a run was scanned with, for the next run to compare against.
+
+    @type indexPath: str
+    @param indexPath: Path to the index file of the profile.
+    @type rules: RuleSet
+    @param rules: Rules of the profile, or None.
+    """
+    tempPath = rulesPath(indexPath) + '.tmp'
+    with open(tempPath,'w') as rulesFile:
+        rulesFile.write(formatRules(rules))
+    os.replace(tempPath, rulesPath(indexPath))
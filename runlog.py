@@ -0,0 +1,154 @@
+import atexit
+import datetime
+import json
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG:'DEBUG', INFO:'INFO', WARNING:'WARNING', ERROR:'ERROR'}
+
+def parseLevel(name: str) -> int:
+    """
+    Returns the log level with the given name (`debug`, `info`, `warning` or `error`).
+
+    @type name: str
+    @param name: Name of the level, in any case.
+    """
+    for level, levelName in LEVEL_NAMES.items():
+        if (levelName == name.strip().upper()):
+            return level
+    raise ValueError(f"Unknown log level: {name}")
+
+class RunLog:
+    """
+    ## RunLog
+    The RunLog class writes log records to a file from a background thread.
+    Callers only append the record to a buffer, which is written out once it
+    holds `flushSize` records, after `flushInterval` seconds, or when `flush()`
+    is called, keeping the file open in between. It is safe to call from any
+    thread.
+
+    Records have a level and optional structured fields (such as `profile`,
+    `operation` and `path`). In the `text` format, lines look like the original
+    `backup.log` lines, with the level added for warnings and errors and the
+    profile added when it is set. The `json` format writes one JSON object per
+    line, including every field.
+    """
+    def __init__(self, path: str, level: int = INFO, logFormat: str = 'text', flushSize: int = 512, flushInterval: float = 1.0):
+        """
+        @type path: str
+        @param path: Path of the log file, appended to.
+        @type level: int
+        @param level: Records below this level are dropped.
+            (default is INFO)
+        @type logFormat: str
+        @param logFormat: `'text'` or `'json'`.
+            (default is `'text'`)
+        @type flushSize: int
+        @param flushSize: Number of buffered records that triggers a write.
+            (default is 512)
+        @type flushInterval: float
+        @param flushInterval: Most seconds a record waits in the buffer.
+            (default is 1.0)
+        """
+        self.path = path
+        self.level = level
+        self.logFormat = logFormat
+        self.flushSize = flushSize
+        self.flushInterval = flushInterval
+        self.records = []
+        self.condition = threading.Condition()
+        # flush() requests, and how many of them have been written
+        self.requested = 0
+        self.written = 0
+        self.closed = False
+        self.file = open(path, 'a')
+        self.thread = threading.Thread(target=self.run, name='RunLog', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def log(self, message: str, level: int = INFO, **fields: any) -> None:
+        """
+        Add a record to the log.
+
+        @type message: str
+        @param message: Message to be logged.
+        @type level: int
+        @param level: Level of the record.
+            (default is INFO)
+        @type fields: any
+        @param fields: Structured fields of the record.
+        """
+        if (level < self.level):
+            return
+        with self.condition:
+            if (self.closed):
+                return
+            self.records.append((time.time(), level, message, fields))
+            if (len(self.records) >= self.flushSize):
+                self.condition.notify_all()
+
+    def flush(self) -> None:
+        """
+        Wait until every record added so far has been written to the file.
+        """
+        with self.condition:
+            if (self.closed):
+                return
+            self.requested += 1
+            target = self.requested
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: self.written >= target or not self.thread.is_alive())
+
+    def close(self) -> None:
+        """
+        Write the remaining records and close the file. Records added afterwards are dropped.
+        """
+        with self.condition:
+            if (self.closed):
+                return
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.file.close()
+
+    def run(self) -> None:
+        """
+        Write the buffered records until the log is closed. Runs on the background thread.
+        """
+        while True:
+            with self.condition:
+                while (len(self.records) < self.flushSize and not self.closed and self.requested == self.written):
+                    if (not self.condition.wait(self.flushInterval)):
+                        break
+                records = self.records
+                self.records = []
+                requested = self.requested
+                closed = self.closed
+            if (len(records) > 0):
+                self.file.write(''.join(self.formatRecord(*record) for record in records))
+                self.file.flush()
+            with self.condition:
+                self.written = requested
+                self.condition.notify_all()
+            if (closed):
+                return
+
+    def formatRecord(self, created: float, level: int, message: str, fields: dict[str, any]) -> str:
+        """
+        Returns the line written to the file for a record.
+        """
+        timestamp = datetime.datetime.fromtimestamp(created)
+        if (self.logFormat == 'json'):
+            record = {'time':timestamp.isoformat(timespec='milliseconds'), 'level':LEVEL_NAMES.get(level, str(level)), 'message':message}
+            record.update(fields)
+            return json.dumps(record, default=str) + '\n'
+        line = f"[{timestamp.strftime('%Y-%m-%d %H:%M:%S')}]"
+        if (fields.get('profile') != None):
+            line += f" [{fields.get('profile')}]"
+        if (level != INFO):
+            line += f" {LEVEL_NAMES.get(level, str(level))}:"
+        return f"{line} {message}\n"
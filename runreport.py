@@ -0,0 +1,281 @@
+import datetime
+import json
+import os
+import sys
+import time
+from typing import Iterable, Iterator
+
+# resource is only available on Unix systems
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# counters read from /proc/self/io, see proc(5)
+IO_COUNTERS = ['rchar', 'wchar', 'syscr', 'syscw', 'read_bytes', 'write_bytes']
+
+def peakRss() -> int:
+    """
+    Returns the largest resident set size of the process so far in bytes, or
+    None if it is not available.
+    """
+    if (resource == None):
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+class PhaseStats:
+    """
+    ## PhaseStats
+    The PhaseStats class adds up what one phase of a backup took.
+    """
+    __slots__ = ('wallTime', 'files', 'size', 'io', 'peakRss')
+
+    def __init__(self):
+        self.wallTime = 0.0
+        self.files = 0
+        self.size = 0
+        self.io = None
+        self.peakRss = None
+
+    def toDict(self) -> dict[str, any]:
+        """
+        Returns the statistics as they are written to the report.
+        """
+        returnMap = {
+            'wallTime': round(self.wallTime, 6),
+            'files': self.files,
+            'bytes': self.size,
+            'filesPerSecond': round(self.files / self.wallTime, 3) if self.wallTime > 0 else None,
+            'bytesPerSecond': round(self.size / self.wallTime, 3) if self.wallTime > 0 else None,
+            'syscalls': None,
+            'io': self.io,
+            'peakRss': self.peakRss
+        }
+        if (self.io != None):
+            returnMap.update({'syscalls': {'read': self.io.get('syscr'), 'write': self.io.get('syscw')}})
+        return returnMap
+
+class RunReport:
+    """
+    ## RunReport
+    The RunReport class measures the phases of a backup (index load, scan, diff,
+    move, copy, ...) and writes them to a JSON report next to the index, one
+    file per run.
+
+    For every phase it records the wall time, the files and bytes handled, the
+    read and write syscalls and bytes from `/proc/self/io` (Linux only), and the
+    peak resident set size of the process once the phase ended. Phases may be
+    nested, the time and I/O of an inner phase are not counted for the outer
+    one. The I/O counters are those of the whole process, so while several
+    profiles run at the same time they include the other profiles.
+    """
+    def __init__(self, profileName: str):
+        """
+        @type profileName: str
+        @param profileName: Name of the profile being backed up.
+        """
+        self.profileName = profileName
+        self.started = time.time()
+        self.startedClock = time.perf_counter()
+        self.phases = {}
+        # open phases: [name, start time, start I/O counters, own reads before it, time of inner phases, I/O of inner phases]
+        self.stack = []
+        self.summary = {}
+        # reads of the I/O counters so far and their bytes, left out of the counters
+        self.ioReads = 0
+        self.ioReadBytes = 0
+        try:
+            self.ioFile = os.open('/proc/self/io', os.O_RDONLY)
+        except OSError:
+            self.ioFile = None
+
+    def readIo(self) -> dict[str, int]:
+        """
+        Returns the I/O counters of the process, or None if they are not available.
+        """
+        if (self.ioFile == None):
+            return None
+        try:
+            data = os.pread(self.ioFile, 4096, 0)
+        except OSError:
+            return None
+        self.ioReads += 1
+        self.ioReadBytes += len(data)
+        counters = {}
+        for line in data.decode('ascii', 'replace').splitlines():
+            key, _, value = line.partition(':')
+            if (key in IO_COUNTERS):
+                counters.update({key:int(value)})
+        return counters
+
+    def getPhase(self, name: str) -> PhaseStats:
+        """
+        Returns the statistics of a phase, adding the phase if it is new.
+
+        @type name: str
+        @param name: Name of the phase.
+        """
+        phase = self.phases.get(name)
+        if (phase == None):
+            phase = PhaseStats()
+            self.phases.update({name:phase})
+        return phase
+
+    def start(self, name: str) -> None:
+        """
+        Start measuring a phase. Every `start` must be followed by a `stop`.
+
+        @type name: str
+        @param name: Name of the phase.
+        """
+        ownReads = (self.ioReads, self.ioReadBytes)
+        startIo = self.readIo()
+        self.stack.append([name, time.perf_counter(), startIo, ownReads, 0.0, {}])
+
+    def stop(self, files: int = 0, size: int = 0) -> None:
+        """
+        Stop measuring the most recently started phase.
+
+        @type files: int
+        @param files: Number of files the phase handled.
+            (default is 0)
+        @type size: int
+        @param size: Number of bytes the phase handled.
+            (default is 0)
+        """
+        elapsed = time.perf_counter()
+        ownReads = (self.ioReads, self.ioReadBytes)
+        endIo = self.readIo()
+        name, startTime, startIo, startReads, innerTime, innerIo = self.stack.pop()
+        elapsed -= startTime
+        phase = self.getPhase(name)
+        phase.wallTime += elapsed - innerTime
+        phase.files += files
+        phase.size += size
+        phase.peakRss = peakRss()
+        ioDelta = None
+        if (startIo != None and endIo != None):
+            ioDelta = {key:endIo.get(key, 0) - startIo.get(key, 0) for key in IO_COUNTERS}
+            # the counters include the reads of themselves made since the start
+            ioDelta.update({'syscr':ioDelta.get('syscr') - (ownReads[0] - startReads[0])})
+            ioDelta.update({'rchar':ioDelta.get('rchar') - (ownReads[1] - startReads[1])})
+            if (phase.io == None):
+                phase.io = {key:0 for key in IO_COUNTERS}
+            for key in IO_COUNTERS:
+                phase.io[key] += ioDelta.get(key) - innerIo.get(key, 0)
+        if (len(self.stack) > 0):
+            parent = self.stack[-1]
+            parent[4] += elapsed
+            if (ioDelta != None):
+                for key in IO_COUNTERS:
+                    parent[5].update({key:parent[5].get(key, 0) + ioDelta.get(key)})
+
+    def count(self, name: str, files: int = 0, size: int = 0) -> None:
+        """
+        Add files and bytes to a phase after it was measured.
+
+        @type name: str
+        @param name: Name of the phase.
+        @type files: int
+        @param files: Number of files.
+            (default is 0)
+        @type size: int
+        @param size: Number of bytes.
+            (default is 0)
+        """
+        phase = self.getPhase(name)
+        phase.files += files
+        phase.size += size
+
+    def timeIterator(self, name: str, iterable: Iterable[any]) -> Iterator[any]:
+        """
+        Yields the items of an iterable, measuring the time spent producing
+        them as a phase. Used for the scan, whose directories are compared
+        with the index while the scan goes on.
+
+        @type name: str
+        @param name: Name of the phase.
+        @type iterable: Iterable[any]
+        @param iterable: Iterable to measure.
+        """
+        iterator = iter(iterable)
+        while True:
+            self.start(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.stop()
+                return
+            except:
+                self.stop()
+                raise
+            self.stop()
+            yield item
+
+    def setSummary(self, **values: any) -> None:
+        """
+        Set totals of the run written at the top of the report.
+
+        @type values: any
+        @param values: Totals such as `files`, `directories` and `bytes`.
+        """
+        self.summary.update(values)
+
+    def toDict(self) -> dict[str, any]:
+        """
+        Returns the report as it is written to the file.
+        """
+        returnMap = {
+            'profile': self.profileName,
+            'started': datetime.datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'wallTime': round(time.perf_counter() - self.startedClock, 6),
+            'peakRss': peakRss()
+        }
+        returnMap.update(self.summary)
+        returnMap.update({'phases': {name:phase.toDict() for name, phase in self.phases.items()}})
+        return returnMap
+
+    def formatPhases(self) -> str:
+        """
+        Returns a one line summary of the phase times for the log.
+        """
+        return ', '.join(f"{name} {round(phase.wallTime, 3)}s" for name, phase in self.phases.items())
+
+    def write(self, indexPath: str) -> str:
+        """
+        Write the report to the reports directory of the profile and return its path.
+
+        @type indexPath: str
+        @param indexPath: Path to the index file of the profile.
+        """
+        reportDir = reportsPath(indexPath)
+        os.makedirs(reportDir, exist_ok=True)
+        name = datetime.datetime.fromtimestamp(self.started).strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(reportDir, f"{name}.json")
+        suffix = 1
+        while (os.path.exists(path)):
+            path = os.path.join(reportDir, f"{name}-{suffix}.json")
+            suffix += 1
+        with open(path,'w') as reportFile:
+            json.dump(self.toDict(), reportFile, indent=2)
+            reportFile.write('\n')
+        return path
+
+    def close(self) -> None:
+        """
+        Close the I/O counters file.
+        """
+        if (self.ioFile != None):
+            os.close(self.ioFile)
+            self.ioFile = None
+
+def reportsPath(indexPath: str) -> str:
+    """
+    Returns the directory holding the run reports of a profile.
+
+    @type indexPath: str
+    @param indexPath: Path to the index file of the profile.
+    """
+    return indexPath + '.reports'
@@ -0,0 +1,326 @@
+import concurrent.futures
+import os
+from typing import Callable, Iterator
+
+from file import formatIndexLine
+from rules import RuleSet, relativePath
+from throttle import Throttle
+
+class ScanEntry:
+    """
+    ## ScanEntry
+    The ScanEntry class is a lightweight record of a file found while scanning
+    the source directory. It is built straight from an `os.scandir` entry, so
+    unlike File it does not resolve or stat the path again.
+    """
+    __slots__ = ('real_path', 'stored_path', 'st_ino', 'st_dev', 'st_size', 'st_mtime_ns', 'st_nlink')
+
+    def __init__(self, real_path: str, stored_path: str, stats: os.stat_result):
+        """
+        @type real_path: str
+        @param real_path: Path of the file in the source directory.
+        @type stored_path: str
+        @param stored_path: Path the file is stored at in the backup.
+        @type stats: os.stat_result
+        @param stats: Stats of the file, as returned by `os.DirEntry.stat()`.
+        """
+        self.real_path = real_path
+        self.stored_path = stored_path
+        self.st_ino = stats.st_ino
+        self.st_dev = stats.st_dev
+        self.st_size = stats.st_size
+        self.st_mtime_ns = stats.st_mtime_ns
+        self.st_nlink = stats.st_nlink
+
+    def getIndexPrint(self) -> str:
+        """
+        Return string containing all necessary data for writing to the index file.
+        """
+        return formatIndexLine(self.st_ino, self.st_mtime_ns, self.real_path, self.stored_path)
+
+class ScanDir:
+    """
+    ## ScanDir
+    The ScanDir class holds the files found in a single directory while scanning
+    the source directory. A directory that was trusted to be unchanged (see
+    `scanTree`) is not listed, it only holds the child directories recorded
+    in the index.
+    """
+    __slots__ = ('path', 'files', 'subdirs', 'st_mtime_ns', 'childCount', 'complete', 'trusted')
+
+    def __init__(self, path: str):
+        """
+        @type path: str
+        @param path: Path of the directory in the source directory.
+        """
+        self.path = path
+        self.files = []
+        self.subdirs = []
+        # modification time taken before the directory was listed, -1 if unknown
+        self.st_mtime_ns = -1
+        # number of files and directories listed
+        self.childCount = 0
+        # false if any entry of the directory could not be read
+        self.complete = True
+        self.trusted = False
+
+def scanDirectory(path: str, originalPath: str, backupPath: str, onError: Callable[[str, OSError], None] = None, rules: RuleSet = None, throttle: Throttle = None) -> ScanDir:
+    """
+    List a single directory and return a ScanDir with its files and the paths
+    of its child directories. Symbolic links to directories are not followed.
+    Files and child directories excluded by the rules are left out, so the
+    subtree of an excluded directory is never walked.
+
+    @type path: str
+    @param path: Path of the directory to list.
+    @type originalPath: str
+    @param originalPath: Resolved original path of the profile.
+    @type backupPath: str
+    @param backupPath: Resolved backup path of the profile.
+    @type onError: Callable[[str, OSError], None]
+    @param onError: Called with the path and the error when an entry cannot be read.
+        (default is None)
+    @type rules: RuleSet
+    @param rules: Include and exclude rules of the profile.
+        (default is None, everything is included)
+    @type throttle: Throttle
+    @param throttle: Limits the listing and the stats of the files are made within.
+        (default is None, no limits)
+    """
+    scanDir = ScanDir(path)
+    if (throttle != None):
+        throttle.file()
+    if (rules != None):
+        relativeDir = relativePath(path, originalPath)
+        relativeDir = relativeDir + '/' if relativeDir != '' else ''
+    try:
+        entries = os.scandir(path)
+    except OSError as error:
+        if (onError != None):
+            onError(path, error)
+        scanDir.complete = False
+        return scanDir
+
+    with entries:
+        for entry in entries:
+            try:
+                if (entry.is_dir()):
+                    if (not entry.is_symlink() and (rules == None or rules.includesDir(relativeDir + entry.name, entry.name))):
+                        scanDir.subdirs.append(entry.path)
+                    continue
+                if (not entry.is_file()):
+                    if (entry.is_symlink()):
+                        raise FileNotFoundError(entry.path)
+                    continue
+                stats = entry.stat() if throttle == None else throttle.stat(entry)
+                if (rules != None and not rules.includesFile(relativeDir + entry.name, entry.name, stats)):
+                    continue
+                storedPath = backupPath + entry.path[len(originalPath):]
+                scanDir.files.append(ScanEntry(entry.path, storedPath, stats))
+            except OSError as error:
+                if (onError != None):
+                    onError(entry.path, error)
+                scanDir.complete = False
+
+    scanDir.childCount = len(scanDir.files) + len(scanDir.subdirs)
+    return scanDir
+
+def scanOrTrustDirectory(path: str, originalPath: str, backupPath: str, onError: Callable[[str, OSError], None], unchangedDir: Callable[[str, int], list[str]], rules: RuleSet = None, throttle: Throttle = None) -> ScanDir:
+    """
+    List a single directory like `scanDirectory`, unless `unchangedDir` trusts
+    it to be unchanged since the last run. The modification time of the
+    directory is taken before it is listed and kept in the returned ScanDir.
+
+    @type path: str
+    @param path: Path of the directory to list.
+    @type originalPath: str
+    @param originalPath: Resolved original path of the profile.
+    @type backupPath: str
+    @param backupPath: Resolved backup path of the profile.
+    @type onError: Callable[[str, OSError], None]
+    @param onError: Called with the path and the error when an entry cannot be read.
+    @type unchangedDir: Callable[[str, int], list[str]]
+    @param unchangedDir: Called with the path and modification time of the directory,
+        returns its recorded child directories if it is unchanged, or None. If None
+        is passed instead, every directory is listed.
+    @type rules: RuleSet
+    @param rules: Include and exclude rules of the profile.
+        (default is None, everything is included)
+    @type throttle: Throttle
+    @param throttle: Limits the directory is listed within.
+        (default is None, no limits)
+    """
+    if (unchangedDir == None):
+        return scanDirectory(path, originalPath, backupPath, onError, rules, throttle)
+    try:
+        st_mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return scanDirectory(path, originalPath, backupPath, onError, rules, throttle)
+    subdirs = unchangedDir(path, st_mtime_ns)
+    if (subdirs != None):
+        scanDir = ScanDir(path)
+        # the rules may have changed since the child directories were recorded
+        if (rules != None):
+            subdirs = [subdir for subdir in subdirs if rules.includesDir(relativePath(subdir, originalPath), os.path.basename(subdir))]
+        scanDir.subdirs = list(subdirs)
+        scanDir.childCount = -1
+        scanDir.trusted = True
+    else:
+        scanDir = scanDirectory(path, originalPath, backupPath, onError, rules, throttle)
+    scanDir.st_mtime_ns = st_mtime_ns
+    return scanDir
+
+def scanTree(originalPath: str, backupPath: str, rules: RuleSet = None, onError: Callable[[str, OSError], None] = None, workers: int = 1, unchangedDir: Callable[[str, int], list[str]] = None, startPaths: list[str] = None, throttle: Throttle = None) -> Iterator[ScanDir]:
+    """
+    Walk through the source directory and yield a ScanDir for every directory
+    that is not excluded by the rules. With more than one worker, independent directories
+    are listed at the same time (see `parallelScanTree`).
+
+    If `unchangedDir` is given, every directory is checked with it before it is
+    listed. Directories it trusts are not listed, and the walk continues into
+    the child directories it returns (see `scanOrTrustDirectory`).
+
+    @type originalPath: str
+    @param originalPath: Original path of the profile (source directory).
+    @type backupPath: str
+    @param backupPath: Backup path of the profile (destination directory).
+    @type rules: RuleSet
+    @param rules: Include and exclude rules of the profile.
+        (default is None, everything is included)
+    @type onError: Callable[[str, OSError], None]
+    @param onError: Called with the path and the error when an entry cannot be read.
+        (default is None)
+    @type workers: int
+    @param workers: Number of directories listed at the same time.
+        (default is 1)
+    @type unchangedDir: Callable[[str, int], list[str]]
+    @param unchangedDir: Called with the path and modification time of a directory,
+        returns its recorded child directories if it is unchanged, or None.
+        (default is None, every directory is listed)
+    @type startPaths: list[str]
+    @param startPaths: Directories inside the source directory to walk instead of all of it.
+        (default is None, the whole source directory is walked)
+    @type throttle: Throttle
+    @param throttle: Limits the directories are listed within.
+        (default is None, no limits)
+    """
+    originalPath = os.path.realpath(originalPath)
+    backupPath = os.path.realpath(backupPath)
+    if (startPaths == None):
+        startPaths = [originalPath]
+    elif (rules != None):
+        startPaths = [startPath for startPath in startPaths if rules.includesPath(startPath, originalPath)]
+    if (workers > 1):
+        yield from parallelScanTree(originalPath, backupPath, rules, onError, workers, unchangedDir, startPaths, throttle)
+        return
+
+    stack = list(reversed(startPaths))
+    while (len(stack) > 0):
+        dirpath = stack.pop()
+        scanDir = scanOrTrustDirectory(dirpath, originalPath, backupPath, onError, unchangedDir, rules, throttle)
+        # reversed, so child directories are walked in listing order
+        stack.extend(reversed(scanDir.subdirs))
+        yield scanDir
+
+def parallelScanTree(originalPath: str, backupPath: str, rules: RuleSet, onError: Callable[[str, OSError], None], workers: int, unchangedDir: Callable[[str, int], list[str]] = None, startPaths: list[str] = None, throttle: Throttle = None) -> Iterator[ScanDir]:
+    """
+    Walk through the source directory with a pool of worker threads, each listing
+    one directory at a time, and yield a ScanDir for every directory that is not
+    excluded by the rules. Directories are yielded in the order their listing completes.
+
+    At most two listings per worker are queued at once. Child directories wait
+    in a stack until a worker is free, so the walk stays depth first and the
+    number of results held in memory stays bounded.
+
+    @type originalPath: str
+    @param originalPath: Resolved original path of the profile.
+    @type backupPath: str
+    @param backupPath: Resolved backup path of the profile.
+    @type rules: RuleSet
+    @param rules: Include and exclude rules of the profile, or None.
+    @type onError: Callable[[str, OSError], None]
+    @param onError: Called with the path and the error when an entry cannot be read.
+    @type workers: int
+    @param workers: Number of directories listed at the same time.
+    @type unchangedDir: Callable[[str, int], list[str]]
+    @param unchangedDir: Called with the path and modification time of a directory,
+        returns its recorded child directories if it is unchanged, or None.
+        (default is None, every directory is listed)
+    @type startPaths: list[str]
+    @param startPaths: Directories inside the source directory to walk instead of all of it.
+        (default is None, the whole source directory is walked)
+    @type throttle: Throttle
+    @param throttle: Limits the directories are listed within.
+        (default is None, no limits)
+    """
+    maxPending = workers * 2
+    if (startPaths == None):
+        startPaths = [originalPath]
+    stack = list(reversed(startPaths))
+    pending = set()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while (len(stack) > 0 or len(pending) > 0):
+            while (len(stack) > 0 and len(pending) < maxPending):
+                dirpath = stack.pop()
+                pending.add(executor.submit(scanOrTrustDirectory, dirpath, originalPath, backupPath, onError, unchangedDir, rules, throttle))
+            if (len(pending) == 0):
+                continue
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                scanDir = future.result()
+                stack.extend(reversed(scanDir.subdirs))
+                yield scanDir
+
+def scanChanges(originalPath: str, backupPath: str, rules: RuleSet, unchangedDirs: list[str], changedDirs: list[str], changedTrees: list[str], onError: Callable[[str, OSError], None] = None, workers: int = 1, throttle: Throttle = None) -> Iterator[ScanDir]:
+    """
+    Yield ScanDirs for a backup driven by the change journal instead of a walk
+    of the whole source directory. Unchanged directories are yielded as trusted
+    without touching them, changed directories are listed without walking into
+    their child directories, and changed trees are walked as a whole.
+
+    @type originalPath: str
+    @param originalPath: Original path of the profile (source directory).
+    @type backupPath: str
+    @param backupPath: Backup path of the profile (destination directory).
+    @type rules: RuleSet
+    @param rules: Include and exclude rules of the profile, or None.
+    @type unchangedDirs: list[str]
+    @param unchangedDirs: Directories whose index entries are kept as they are.
+    @type changedDirs: list[str]
+    @param changedDirs: Directories whose files are listed again.
+    @type changedTrees: list[str]
+    @param changedTrees: Directories that are walked as a whole.
+    @type onError: Callable[[str, OSError], None]
+    @param onError: Called with the path and the error when an entry cannot be read.
+        (default is None)
+    @type workers: int
+    @param workers: Number of directories listed at the same time while walking changed trees.
+        (default is 1)
+    @type throttle: Throttle
+    @param throttle: Limits the directories are listed within.
+        (default is None, no limits)
+    """
+    for directory in unchangedDirs:
+        scanDir = ScanDir(directory)
+        scanDir.childCount = -1
+        scanDir.trusted = True
+        yield scanDir
+
+    originalPath = os.path.realpath(originalPath)
+    backupPath = os.path.realpath(backupPath)
+    for directory in changedDirs:
+        # directories that went away since are handled by their parent
+        if ((rules != None and not rules.includesPath(directory, originalPath)) or not os.path.isdir(directory)):
+            continue
+        try:
+            st_mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            st_mtime_ns = -1
+        scanDir = scanDirectory(directory, originalPath, backupPath, onError, rules, throttle)
+        scanDir.st_mtime_ns = st_mtime_ns
+        yield scanDir
+
+    trees = [tree for tree in changedTrees if os.path.isdir(tree)]
+    if (len(trees) > 0):
+        yield from scanTree(originalPath, backupPath, rules, onError, workers, startPaths=trees, throttle=throttle)
@@ -0,0 +1,80 @@
+import concurrent.futures
+import os
+from typing import Callable
+
+def physicalDevice(st_dev: int) -> str:
+    """
+    Returns a name for the physical disk holding a file system. On Linux the
+    partitions of one disk are mapped to the disk itself through sysfs, so two
+    profiles on different partitions of the same disk still share a device.
+    Elsewhere, or if sysfs has no entry, the file system device number is used.
+
+    @type st_dev: int
+    @param st_dev: Device number of the file system (`os.stat().st_dev`).
+    """
+    sysPath = f"/sys/dev/block/{os.major(st_dev)}:{os.minor(st_dev)}"
+    try:
+        devicePath = os.path.realpath(sysPath)
+        if (os.path.exists(os.path.join(devicePath, 'partition'))):
+            devicePath = os.path.dirname(devicePath)
+        if (os.path.exists(devicePath)):
+            return os.path.basename(devicePath)
+    except OSError:
+        pass
+    return str(st_dev)
+
+def profileDevices(profile: any) -> set[str]:
+    """
+    Returns the devices a profile reads from and writes to: those of its
+    original path and its backup path. A path that cannot be read is
+    identified by the path itself.
+
+    @type profile: Profile
+    @param profile: The profile.
+    """
+    devices = set()
+    for path in [profile.getOriginalPath(), profile.getBackupPath()]:
+        try:
+            devices.add(physicalDevice(os.stat(path).st_dev))
+        except OSError:
+            devices.add(os.path.realpath(path))
+    return devices
+
+def scheduleProfiles(profiles: list[any], runProfile: Callable[[any], None], workers: int = 1) -> None:
+    """
+    Run every profile with `runProfile`, running up to `workers` profiles at
+    the same time. Profiles that share a device (see `profileDevices`) never
+    run at the same time. Profiles are started in the given order, except that
+    a profile whose devices are busy lets later profiles go first.
+
+    @type profiles: list[Profile]
+    @param profiles: Profiles to run.
+    @type runProfile: Callable[[Profile], None]
+    @param runProfile: Runs the backup of a single profile. Called on a worker thread
+        when more than one worker is used.
+    @type workers: int
+    @param workers: Number of profiles run at the same time.
+        (default is 1)
+    """
+    if (workers <= 1 or len(profiles) <= 1):
+        for profile in profiles:
+            runProfile(profile)
+        return
+
+    waiting = [(profile, profileDevices(profile)) for profile in profiles]
+    busyDevices = set()
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while (len(waiting) > 0 or len(running) > 0):
+            for profile, devices in list(waiting):
+                if (len(running) >= workers):
+                    break
+                if (len(devices & busyDevices) > 0):
+                    continue
+                waiting.remove((profile, devices))
+                busyDevices.update(devices)
+                running.update({executor.submit(runProfile, profile):devices})
+            done, notDone = concurrent.futures.wait(list(running.keys()), return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                busyDevices.difference_update(running.pop(future))
+                future.result()
@@ -0,0 +1,242 @@
+import shutil
+import threading
+import time
+
+# reads at least this large are measured per megabyte, smaller reads and stats per call
+LARGE_READ = 256 * 1024
+# smoothing of the latency averages, and samples taken before the first adjustment
+SMOOTHING = 0.1
+WARMUP_SAMPLES = 32
+# the baseline rises towards the average by this share on every adjustment, so
+# a baseline taken from cached reads does not hold the backup back for good
+BASELINE_DRIFT = 0.01
+# the adaptive throttle backs off once latency is this many times its baseline,
+# and eases off again once latency is back below `RECOVER_RATIO` times the baseline
+BACKOFF_RATIO = 2.0
+RECOVER_RATIO = 1.25
+ADJUST_INTERVAL = 0.5
+MIN_PAUSE = 0.25
+MAX_PAUSE = 16.0
+
+class TokenBucket:
+    """
+    ## TokenBucket
+    The TokenBucket class limits a rate shared by several threads. Tokens
+    refill at `rate` per second, up to one second's worth. Taking more tokens
+    than are left puts the bucket in debt, and the taker sleeps until the debt
+    is paid off, so large requests are allowed but the rate holds on average.
+    """
+    def __init__(self, rate: float):
+        """
+        @type rate: float
+        @param rate: Tokens added per second.
+        """
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, amount: float) -> float:
+        """
+        Take tokens, sleeping while the bucket is in debt. Returns the seconds slept.
+
+        @type amount: float
+        @param amount: Number of tokens to take.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        # slept outside the lock, so other threads can queue up their own debt
+        if (wait > 0):
+            time.sleep(wait)
+        return wait
+
+class Latency:
+    """
+    ## Latency
+    The Latency class keeps a smoothed average of one kind of latency, and the
+    lowest average seen once warmed up, which serves as its baseline. Only
+    kinds sampled since the last adjustment count, so the average of a kind
+    that is no longer measured, such as stats once the scan is over, does
+    not hold the backup back.
+    """
+    def __init__(self):
+        self.average = None
+        self.baseline = None
+        self.samples = 0
+        # samples since the last call to `ratio`
+        self.recent = 0
+
+    def add(self, seconds: float) -> None:
+        self.samples += 1
+        self.recent += 1
+        self.average = seconds if self.average == None else self.average + SMOOTHING * (seconds - self.average)
+        if (self.samples >= WARMUP_SAMPLES and (self.baseline == None or self.average < self.baseline)):
+            self.baseline = self.average
+
+    def ratio(self) -> float:
+        """
+        Returns the average latency relative to the baseline, 1.0 until there
+        is one or if there was no sample since the last call, and lets the
+        baseline drift towards the average.
+        """
+        recent = self.recent
+        self.recent = 0
+        if (recent == 0 or self.baseline == None or self.baseline <= 0):
+            return 1.0
+        ratio = self.average / self.baseline
+        self.baseline += BASELINE_DRIFT * (self.average - self.baseline)
+        return ratio
+
+class Throttle:
+    """
+    ## Throttle
+    The Throttle class limits the disk use of a backup, so it can run next to
+    other work. Every file read, hashed or stat'ed by the scan and the copies
+    takes from a files per second bucket, and every byte read from a bytes per
+    second bucket. Both are shared by all worker threads.
+
+    In adaptive mode, the time of every read and stat is measured as well, as
+    latency per call for stats and small reads, and per megabyte for large
+    reads, each averaged on its own. Once any of them measured since the last
+    adjustment rises to `BACKOFF_RATIO` times its lowest average so far, every read and stat is followed by a pause of `pause`
+    times its own duration, which doubles while latency stays high and halves
+    once it is back to normal. The share of time the backup spends on the disk
+    then drops to `1 / (1 + pause)`, whatever limits are set.
+    """
+    def __init__(self, bytesPerSecond: int = 0, filesPerSecond: int = 0, adaptive: bool = False):
+        """
+        @type bytesPerSecond: int
+        @param bytesPerSecond: Bytes read per second.
+            (default is 0, no limit)
+        @type filesPerSecond: int
+        @param filesPerSecond: Files read or stat'ed per second.
+            (default is 0, no limit)
+        @type adaptive: bool
+        @param adaptive: Whether to back off when latency rises.
+            (default is False)
+        """
+        self.bytesBucket = TokenBucket(bytesPerSecond) if bytesPerSecond > 0 else None
+        self.filesBucket = TokenBucket(filesPerSecond) if filesPerSecond > 0 else None
+        self.adaptive = adaptive
+        self.lock = threading.Lock()
+        self.latencies = {'stat':Latency(), 'small':Latency(), 'large':Latency()}
+        self.pause = 0.0
+        self.lastAdjusted = time.monotonic()
+        # statistics for the log
+        self.waited = 0.0
+        self.backoffs = 0
+        self.maxPause = 0.0
+
+    def file(self) -> None:
+        """
+        Take a file from the files per second bucket, before a file is opened or stat'ed.
+        """
+        if (self.filesBucket != None):
+            self.addWaited(self.filesBucket.take(1))
+
+    def bytes(self, amount: int) -> None:
+        """
+        Take bytes from the bytes per second bucket, for reads that are not
+        made through `read`.
+
+        @type amount: int
+        @param amount: Number of bytes.
+        """
+        if (self.bytesBucket != None and amount > 0):
+            self.addWaited(self.bytesBucket.take(amount))
+
+    def read(self, sourceFile: any, size: int) -> bytes:
+        """
+        Read from a file within the limits, measuring the read in adaptive mode.
+
+        @type sourceFile: BinaryIO
+        @param sourceFile: File to read from.
+        @type size: int
+        @param size: Number of bytes to read.
+        """
+        if (not self.adaptive):
+            chunk = sourceFile.read(size)
+        else:
+            start = time.monotonic()
+            chunk = sourceFile.read(size)
+            elapsed = time.monotonic() - start
+            if (len(chunk) >= LARGE_READ):
+                self.observe('large', elapsed, elapsed * (1024 * 1024) / len(chunk))
+            elif (len(chunk) > 0):
+                self.observe('small', elapsed, elapsed)
+        self.bytes(len(chunk))
+        return chunk
+
+    def stat(self, entry: any) -> any:
+        """
+        Stat a directory entry within the limits, measuring the call in adaptive mode.
+
+        @type entry: os.DirEntry
+        @param entry: Entry to stat.
+        """
+        self.file()
+        if (not self.adaptive):
+            return entry.stat()
+        start = time.monotonic()
+        stats = entry.stat()
+        elapsed = time.monotonic() - start
+        self.observe('stat', elapsed, elapsed)
+        return stats
+
+    def observe(self, kind: str, elapsed: float, latency: float) -> None:
+        """
+        Add a measured read or stat to its latency average, adjust the pause
+        factor if it is time to, and pause.
+
+        @type kind: str
+        @param kind: Kind of call, `'stat'`, `'small'` or `'large'`.
+        @type elapsed: float
+        @param elapsed: Seconds the call took.
+        @type latency: float
+        @param latency: Latency of the call, in seconds per megabyte for large reads.
+        """
+        with self.lock:
+            self.latencies.get(kind).add(latency)
+            now = time.monotonic()
+            if (now - self.lastAdjusted >= ADJUST_INTERVAL):
+                self.lastAdjusted = now
+                ratio = max([latency.ratio() for latency in self.latencies.values()])
+                if (ratio >= BACKOFF_RATIO):
+                    self.pause = min(max(self.pause * 2, MIN_PAUSE), MAX_PAUSE)
+                    self.backoffs += 1
+                    self.maxPause = max(self.maxPause, self.pause)
+                elif (ratio < RECOVER_RATIO and self.pause > 0):
+                    self.pause = self.pause / 2 if self.pause > MIN_PAUSE else 0.0
+            pause = elapsed * self.pause
+        if (pause > 0):
+            time.sleep(pause)
+            self.addWaited(pause)
+
+    def addWaited(self, seconds: float) -> None:
+        if (seconds > 0):
+            with self.lock:
+                self.waited += seconds
+
+    def copyFile(self, source: str, destination: str, bufferSize: int = 1024 * 1024) -> None:
+        """
+        Copy a file and its stats like `shutil.copy2`, reading it within the limits.
+
+        @type source: str
+        @param source: Path of the file to copy.
+        @type destination: str
+        @param destination: Path to copy the file to.
+        @type bufferSize: int
+        @param bufferSize: Bytes read at a time.
+            (default is 1 MB)
+        """
+        with open(source,'rb') as sourceFile, open(destination,'wb') as destinationFile:
+            while True:
+                chunk = self.read(sourceFile, bufferSize)
+                if (not chunk):
+                    break
+                destinationFile.write(chunk)
+        shutil.copystat(source, destination)
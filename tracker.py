@@ -1,4 +1,5 @@
 import time
+import threading
 
 class Tracker:
     """
@@ -18,23 +19,25 @@ class Tracker:
             self.total = 1
         self.current = 0
         self.complete = False
+        self.lock = threading.Lock()
 
-    def progressBar(self, current: int, data: bool = False) -> None:
+    def progressBar(self, current: int = None, data: bool = False) -> None:
         """
         Print a dynamic progress bar to the terminal given the current completed
         value (out of the total).
 
         @type current: int
         @param current: The current completed position out of the total (5 out of 10 done).
+            (default is None, which uses the position accumulated with `addCurrent`)
         @type data: bool
         @param data: Whether `current` is a byte measurement or not. 
             (default is False)
         """
-        self.setCurrent(current)
+        if (current != None):
+            self.setCurrent(current)
         elapsedTime = time.time() - self.start
-        if (self.current == 0):
-            self.setCurrent(1)
-        progress = self.current / self.total
+        current = max(self.getCurrent(), 1)
+        progress = current / self.total
         estTotalTime = elapsedTime / progress
         estTimeLeft = estTotalTime - elapsedTime
         if (estTimeLeft > 60):
@@ -43,7 +46,7 @@ class Tracker:
             timeRemaining = f"Est Remaining: {max(round(estTimeLeft, 1),0)} sec"
         
         barLength = 30
-        filledLength = int(barLength * self.current / self.total)
+        filledLength = int(barLength * current / self.total)
         bar = ('=' * filledLength) + ' ' * (barLength - filledLength)
         if (self.complete and data == False):
             print(f"[{'=' * 30}] {self.total}/{self.total} (100.0%) {' ' * 25}")
@@ -51,10 +54,10 @@ class Tracker:
             correctUnit = self.getAppropriateUnit(self.total, self.total)
             print(f"[{'=' * 30}] {correctUnit} (100.0%) {' ' * 25}")
         elif (not self.complete and data == False):
-            print(f"[{bar}] {self.current}/{self.total} ({round((self.current/self.total) * 100,1)}%) {timeRemaining} {' ' * 25}", end='\r')
+            print(f"[{bar}] {current}/{self.total} ({round((current/self.total) * 100,1)}%) {timeRemaining} {' ' * 25}", end='\r')
         elif (not self.complete and data == True):
-            correctUnit = self.getAppropriateUnit(self.current, self.total)
-            print(f"[{bar}] {correctUnit} ({round((self.current/self.total) * 100,1)}%) {timeRemaining} {' ' * 25}", end='\r')
+            correctUnit = self.getAppropriateUnit(current, self.total)
+            print(f"[{bar}] {correctUnit} ({round((current/self.total) * 100,1)}%) {timeRemaining} {' ' * 25}", end='\r')
 
     def setCurrent(self, current: int) -> None:
         """
@@ -63,7 +66,27 @@ class Tracker:
         @type current: int
         @param current: Current position in total (5 out of 10 done).
         """
-        self.current = current
+        with self.lock:
+            self.current = current
+
+    def addCurrent(self, amount: int) -> int:
+        """
+        Add to the current position of tracking and return the new position.
+        Safe to call from multiple worker threads.
+
+        @type amount: int
+        @param amount: Amount to add to the current position.
+        """
+        with self.lock:
+            self.current += amount
+            return self.current
+
+    def getCurrent(self) -> int:
+        """
+        Returns the current position of tracking (out of the total).
+        """
+        with self.lock:
+            return self.current
 
     def setComplete(self) -> None:
         """
@@ -0,0 +1,300 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from driver import readPreferences, readProfiles
+from journal import JOURNAL_CHANGED, JOURNAL_OVERFLOW, JOURNAL_REMOVED, JOURNAL_START, JOURNAL_TREE, formatRecord, journalPath
+
+# inotify constants (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+EVENT_HEADER = struct.Struct('iIII') # watch descriptor, mask, cookie, name length
+
+# journaled changes are collected for this many seconds before they are written,
+# so a file written in many small pieces is only journaled once
+FLUSH_INTERVAL = 1.0
+# a journal larger than this is started over, which makes the next backup a full scan
+JOURNAL_MAX_SIZE = 64 * 1024 * 1024
+
+class Inotify:
+    """
+    ## Inotify
+    The Inotify class is a small ctypes wrapper around the Linux inotify API.
+    """
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if (self.fd < 0):
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+
+    def addWatch(self, path: str, mask: int) -> int:
+        """
+        Watch a directory and return the watch descriptor.
+
+        @type path: str
+        @param path: Path of the directory.
+        @type mask: int
+        @param mask: Events to watch for.
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if (wd < 0):
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), path)
+        return wd
+
+    def removeWatch(self, wd: int) -> None:
+        """
+        Stop watching a directory.
+
+        @type wd: int
+        @param wd: Watch descriptor of the directory.
+        """
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def readEvents(self, timeout: float) -> list[tuple[int, int, str]]:
+        """
+        Returns the `(wd, mask, name)` of every event available within the timeout.
+
+        @type timeout: float
+        @param timeout: Seconds to wait for an event.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if (len(readable) == 0):
+            return []
+        data = os.read(self.fd, 256 * 1024)
+        events = []
+        offset = 0
+        while (offset + EVENT_HEADER.size <= len(data)):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+class ProfileWatch:
+    """
+    ## ProfileWatch
+    The ProfileWatch class keeps the change journal of one profile open for appending.
+    """
+    def __init__(self, profile: any):
+        """
+        @type profile: Profile
+        @param profile: The watched profile.
+        """
+        self.profile = profile
+        self.root = os.path.realpath(profile.getOriginalPath())
+        self.rules = profile.getRules()
+        self.path = journalPath(profile.getIndexPath())
+        self.file = open(self.path, 'ab', buffering=0)
+        self.pending = []
+        self.pendingSet = set()
+
+    def record(self, kind: str, path: str = '') -> None:
+        """
+        Queue a journal record, unless the same record is already queued.
+
+        @type kind: str
+        @param kind: Kind of the record.
+        @type path: str
+        @param path: Path the record is about.
+        """
+        if ((kind, path) not in self.pendingSet):
+            self.pendingSet.add((kind, path))
+            self.pending.append(formatRecord(kind, path))
+
+    def flush(self) -> None:
+        """
+        Append the queued records to the journal and sync it to disk, starting
+        a new journal first if it grew too large.
+        """
+        if (len(self.pending) == 0):
+            return
+        if (os.fstat(self.file.fileno()).st_size > JOURNAL_MAX_SIZE):
+            self.file.close()
+            os.replace(self.path, self.path + '.old')
+            self.file = open(self.path, 'ab', buffering=0)
+            self.pending.insert(0, formatRecord(JOURNAL_START))
+        # a single append, so a backup never reads half of a batch
+        self.file.write(b''.join(self.pending))
+        os.fsync(self.file.fileno())
+        self.pending = []
+        self.pendingSet = set()
+
+class Watcher:
+    """
+    ## Watcher
+    The Watcher class watches the original path of every executable profile with
+    inotify and appends the changes to the change journal of the profile, where
+    the next backup picks them up (see `journal.readChanges`).
+    """
+    def __init__(self, profiles: list[any]):
+        """
+        @type profiles: list[Profile]
+        @param profiles: Profiles to watch.
+        """
+        self.inotify = Inotify()
+        self.profiles = [ProfileWatch(profile) for profile in profiles]
+        # watch descriptor to (profile, directory path)
+        self.watches = {}
+        self.paths = {}
+
+    def watchTree(self, profileWatch: ProfileWatch, top: str) -> None:
+        """
+        Watch a directory and every directory inside of it. If a watch cannot be
+        added, events may be lost, so an overflow is journaled.
+
+        @type profileWatch: ProfileWatch
+        @param profileWatch: Profile the directory belongs to.
+        @type top: str
+        @param top: Path of the directory.
+        """
+        stack = [top]
+        while (len(stack) > 0):
+            directory = stack.pop()
+            if (profileWatch.rules != None and not profileWatch.rules.includesPath(directory, profileWatch.root)):
+                continue
+            try:
+                wd = self.inotify.addWatch(directory, WATCH_MASK)
+            except OSError as error:
+                if (error.errno == errno.ENOSPC):
+                    print('Error: The inotify watch limit was reached (see /proc/sys/fs/inotify/max_user_watches).')
+                if (error.errno != errno.ENOENT):
+                    profileWatch.record(JOURNAL_OVERFLOW)
+                continue
+            self.watches.update({wd:(profileWatch, directory)})
+            self.paths.update({(id(profileWatch), directory):wd})
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if (entry.is_dir(follow_symlinks=False)):
+                            stack.append(entry.path)
+            except OSError:
+                continue
+
+    def unwatchTree(self, profileWatch: ProfileWatch, top: str) -> None:
+        """
+        Stop watching a directory and every directory inside of it.
+
+        @type profileWatch: ProfileWatch
+        @param profileWatch: Profile the directory belongs to.
+        @type top: str
+        @param top: Path of the directory.
+        """
+        for key, wd in list(self.paths.items()):
+            profileId, directory = key
+            if (profileId == id(profileWatch) and (directory == top or directory.startswith(top + os.sep))):
+                self.paths.pop(key)
+                self.watches.pop(wd, None)
+                self.inotify.removeWatch(wd)
+
+    def handleEvent(self, wd: int, mask: int, name: str) -> None:
+        """
+        Journal a single inotify event.
+
+        @type wd: int
+        @param wd: Watch descriptor of the directory the event happened in.
+        @type mask: int
+        @param mask: Event flags.
+        @type name: str
+        @param name: Name of the file or directory inside the watched directory.
+        """
+        if (mask & IN_Q_OVERFLOW):
+            for profileWatch in self.profiles:
+                profileWatch.record(JOURNAL_OVERFLOW)
+            return
+        watch = self.watches.get(wd)
+        if (watch == None):
+            return
+        profileWatch, directory = watch
+        if (mask & IN_IGNORED):
+            self.watches.pop(wd, None)
+            self.paths.pop((id(profileWatch), directory), None)
+            return
+        if (mask & (IN_DELETE_SELF | IN_MOVE_SELF)):
+            if (directory == profileWatch.root):
+                profileWatch.record(JOURNAL_OVERFLOW)
+            return
+        path = os.path.join(directory, name)
+        if (mask & IN_ISDIR):
+            if (mask & (IN_CREATE | IN_MOVED_TO)):
+                self.watchTree(profileWatch, path)
+                profileWatch.record(JOURNAL_TREE, path)
+            elif (mask & (IN_DELETE | IN_MOVED_FROM)):
+                self.unwatchTree(profileWatch, path)
+                profileWatch.record(JOURNAL_REMOVED, path)
+        profileWatch.record(JOURNAL_CHANGED, directory)
+
+    def run(self) -> None:
+        """
+        Watch the profiles until interrupted. The start of the watch is journaled
+        once every directory is watched, so the next backup scans everything.
+        """
+        for profileWatch in self.profiles:
+            self.watchTree(profileWatch, profileWatch.root)
+            profileWatch.record(JOURNAL_START)
+            profileWatch.flush()
+        print(f"Watching {len(self.watches)} directories...")
+        lastFlush = time.monotonic()
+        try:
+            while True:
+                for wd, mask, name in self.inotify.readEvents(FLUSH_INTERVAL):
+                    self.handleEvent(wd, mask, name)
+                if (time.monotonic() - lastFlush >= FLUSH_INTERVAL):
+                    for profileWatch in self.profiles:
+                        profileWatch.flush()
+                    lastFlush = time.monotonic()
+        finally:
+            for profileWatch in self.profiles:
+                profileWatch.flush()
+                profileWatch.file.close()
+            self.inotify.close()
+
+def main() -> None:
+    if (not sys.platform.startswith('linux')):
+        print('Error: The watcher needs Linux (inotify).')
+        exit()
+    try:
+        prefs = readPreferences('preferences.txt')
+    except FileNotFoundError:
+        print('Error reading preferences.txt. May be missing or is named incorrectly.')
+        exit()
+    profiles = readProfiles(prefs.get('profiles'), prefs)
+    watched = [profile for profile in profiles.get('executable') if profile.getChangeJournal()]
+    if (len(watched) == 0):
+        print('No profile sets changeJournal=true, nothing to watch.')
+        exit()
+    try:
+        Watcher(watched).run()
+    except KeyboardInterrupt:
+        pass
+
+if (__name__ == '__main__'):
+    main()